@@ -0,0 +1,103 @@
+"""
+Benchmark of the plugin's cold start cost: importing it and loading a
+TiddlyWeb app with it, as happens on every request under CGI.
+
+Each run is a fresh Python process that imports tiddlyweb and then
+times importing the plugin and serve.load_app(). The same is done
+without the plugin, and the difference of the medians is the plugin's
+cost. It also lists modules imported by the plugin that it should only
+import when they are used.
+
+    python bench/bench_import.py [--runs N] [--budget MS]
+
+The exit status is 1 if the cost is over --budget milliseconds
+(default 20) or a deferred module was imported.
+"""
+import argparse
+import os
+import subprocess
+import sys
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# modules that loading the app with the plugin should not import
+DEFERRED = ['uuid', 'json', 'tiddlyweb.manage',
+        'tiddlywebplugins.form.commands', 'tiddlywebplugins.form.uploads',
+        'tiddlywebplugins.form.writebehind', 'tiddlywebplugins.form.images',
+        'tiddlywebplugins.form.idempotency', 'tiddlywebplugins.form.ratelimit',
+        'tiddlywebplugins.form.memprofile', 'tiddlywebplugins.form.blobs',
+        'tiddlywebplugins.form.digests', 'tiddlywebplugins.form.redirects',
+        'tiddlywebplugins.form.timing']
+
+CHILD = '''
+import sys, time
+sys.path.insert(0, %(root)r)
+import mangler
+from tiddlyweb.config import config
+from tiddlyweb.web import serve
+config['system_plugins'] = %(plugins)r
+start = time.time()
+for plugin in config['system_plugins']:
+    __import__(plugin)
+imported = time.time()
+serve.load_app()
+loaded = time.time()
+print('%%f %%f' %% (imported - start, loaded - imported))
+print(' '.join(name for name in %(deferred)r if name in sys.modules))
+'''
+
+
+def run_child(plugins):
+    """
+    Time one cold start, returning the import and load seconds and
+    the deferred modules that were imported.
+    """
+    output = subprocess.check_output([sys.executable, '-c', CHILD % {
+        'root': ROOT, 'plugins': plugins, 'deferred': DEFERRED}],
+        cwd=ROOT)
+    times, imported = output.split('\n')[:2]
+    import_time, load_time = [float(value) for value in times.split()]
+    return import_time, load_time, imported.split()
+
+
+def median(values):
+    values = sorted(values)
+    return values[len(values) // 2]
+
+
+def main(args):
+    parser = argparse.ArgumentParser(description='form cold start benchmark')
+    parser.add_argument('--runs', type=int, default=21)
+    parser.add_argument('--budget', type=float, default=20.0,
+            help='milliseconds the plugin may add to a cold start')
+    options = parser.parse_args(args)
+
+    baseline = [run_child([]) for _ in range(options.runs)]
+    plugin = [run_child(['tiddlywebplugins.form'])
+            for _ in range(options.runs)]
+
+    baseline_load = median([load for _, load, _ in baseline]) * 1000
+    plugin_import = median([imp for imp, _, _ in plugin]) * 1000
+    plugin_load = median([load for _, load, _ in plugin]) * 1000
+    cost = plugin_import + plugin_load - baseline_load
+    imported = sorted(set(name for _, _, names in plugin for name in names))
+
+    print('load_app without plugin %8.2f ms' % baseline_load)
+    print('import plugin           %8.2f ms' % plugin_import)
+    print('load_app with plugin    %8.2f ms' % plugin_load)
+    print('plugin cost             %8.2f ms (budget %.2f ms)'
+            % (cost, options.budget))
+
+    status = 0
+    if imported:
+        print('DEFERRED MODULES IMPORTED: %s' % ', '.join(imported))
+        status = 1
+    if cost > options.budget:
+        print('OVER BUDGET')
+        status = 1
+    return status
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
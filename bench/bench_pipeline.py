@@ -0,0 +1,200 @@
+"""
+Benchmark suite for the form POST pipeline.
+
+Runs a set of scenarios, each in its own process against a text store
+in a temporary directory, and reports requests per second, p50 and p99
+latency and the growth in peak memory (maximum resident set size) over
+the process baseline. Results are written as JSON so that runs can be
+compared between releases.
+
+    python bench/bench_pipeline.py [--output FILE] [--compare FILE]
+        [--only NAME ...] [--skip-large]
+
+With --compare, scenarios whose throughput fell by more than
+--tolerance (default 0.2, ie 20%) against the earlier results are
+listed, and the exit status is 1.
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import shutil
+import sys
+import tempfile
+import time
+
+from benchutil import (make_app, request, multipart_body, MULTIPART_TYPE,
+        URLENCODED_TYPE)
+
+
+KB = 1024
+MB = 1024 * KB
+
+TAG_HEAVY = ' '.join(['tag%s' % index for index in range(40)] +
+        ['[[multi word tag %s]]' % index for index in range(20)])
+
+
+def urlencoded(index):
+    return ('title=tiddler%s&text=some%%20text&tags=one%%20two' % index,
+            URLENCODED_TYPE)
+
+
+def urlencoded_tag_heavy(index):
+    return ('title=tiddler%s&text=some%%20text&tags=%s' % (index,
+        TAG_HEAVY.replace(' ', '%20').replace('[', '%5B').replace(']', '%5D')),
+        URLENCODED_TYPE)
+
+
+def multipart_text(index):
+    return (multipart_body([('title', 'tiddler%s' % index),
+        ('text', 'some text'), ('tags', 'one two')]), MULTIPART_TYPE)
+
+
+def binary(size):
+    content = (''.join(chr(byte) for byte in range(256)) *
+            (size // 256 + 1))[:size]
+
+    def build(index):
+        return (multipart_body([('title', 'file%s' % index)],
+            [('file.bin', 'application/octet-stream', content)]),
+            MULTIPART_TYPE)
+    return build
+
+
+# name, path, body builder, number of requests, large
+SCENARIOS = [
+    ('bag-urlencoded', '/bags/bench/tiddlers', urlencoded, 500, False),
+    ('recipe-urlencoded', '/recipes/bench/tiddlers', urlencoded, 500, False),
+    ('bag-multipart-text', '/bags/bench/tiddlers', multipart_text, 500,
+        False),
+    ('recipe-multipart-text', '/recipes/bench/tiddlers', multipart_text,
+        500, False),
+    ('bag-tag-heavy', '/bags/bench/tiddlers', urlencoded_tag_heavy, 500,
+        False),
+    ('binary-1KB', '/bags/bench/tiddlers', binary(1 * KB), 200, False),
+    ('binary-100KB', '/bags/bench/tiddlers', binary(100 * KB), 100, False),
+    ('binary-1MB', '/bags/bench/tiddlers', binary(1 * MB), 20, False),
+    ('binary-10MB', '/bags/bench/tiddlers', binary(10 * MB), 5, True),
+    ('binary-100MB', '/bags/bench/tiddlers', binary(100 * MB), 2, True),
+]
+
+
+def percentile(sorted_values, fraction):
+    index = min(len(sorted_values) - 1,
+            int(round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def run_scenario(name, path, builder, count, results):
+    """
+    Run one scenario and put its figures on the results queue.
+    Bodies are built before timing starts, and memory is measured
+    relative to the peak after building them.
+    """
+    directory = tempfile.mkdtemp()
+    try:
+        app = make_app(os.path.join(directory, 'store'))
+        bodies = [builder(index) for index in range(count)]
+        baseline = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        latencies = []
+        errors = 0
+        start = time.time()
+        for body, content_type in bodies:
+            request_start = time.time()
+            status = request(app, path, body, content_type)[0]
+            latencies.append(time.time() - request_start)
+            if status[0] not in '23':
+                errors += 1
+        elapsed = time.time() - start
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        latencies.sort()
+        results.put({
+            'name': name,
+            'requests': count,
+            'errors': errors,
+            'bytes_per_request': len(bodies[0][0]),
+            'requests_per_second': count / elapsed,
+            'p50_ms': percentile(latencies, 0.5) * 1000,
+            'p99_ms': percentile(latencies, 0.99) * 1000,
+            # ru_maxrss is in kilobytes on Linux
+            'peak_memory_kb': peak - baseline,
+        })
+    finally:
+        shutil.rmtree(directory)
+
+
+def run(scenarios):
+    results = []
+    for name, path, builder, count, _ in scenarios:
+        queue = multiprocessing.Queue()
+        process = multiprocessing.Process(target=run_scenario,
+                args=(name, path, builder, count, queue))
+        process.start()
+        results.append(queue.get())
+        process.join()
+    return results
+
+
+def report(results):
+    print('%-24s %10s %10s %10s %12s %7s' % ('scenario', 'req/sec',
+        'p50 ms', 'p99 ms', 'peak mem KB', 'errors'))
+    for result in results:
+        print('%-24s %10.1f %10.2f %10.2f %12d %7d' % (result['name'],
+            result['requests_per_second'], result['p50_ms'],
+            result['p99_ms'], result['peak_memory_kb'], result['errors']))
+
+
+def regressions(results, previous, tolerance):
+    """
+    Return the names of scenarios whose throughput fell by more than
+    tolerance against previous.
+    """
+    before = dict((result['name'], result)
+            for result in previous['results'])
+    slower = []
+    for result in results:
+        old = before.get(result['name'])
+        if old and result['requests_per_second'] < (
+                old['requests_per_second'] * (1 - tolerance)):
+            slower.append(result['name'])
+    return slower
+
+
+def main(args):
+    parser = argparse.ArgumentParser(description='form POST benchmarks')
+    parser.add_argument('--output', help='write JSON results here')
+    parser.add_argument('--compare', help='JSON results to compare with')
+    parser.add_argument('--tolerance', type=float, default=0.2)
+    parser.add_argument('--only', nargs='*', help='scenarios to run')
+    parser.add_argument('--skip-large', action='store_true',
+            help='skip the 10MB and 100MB uploads')
+    options = parser.parse_args(args)
+
+    scenarios = [scenario for scenario in SCENARIOS
+            if (not options.only or scenario[0] in options.only)
+            and not (options.skip_large and scenario[4])]
+    results = run(scenarios)
+    report(results)
+
+    if options.output:
+        with open(options.output, 'w') as output:
+            json.dump({
+                'python': platform.python_version(),
+                'time': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+                'results': results}, output, indent=2, sort_keys=True)
+
+    if options.compare:
+        with open(options.compare) as previous:
+            slower = regressions(results, json.load(previous),
+                    options.tolerance)
+        for name in slower:
+            print('REGRESSION: %s' % name)
+        if slower:
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
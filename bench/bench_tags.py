@@ -0,0 +1,94 @@
+"""
+Microbenchmark of tag parsing: the cached TagParser against the
+regex-per-call implementation it replaced.
+
+Reports parses per second and the memory held by the tag strings
+in the parsed results.
+
+    python bench/bench_tags.py
+"""
+import os
+import re
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import mangler
+
+from tiddlywebplugins.form.tags import TagParser
+
+
+ITERATIONS = 20000
+
+# What forms actually send: a handful of checkbox and template tag
+# strings repeated many times, plus the odd one-off.
+COMMON_TAGS = [
+    u'news',
+    u'news featured',
+    u'blog [[getting started]] help',
+    u'image bitmap [[test data]]',
+    u'excludeLists excludeSearch systemConfig',
+    u'[[project alpha]] [[project beta]] status:open priority:high',
+    u'review draft',
+    u'tag1 tag2 tag3 tag4 tag5 tag6 tag7 tag8',
+]
+
+
+def create_tag_list(input_string):
+    """
+    The implementation TagParser replaced.
+    """
+    regex = '\[\[([^\]\]]+)\]\]|(\S+)'
+    matches = re.findall(regex, input_string)
+    tags = set()
+    for bracketed, unbracketed in matches:
+        tag = bracketed or unbracketed
+        tags.add(tag)
+    return list(tags)
+
+
+def workload():
+    inputs = []
+    for index in range(ITERATIONS):
+        if index % 50 == 0:
+            inputs.append(u'oneoff%s [[one off %s]]' % (index, index))
+        else:
+            inputs.append(COMMON_TAGS[index % len(COMMON_TAGS)])
+    return inputs
+
+
+def throughput(parse, inputs):
+    def run():
+        for tag_string in inputs:
+            parse(tag_string)
+    best = min(timeit.repeat(run, number=1, repeat=5))
+    return len(inputs) / best
+
+
+def held_bytes(parse, inputs):
+    """
+    Bytes used by the distinct tag string objects across all
+    results, as if every parsed tiddler were kept.
+    """
+    strings = {}
+    results = [parse(tag_string) for tag_string in inputs]
+    for tags in results:
+        for tag in tags:
+            strings[id(tag)] = sys.getsizeof(tag)
+    return sum(strings.values())
+
+
+def main():
+    inputs = workload()
+    candidates = [
+        ('regex per call', create_tag_list),
+        ('TagParser', TagParser().parse),
+    ]
+    print('%-16s %14s %14s' % ('parser', 'parses/sec', 'string bytes'))
+    for name, parse in candidates:
+        print('%-16s %14.0f %14d' % (name, throughput(parse, inputs),
+            held_bytes(parse, inputs)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,103 @@
+"""
+Helpers shared by the benchmarks: an in-process TiddlyWeb app with
+the form plugin, backed by a text store, and WSGI requests to it.
+"""
+import os
+import sys
+from StringIO import StringIO
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import mangler
+
+from tiddlyweb.config import config
+from tiddlyweb.model.bag import Bag
+from tiddlyweb.model.recipe import Recipe
+from tiddlyweb.web import serve
+
+from tiddlywebplugins.utils import get_store
+from tiddlywebplugins import form
+
+
+BOUNDARY = '---------------------------984943658114410893'
+
+
+def make_app(store_root, handler=None, extra_config=None):
+    """
+    Load the app with the form plugin, with a bag called bench and a
+    recipe called bench over it. If handler is given it replaces
+    post_tiddler_to_container.
+    """
+    config['server_store'] = ['text', {'store_root': store_root}]
+    config['system_plugins'] = ['tiddlywebplugins.form']
+    config.update(extra_config or {})
+    original = form.post_tiddler_to_container
+    if handler is not None:
+        form.post_tiddler_to_container = handler
+    try:
+        app = serve.load_app()
+    finally:
+        form.post_tiddler_to_container = original
+    store = get_store(config)
+    store.put(Bag('bench'))
+    recipe = Recipe('bench')
+    recipe.set_recipe([('bench', '')])
+    store.put(recipe)
+    return app
+
+
+def request(app, path, body, content_type, method='POST', headers=None):
+    """
+    Make a request to app, returning the status and headers and
+    consuming the body of the response.
+    """
+    environ = {
+        'REQUEST_METHOD': method,
+        'SCRIPT_NAME': '',
+        'PATH_INFO': path,
+        'QUERY_STRING': '',
+        'SERVER_NAME': 'localhost',
+        'SERVER_PORT': '8080',
+        'SERVER_PROTOCOL': 'HTTP/1.1',
+        'CONTENT_TYPE': content_type,
+        'CONTENT_LENGTH': str(len(body)),
+        'wsgi.input': StringIO(body),
+        'wsgi.errors': sys.stderr,
+        'wsgi.url_scheme': 'http',
+    }
+    environ.update(headers or {})
+    response = []
+
+    def start_response(status, response_headers, exc_info=None):
+        response.extend([status, response_headers])
+
+    for _ in app(environ, start_response):
+        pass
+    return response[0], response[1]
+
+
+def multipart_body(fields, files=None):
+    """
+    Build a multipart/form-data body from a list of (name, value)
+    fields and a list of (filename, content type, content) files.
+    """
+    parts = []
+    for name, value in fields:
+        parts.extend([
+            '--' + BOUNDARY,
+            'Content-Disposition: form-data; name="%s"' % name,
+            '',
+            value])
+    for filename, content_type, content in files or []:
+        parts.extend([
+            '--' + BOUNDARY,
+            'Content-Disposition: form-data; name="file"; '
+                'filename="%s"' % filename,
+            'Content-Type: %s' % content_type,
+            '',
+            content])
+    parts.append('--' + BOUNDARY + '--')
+    return '\r\n'.join(parts)
+
+
+MULTIPART_TYPE = 'multipart/form-data; boundary=%s' % BOUNDARY
+URLENCODED_TYPE = 'application/x-www-form-urlencoded'
@@ -22,6 +22,8 @@ setup(
     packages = find_packages(exclude='test'),
     author_email = AUTHOR_EMAIL,
     platforms = 'Posix; MacOS X; Windows',
-    install_requires = ['setuptools', 'httpexceptor', 'tiddlyweb>=2.1.5'],
+    install_requires = ['setuptools', 'httpexceptor', 'tiddlyweb>=2.1.5',
+        'tiddlywebplugins.utils'],
+    extras_require = {'images': ['Pillow']},
     zip_safe = False
     )
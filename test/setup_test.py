@@ -24,6 +24,9 @@ RECIPES = {
     'foobar': [('foo', ''), ('bar', '')]
 }
 
+BOUNDARY = '---------------------------984943658114410893'
+MULTIPART_TYPE = 'multipart/form-data; boundary=%s' % BOUNDARY
+
 def setup_store():
     """
     initialise a blank store, and fill it with some data
@@ -57,3 +60,27 @@ def setup_web():
         
     httplib2_intercept.install()
     wsgi_intercept.add_wsgi_intercept('test_domain', 8001, app_fn)
+
+def multipart_body(fields=(), files=()):
+    """
+    build a multipart/form-data body, to be sent with MULTIPART_TYPE,
+    from fields, a list of (name, value), and files, a list of
+    (filename, content type, content) with an optional fourth item
+    listing more headers for the part
+    """
+    lines = []
+    for name, value in fields:
+        lines.extend(['--' + BOUNDARY,
+            'Content-Disposition: form-data; name="%s"' % name,
+            '',
+            value])
+    for upload in files:
+        filename, content_type, content = upload[:3]
+        lines.extend(['--' + BOUNDARY,
+            'Content-Disposition: form-data; name="file"; '
+                'filename="%s"' % filename,
+            'Content-Type: %s' % content_type])
+        lines.extend(upload[3] if len(upload) > 3 else [])
+        lines.extend(['', content])
+    lines.extend(['--' + BOUNDARY + '--', ''])
+    return '\r\n'.join(lines)
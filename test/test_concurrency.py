@@ -0,0 +1,64 @@
+"""
+tests to ensure concurrent POSTs do not share form data
+"""
+import threading
+
+from setup_test import setup_store, setup_web
+
+from tiddlyweb.config import config
+from tiddlyweb.model.tiddler import Tiddler
+from tiddlyweb.web import serve
+
+import httplib2
+import wsgi_intercept
+
+config['system_plugins'] = ['tiddlywebplugins.form']
+
+THREADS = 8
+POSTS_PER_THREAD = 10
+
+def test_concurrent_posts():
+    """
+    post to the bag and recipe routes from several threads at once,
+    then check every tiddler holds the text that was sent for it
+    """
+    store = setup_store()
+    setup_web()
+    # load_app is not thread safe, so share one app between the threads
+    app = serve.load_app()
+    wsgi_intercept.add_wsgi_intercept('test_domain', 8001, lambda: app)
+    errors = []
+
+    def poster(thread_index):
+        http = httplib2.Http()
+        for post_index in range(POSTS_PER_THREAD):
+            title = 'tiddler-%s-%s' % (thread_index, post_index)
+            if post_index % 2:
+                url = 'http://test_domain:8001/recipes/foobar/tiddlers'
+            else:
+                url = 'http://test_domain:8001/bags/bar/tiddlers'
+            try:
+                response = http.request(url, method='POST',
+                    headers={'Content-type':
+                        'application/x-www-form-urlencoded'},
+                    body='title=%s&text=text%%20of%%20%s&tags=%s'
+                        % (title, title, title))[0]
+                if response.status != 204:
+                    errors.append('%s: %s' % (title, response.status))
+            except Exception as exc:
+                errors.append('%s: %s' % (title, exc))
+
+    threads = [threading.Thread(target=poster, args=(index,))
+            for index in range(THREADS)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert errors == []
+    for thread_index in range(THREADS):
+        for post_index in range(POSTS_PER_THREAD):
+            title = 'tiddler-%s-%s' % (thread_index, post_index)
+            tiddler = store.get(Tiddler(title, 'bar'))
+            assert tiddler.text == 'text of %s' % title
+            assert tiddler.tags == [title]
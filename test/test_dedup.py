@@ -0,0 +1,263 @@
+"""
+tests to ensure repeated uploads share one stored blob
+"""
+import hashlib
+import shutil
+import tempfile
+
+from setup_test import (MULTIPART_TYPE, multipart_body, setup_store,
+    setup_web)
+
+from tiddlyweb.config import config
+from tiddlyweb.model.tiddler import Tiddler
+from tiddlyweb.store import Store
+
+from tiddlywebplugins.form import blobs
+
+import httplib2
+
+config['system_plugins'] = ['tiddlywebplugins.form']
+
+def setup_module(module):
+    module.BLOB_DIR = tempfile.mkdtemp()
+    config['form.dedup'] = True
+    config['form.blob_dir'] = module.BLOB_DIR
+
+def teardown_module(module):
+    del config['form.dedup']
+    del config['form.blob_dir']
+    shutil.rmtree(module.BLOB_DIR)
+
+def upload(http, title, content, bag='foo'):
+    """
+    upload content as a file, titled title
+    """
+    return http.request('http://test_domain:8001/bags/%s/tiddlers' % bag,
+        method='POST', headers={'Content-type': MULTIPART_TYPE},
+        body=multipart_body([('title', title)],
+            [('logo.bmp', 'image/bmp', content)]))[0]
+
+def test_repeat_upload_shares_blob():
+    """
+    the same file uploaded twice is stored once, and served to both
+    """
+    store = setup_store()
+    setup_web()
+    http = httplib2.Http()
+    binary_data = open('test/test.bmp').read()
+
+    assert upload(http, 'logo', binary_data).status == 204
+    assert upload(http, 'logo copy', binary_data, bag='bar').status == 204
+
+    first = store.get(Tiddler('logo', 'foo'))
+    second = store.get(Tiddler('logo copy', 'bar'))
+    assert first.text == ''
+    assert first.type == 'image/bmp'
+    assert first.fields['_form_blob'] == second.fields['_form_blob']
+    assert list(blobs.BlobStore(BLOB_DIR).digests()) == \
+        [first.fields['_form_blob']]
+
+    http.follow_redirects = False
+    response = http.request(
+        'http://test_domain:8001/bags/bar/tiddlers/logo%20copy')[0]
+    assert response.status == 302
+    assert response['location'] == second.fields['_canonical_uri']
+
+    response, content = http.request(
+        'http://test_domain:8001' + second.fields['_canonical_uri'])
+    assert response.status == 200
+    assert response['content-type'] == 'image/bmp'
+    assert content == binary_data
+
+def test_collision_stores_in_full():
+    """
+    a different file with the same digest is not treated as a repeat
+    """
+    store = setup_store()
+    setup_web()
+    http = httplib2.Http()
+
+    class WeakHash(object):
+        def update(self, data):
+            pass
+        def hexdigest(self):
+            return 'a' * 64
+
+    original = blobs.new_hash
+    blobs.new_hash = WeakHash
+    try:
+        assert upload(http, 'one', 'first content').status == 204
+        assert upload(http, 'two', 'other content').status == 204
+    finally:
+        blobs.new_hash = original
+
+    one = store.get(Tiddler('one', 'foo'))
+    two = store.get(Tiddler('two', 'foo'))
+    assert one.fields['_form_blob'] == 'a' * 64
+    assert '_form_blob' not in two.fields
+    assert '_canonical_uri' not in two.fields
+    assert two.text == 'other content'
+
+def test_delete_shared_blob():
+    """
+    deleting one tiddler leaves the blob for the other. once neither
+    refers to it, rebuild removes it
+    """
+    store = setup_store()
+    setup_web()
+    http = httplib2.Http()
+    blob_store = blobs.BlobStore(BLOB_DIR)
+
+    assert upload(http, 'first', 'shared content').status == 204
+    assert upload(http, 'second', 'shared content').status == 204
+    digest = store.get(Tiddler('first', 'foo')).fields['_form_blob']
+
+    response = http.request(
+        'http://test_domain:8001/bags/foo/tiddlers/first',
+        method='DELETE')[0]
+    assert response.status == 204
+
+    removed, missing = blobs.rebuild(store, blob_store, min_age=0)
+    assert digest not in removed
+    assert missing == []
+    response, content = http.request(
+        'http://test_domain:8001/form/blobs/foo/%s' % digest)
+    assert content == 'shared content'
+
+    store.delete(Tiddler('second', 'foo'))
+    removed, missing = blobs.rebuild(store, blob_store, min_age=0)
+    assert digest in removed
+    assert not blob_store.exists(digest)
+
+def test_verify():
+    """
+    verify reports blobs whose content no longer matches their digest
+    """
+    setup_store()
+    setup_web()
+    http = httplib2.Http()
+    blob_store = blobs.BlobStore(BLOB_DIR)
+
+    assert upload(http, 'good', 'good content').status == 204
+    assert upload(http, 'bad', 'bad content').status == 204
+    assert blobs.verify(blob_store) == []
+
+    bad_digest = hashlib.sha256('bad content').hexdigest()
+    with open(blob_store.path(bad_digest), 'w') as blob:
+        blob.write('changed')
+    assert blobs.verify(blob_store) == [bad_digest]
+
+def test_threshold():
+    """
+    with form.blob_threshold set, only uploads larger than it are
+    stored as blobs, even without form.dedup
+    """
+    config['form.dedup'] = False
+    config['form.blob_threshold'] = 10
+    try:
+        store = setup_store()
+        setup_web()
+        http = httplib2.Http()
+
+        assert upload(http, 'small', 'tiny').status == 204
+        assert upload(http, 'large', 'more than ten bytes').status == 204
+    finally:
+        config['form.dedup'] = True
+        del config['form.blob_threshold']
+
+    small = store.get(Tiddler('small', 'foo'))
+    assert small.text == 'tiny'
+    assert '_form_blob' not in small.fields
+    large = store.get(Tiddler('large', 'foo'))
+    assert large.text == ''
+    assert large.fields['_form_blob'] == hashlib.sha256(
+        'more than ten bytes').hexdigest()
+
+def test_byte_range():
+    """
+    a single byte range of a blob can be asked for
+    """
+    setup_store()
+    setup_web()
+    http = httplib2.Http()
+
+    assert upload(http, 'ranged', '0123456789').status == 204
+    url = 'http://test_domain:8001/form/blobs/foo/%s' % hashlib.sha256(
+        '0123456789').hexdigest()
+
+    response, content = http.request(url, headers={'Range': 'bytes=2-4'})
+    assert response.status == 206
+    assert response['content-range'] == 'bytes 2-4/10'
+    assert content == '234'
+
+    response, content = http.request(url, headers={'Range': 'bytes=-3'})
+    assert content == '789'
+    response, content = http.request(url, headers={'Range': 'bytes=8-'})
+    assert content == '89'
+
+    for header in [{'Range': 'bytes=20-30'},
+            {'Range': 'bytes=1-2', 'If-Range': '"other"'}]:
+        response, content = http.request(url, headers=header)
+        assert response.status == 200
+        assert content == '0123456789'
+
+    assert blobs.byte_range('bytes=0-1,4-5', 10) is None
+
+def test_blob_only_through_referring_bag():
+    """
+    a blob is not served through a bag none of whose tiddlers refer
+    to it, even if the bag can be read
+    """
+    setup_store()
+    setup_web()
+    http = httplib2.Http()
+
+    assert upload(http, 'private', 'private content', bag='bar').status == 204
+    digest = hashlib.sha256('private content').hexdigest()
+    response, content = http.request(
+        'http://test_domain:8001/form/blobs/bar/%s' % digest)
+    assert response.status == 200
+    response, content = http.request(
+        'http://test_domain:8001/form/blobs/foo/%s' % digest)
+    assert response.status == 404
+    assert 'private content' not in content
+
+def test_blob_served_without_bag_scan():
+    """
+    serving a blob, or revalidating it, looks up the tiddlers its
+    references name rather than listing the bag, and rebuild restores
+    lost references
+    """
+    store = setup_store()
+    setup_web()
+    http = httplib2.Http()
+    blob_store = blobs.BlobStore(BLOB_DIR)
+
+    assert upload(http, 'listed', 'listed content').status == 204
+    digest = hashlib.sha256('listed content').hexdigest()
+    url = 'http://test_domain:8001/form/blobs/foo/%s' % digest
+    assert blob_store.references(digest, u'foo') == [u'listed']
+
+    def no_listing(self, bag):
+        raise AssertionError('bag listed')
+    list_bag_tiddlers = Store.list_bag_tiddlers
+    Store.list_bag_tiddlers = no_listing
+    try:
+        response, content = http.request(url)
+        assert response.status == 200
+        assert content == 'listed content'
+        response = http.request(url,
+            headers={'If-None-Match': '"%s"' % digest})[0]
+        assert response.status == 304
+    finally:
+        Store.list_bag_tiddlers = list_bag_tiddlers
+
+    shutil.rmtree(blob_store.path(digest) + blobs.REFS_SUFFIX)
+    assert http.request(url)[0].status == 404
+    blobs.rebuild(store, blob_store, min_age=0)
+    assert http.request(url)[0].status == 200
+
+    tiddler = store.get(Tiddler('listed', 'foo'))
+    del tiddler.fields['_form_blob']
+    store.put(tiddler)
+    assert http.request(url)[0].status == 404
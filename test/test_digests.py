@@ -0,0 +1,149 @@
+"""
+tests for the digests of uploaded files
+"""
+import hashlib
+
+from setup_test import (MULTIPART_TYPE, multipart_body, setup_store,
+    setup_web)
+
+from tiddlyweb.config import config
+from tiddlyweb.model.tiddler import Tiddler
+from tiddlyweb.store import NoTiddlerError
+
+from tiddlywebplugins.form.digests import file_digests
+from tiddlywebplugins.form.spool import SpoolFile
+
+import httplib2
+
+config['system_plugins'] = ['tiddlywebplugins.form']
+
+CONTENT = 'digested content\n' * 200
+
+def setup_module(module):
+    config['server_prefix'] = ''
+
+def teardown_function(function):
+    config.pop('form.digest', None)
+
+def multipart(title, content, part_headers=(), fields=()):
+    return multipart_body([('title', title)] + list(fields),
+        [('%s.txt' % title, 'text/plain', content, part_headers)])
+
+def post(http, body, headers=None):
+    all_headers = {'Content-type': MULTIPART_TYPE}
+    all_headers.update(headers or {})
+    return http.request('http://test_domain:8001/bags/foo/tiddlers',
+        method='POST', headers=all_headers, body=body)[0]
+
+def stored(store, title):
+    try:
+        return store.get(Tiddler(title, 'foo'))
+    except NoTiddlerError:
+        return None
+
+def test_digest_field():
+    """
+    the sha256 of an upload is kept in _form_digest, or with
+    form.digest set, the digest in that algorithm
+    """
+    store = setup_store()
+    setup_web()
+    http = httplib2.Http()
+
+    assert post(http, multipart('plain', CONTENT)).status == 204
+    assert stored(store, 'plain').fields['_form_digest'] == (
+            'sha256:%s' % hashlib.sha256(CONTENT).hexdigest())
+
+    config['form.digest'] = 'sha-512'
+    assert post(http, multipart('long', CONTENT)).status == 204
+    assert stored(store, 'long').fields['_form_digest'] == (
+            'sha512:%s' % hashlib.sha512(CONTENT).hexdigest())
+
+    config['form.digest'] = ''
+    assert post(http, multipart('none', CONTENT)).status == 204
+    assert '_form_digest' not in stored(store, 'none').fields
+
+def test_part_headers():
+    """
+    a file is checked against the Content-MD5 and Digest headers of
+    its part
+    """
+    store = setup_store()
+    setup_web()
+    http = httplib2.Http()
+
+    md5 = hashlib.md5(CONTENT).digest().encode('base64').strip()
+    sha = hashlib.sha256(CONTENT).digest().encode('base64').strip()
+    assert post(http, multipart('md5', CONTENT,
+        ['Content-MD5: %s' % md5])).status == 204
+    assert post(http, multipart('sha', CONTENT,
+        ['Digest: SHA-256=%s, unknown=abc' % sha])).status == 204
+
+    response = post(http, multipart('bad', CONTENT + 'x',
+        ['Content-MD5: %s' % md5]))
+    assert response.status == 400
+    assert stored(store, 'bad') is None
+
+def test_digest_form_field():
+    """
+    a _digest field checks the files in order, and is not kept
+    """
+    store = setup_store()
+    setup_web()
+    http = httplib2.Http()
+
+    hex_sha = hashlib.sha256(CONTENT).hexdigest()
+    assert post(http, multipart('hex', CONTENT,
+        fields=[('_digest', hex_sha)])).status == 204
+    assert '_digest' not in stored(store, 'hex').fields
+
+    md5 = hashlib.md5(CONTENT).digest().encode('base64').strip()
+    assert post(http, multipart('md5', CONTENT,
+        fields=[('_digest', 'md5=%s' % md5)])).status == 204
+
+    for title, value in [('wrong', '0' * 64), ('unknown', 'crc32=abc'),
+            ('junk', 'not hex')]:
+        response = post(http, multipart(title, CONTENT,
+            fields=[('_digest', value)]))
+        assert response.status == 400
+        assert stored(store, title) is None
+
+def test_request_headers():
+    """
+    Content-MD5 and Digest headers of the request check the whole body
+    """
+    store = setup_store()
+    setup_web()
+    http = httplib2.Http()
+
+    body = multipart('whole', CONTENT)
+    md5 = hashlib.md5(body).digest().encode('base64').strip()
+    assert post(http, body, {'Content-MD5': md5}).status == 204
+
+    body = 'title=urlencoded&text=Hi'
+    sha = hashlib.sha256(body).digest().encode('base64').strip()
+    response = http.request('http://test_domain:8001/bags/foo/tiddlers',
+        method='POST',
+        headers={'Content-type': 'application/x-www-form-urlencoded',
+            'Digest': 'sha-256=%s' % sha},
+        body=body)[0]
+    assert response.status == 204
+
+    response = post(http, multipart('whole-bad', CONTENT),
+        {'Content-MD5': md5})
+    assert response.status == 400
+    assert stored(store, 'whole-bad') is None
+
+def test_spooled_digest_not_reread():
+    """
+    the digest of a spooled file comes from the hash made as it was
+    written, without reading it back
+    """
+    spool = SpoolFile(max_size=10, algorithms=['sha256'])
+    spool.write(CONTENT)
+
+    def no_read(*args):
+        raise AssertionError('spool file read')
+    spool.read = no_read
+    assert file_digests(spool, ['sha256']) == {
+            'sha256': hashlib.sha256(CONTENT).digest()}
@@ -0,0 +1,185 @@
+"""
+tests for POSTing compressed form bodies
+"""
+import gzip
+import sys
+import zlib
+from StringIO import StringIO
+
+from setup_test import (MULTIPART_TYPE, multipart_body, setup_store,
+    setup_web)
+
+from tiddlyweb.config import config
+from tiddlyweb.model.tiddler import Tiddler
+from tiddlyweb.web import serve
+
+import httplib2
+
+config['system_plugins'] = ['tiddlywebplugins.form']
+
+
+TEXT = ' '.join('word%s' % (index * 7919 % 10007) for index in range(20000))
+
+def gzipped(data):
+    output = StringIO()
+    with gzip.GzipFile(fileobj=output, mode='wb') as compressed:
+        compressed.write(data)
+    return output.getvalue()
+
+def raw_deflated(data):
+    compressor = zlib.compressobj(9, zlib.DEFLATED, -zlib.MAX_WBITS)
+    return compressor.compress(data) + compressor.flush()
+
+def multipart(title, content):
+    return multipart_body([('title', title)],
+        [('file.txt', 'text/plain', content)])
+
+def post(body, encoding, content_type='application/x-www-form-urlencoded'):
+    http = httplib2.Http()
+    return http.request('http://test_domain:8001/bags/foo/tiddlers',
+        method='POST',
+        headers={'Content-type': content_type, 'Content-Encoding': encoding},
+        body=body)
+
+def setup_module(module):
+    # keep uploads in the tiddler text, where they are compared
+    config['form.blob_threshold'] = 1024 * 1024
+
+def teardown_module(module):
+    del config['form.blob_threshold']
+
+def teardown_function(function):
+    config.pop('form.max_inflate_ratio', None)
+    config.pop('form.max_body', None)
+
+def test_gzip_urlencoded():
+    """
+    a gzipped urlencoded form is decompressed before it is parsed
+    """
+    store = setup_store()
+    setup_web()
+    body = 'title=Zipped&text=%s' % TEXT.replace(' ', '%20')
+    response = post(gzipped(body), 'gzip')[0]
+    assert response.status == 204
+    assert store.get(Tiddler('Zipped', 'foo')).text == TEXT
+
+def test_deflate_multipart():
+    """
+    zlib wrapped and raw deflate multipart forms are both decompressed
+    """
+    store = setup_store()
+    setup_web()
+    content_type = MULTIPART_TYPE
+    response = post(zlib.compress(multipart('Wrapped', TEXT)), 'deflate',
+        content_type)[0]
+    assert response.status == 204
+    response = post(raw_deflated(multipart('Raw', TEXT)), 'deflate',
+        content_type)[0]
+    assert response.status == 204
+    assert store.get(Tiddler('Wrapped', 'foo')).text == TEXT
+    assert store.get(Tiddler('Raw', 'foo')).text == TEXT
+
+def test_inflate_ratio():
+    """
+    a body that expands too much is refused
+    """
+    setup_store()
+    setup_web()
+    bomb = gzipped('title=Bomb&text=' + 'a' * (10 * 1024 * 1024))
+    assert post(bomb, 'gzip')[0].status == 413
+
+    config['form.max_inflate_ratio'] = 2000
+    assert post(bomb, 'gzip')[0].status == 204
+
+def test_max_body_after_decompression():
+    """
+    form.max_body limits the decompressed body too
+    """
+    setup_store()
+    setup_web()
+    config['form.max_body'] = 50000
+    body = 'title=Big&text=%s' % TEXT.replace(' ', '%20')
+    assert len(gzipped(body)) < 50000 < len(body)
+    assert post(gzipped(body), 'gzip')[0].status == 413
+
+def test_bad_encodings():
+    """
+    unknown encodings and corrupt bodies are refused
+    """
+    setup_store()
+    setup_web()
+    assert post('title=Hello', 'br')[0].status == 415
+    assert post('not gzip at all', 'gzip')[0].status == 400
+    assert post('title=Plain&text=hi', 'identity')[0].status == 204
+
+class KeptAliveInput(object):
+    """
+    A wsgi.input on a connection kept open for another request. With
+    end, reading past it fails; without, reading once the data sent
+    has run out fails, as it would block.
+    """
+
+    def __init__(self, body, end=None):
+        self.stream = StringIO(body)
+        self.end = end
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            raise AssertionError('read to the end of the connection')
+        if self.end is not None and self.stream.tell() + size > self.end:
+            raise AssertionError('read past the end of the request')
+        data = self.stream.read(size)
+        if not data:
+            raise AssertionError('read after the data sent')
+        return data
+
+    def readline(self, size=-1):
+        raise AssertionError('compressed body read by line')
+
+def wsgi_post(stream, content_type, content_length=None):
+    environ = {
+        'REQUEST_METHOD': 'POST',
+        'SCRIPT_NAME': '',
+        'PATH_INFO': '/bags/foo/tiddlers',
+        'QUERY_STRING': '',
+        'SERVER_NAME': 'test_domain',
+        'SERVER_PORT': '8001',
+        'SERVER_PROTOCOL': 'HTTP/1.1',
+        'CONTENT_TYPE': content_type,
+        'HTTP_CONTENT_ENCODING': 'gzip',
+        'wsgi.input': stream,
+        'wsgi.errors': sys.stderr,
+        'wsgi.url_scheme': 'http',
+    }
+    if content_length is not None:
+        environ['CONTENT_LENGTH'] = str(content_length)
+    status = []
+
+    def start_response(response_status, headers, exc_info=None):
+        status.append(response_status)
+
+    list(serve.load_app()(environ, start_response))
+    return status[0]
+
+def test_read_stops_at_end_of_request():
+    """
+    no more than Content-Length bytes are read, and without a
+    Content-Length nothing is read after the end of the compressed data
+    """
+    store = setup_store()
+    next_request = 'POST /bags/foo/tiddlers HTTP/1.1\r\n' * 1000
+
+    body = gzipped('title=Alive&text=kept')
+    assert wsgi_post(KeptAliveInput(body + next_request, len(body)),
+        'application/x-www-form-urlencoded', len(body)).startswith('204')
+    assert store.get(Tiddler('Alive', 'foo')).text == 'kept'
+
+    body = gzipped(multipart('Parts', TEXT))
+    assert wsgi_post(KeptAliveInput(body + next_request, len(body)),
+        MULTIPART_TYPE,
+        len(body)).startswith('204')
+    assert store.get(Tiddler('Parts', 'foo')).text == TEXT
+
+    assert wsgi_post(KeptAliveInput(gzipped('title=Unsized&text=kept')),
+        'application/x-www-form-urlencoded').startswith('204')
+    assert store.get(Tiddler('Unsized', 'foo')).text == 'kept'
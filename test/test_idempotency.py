@@ -0,0 +1,228 @@
+"""
+tests for idempotency keys on form POSTs
+"""
+import os
+import shutil
+import sys
+import tempfile
+from StringIO import StringIO
+from wsgiref.validate import validator
+
+from setup_test import setup_store, setup_web
+
+from tiddlyweb.config import config
+from tiddlyweb.model.bag import Bag
+from tiddlyweb.model.tiddler import Tiddler
+from tiddlyweb.web import serve
+
+from tiddlywebplugins.form import idempotency
+
+import httplib2
+
+config['system_plugins'] = ['tiddlywebplugins.form']
+
+def setup_module(module):
+    config['form.idempotency'] = 'memory'
+
+def teardown_module(module):
+    for key in ['form.idempotency', 'form.idempotency_dir']:
+        config.pop(key, None)
+    setup_web()
+
+def post(http, body, headers=None):
+    headers = dict(headers or {})
+    headers['Content-type'] = 'application/x-www-form-urlencoded'
+    return http.request('http://test_domain:8001/bags/foo/tiddlers',
+        method='POST', headers=headers, body=body)
+
+def test_header_key_replayed():
+    """
+    a POST repeated with the same Idempotency-Key gets the first
+    response and does not write again
+    """
+    store = setup_store()
+    setup_web()
+    http = httplib2.Http()
+
+    first = post(http, 'title=Once&text=first',
+        {'Idempotency-Key': 'abc123'})[0]
+    assert first.status == 204
+    assert 'idempotent-replayed' not in first
+
+    second = post(http, 'title=Once&text=first',
+        {'Idempotency-Key': 'abc123'})[0]
+    assert second.status == 204
+    assert second['idempotent-replayed'] == 'true'
+    assert second['etag'] == first['etag']
+    assert len(store.list_tiddler_revisions(Tiddler('Once', 'foo'))) == 1
+
+    third = post(http, 'title=Once&text=third',
+        {'Idempotency-Key': 'other'})[0]
+    assert 'idempotent-replayed' not in third
+    assert store.get(Tiddler('Once', 'foo')).text == 'third'
+
+def test_field_key_with_file_cache():
+    """
+    the key may be a form field, and the file cache keeps responses
+    between processes
+    """
+    directory = tempfile.mkdtemp()
+    config['form.idempotency'] = 'file'
+    config['form.idempotency_dir'] = directory
+    try:
+        store = setup_store()
+        setup_web()
+        http = httplib2.Http()
+
+        first = post(http, 'title=Field&text=first&_idempotency_key=k1')[0]
+        assert first.status == 204
+        second = post(http, 'title=Field&text=first&_idempotency_key=k1')[0]
+        assert second['idempotent-replayed'] == 'true'
+        assert second['location'] == first['location']
+        assert post(http, 'title=Field&text=second&_idempotency_key=k1'
+            )[0].status == 422
+
+        tiddler = store.get(Tiddler('Field', 'foo'))
+        assert tiddler.text == 'first'
+        assert len(store.list_tiddler_revisions(tiddler)) == 1
+        assert '_idempotency_key' not in tiddler.fields
+        assert len(os.listdir(directory)) == 1
+    finally:
+        config['form.idempotency'] = 'memory'
+        del config['form.idempotency_dir']
+        shutil.rmtree(directory)
+
+def test_failure_not_kept():
+    """
+    a POST that failed may be sent again with the same key, to the
+    same URL, once the cause is fixed
+    """
+    store = setup_store()
+    setup_web()
+    http = httplib2.Http()
+
+    def post_missing():
+        return http.request('http://test_domain:8001/bags/missing/tiddlers',
+            method='POST',
+            headers={'Content-type': 'application/x-www-form-urlencoded',
+                'Idempotency-Key': 'retry'},
+            body='title=Lost&text=Hi')[0]
+
+    assert post_missing().status == 409
+    store.put(Bag('missing'))
+    response = post_missing()
+    assert response.status == 204
+    assert 'idempotent-replayed' not in response
+    store.get(Tiddler('Lost', 'missing'))
+
+def test_changed_body_refused():
+    """
+    a key sent again with a different form gets 422, and nothing is
+    written
+    """
+    store = setup_store()
+    setup_web()
+    http = httplib2.Http()
+
+    assert post(http, 'title=Same&text=first',
+        {'Idempotency-Key': 'changed'})[0].status == 204
+    response = post(http, 'title=Same&text=second',
+        {'Idempotency-Key': 'changed'})[0]
+    assert response.status == 422
+    assert store.get(Tiddler('Same', 'foo')).text == 'first'
+
+def test_pending_and_bounded():
+    """
+    a key being handled is reported as pending, a key used with another
+    fingerprint as a mismatch, and the memory cache keeps no more than
+    its size
+    """
+    for cache in [idempotency.MemoryCache(size=2),
+            idempotency.FileCache(tempfile.mkdtemp(), size=2)]:
+        assert cache.reserve('a') is None
+        assert cache.reserve('a') is idempotency.PENDING
+        cache.store('a', ('204 No Content', [('ETag', '"x"')], ''))
+        assert cache.reserve('a') == ('204 No Content', [('ETag', '"x"')], '')
+        cache.release('a')
+        assert cache.reserve('a') is None
+        cache.release('a')
+        assert cache.reserve('a', 'first') is None
+        assert cache.reserve('a', 'second') is idempotency.MISMATCH
+        cache.store('a', ('204 No Content', [], ''), 'first')
+        assert cache.reserve('a', 'second') is idempotency.MISMATCH
+        assert cache.reserve('a', 'first') == ('204 No Content', [], '')
+
+    cache = idempotency.MemoryCache(size=2)
+    for key in 'abc':
+        cache.reserve(key)
+    assert list(cache.entries) == ['b', 'c']
+
+def validated_post(body, key):
+    """
+    POST body through wsgiref.validate, which insists on byte strings,
+    asking for a JSON response
+    """
+    environ = {
+        'REQUEST_METHOD': 'POST',
+        'SCRIPT_NAME': '',
+        'PATH_INFO': '/bags/foo/tiddlers',
+        'QUERY_STRING': '',
+        'SERVER_NAME': 'test_domain',
+        'SERVER_PORT': '8001',
+        'SERVER_PROTOCOL': 'HTTP/1.1',
+        'CONTENT_TYPE': 'application/x-www-form-urlencoded',
+        'CONTENT_LENGTH': str(len(body)),
+        'HTTP_IDEMPOTENCY_KEY': key,
+        'HTTP_ACCEPT': 'application/json',
+        'wsgi.version': (1, 0),
+        'wsgi.input': StringIO(body),
+        'wsgi.errors': sys.stderr,
+        'wsgi.url_scheme': 'http',
+        'wsgi.multithread': False,
+        'wsgi.multiprocess': False,
+        'wsgi.run_once': False,
+    }
+    response = []
+
+    def start_response(status, headers, exc_info=None):
+        response[:] = [status, dict(headers)]
+
+    output = validator(serve.load_app())(environ, start_response)
+    try:
+        response.append(''.join(output))
+    finally:
+        output.close()
+    return response
+
+def test_file_cache_replay_is_valid_wsgi():
+    """
+    a response replayed from the file cache has a byte string status,
+    headers and body, with bytes outside ASCII kept as they were
+    """
+    directory = tempfile.mkdtemp()
+    config['form.idempotency'] = 'file'
+    config['form.idempotency_dir'] = directory
+    try:
+        setup_store()
+        body = 'title=Caf%C3%A9&text=Hi'
+        first = validated_post(body, 'valid')
+        second = validated_post(body, 'valid')
+        assert second[1]['Idempotent-Replayed'] == 'true'
+        assert second[0] == first[0]
+        assert second[1]['Location'] == first[1]['Location']
+        assert second[2] == first[2]
+
+        cache = idempotency.FileCache(directory)
+        cache.reserve('binary')
+        cache.store('binary', ('200 OK', [('X-Bytes', 'caf\xc3\xa9')],
+            '\x00\xff\xc3\xa9'))
+        status, headers, content = cache.reserve('binary')
+        assert type(status) is str
+        assert headers == [('X-Bytes', 'caf\xc3\xa9')]
+        assert all(type(item) is str for header in headers
+            for item in header)
+        assert content == '\x00\xff\xc3\xa9'
+    finally:
+        config['form.idempotency'] = 'memory'
+        del config['form.idempotency_dir']
+        shutil.rmtree(directory)
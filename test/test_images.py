@@ -0,0 +1,175 @@
+"""
+tests for scaling uploaded images and making their thumbnails
+"""
+import multiprocessing
+import os
+import time
+from StringIO import StringIO
+
+import pytest
+
+from setup_test import (MULTIPART_TYPE, multipart_body, setup_store,
+    setup_web)
+
+from tiddlyweb.config import config
+from tiddlyweb.model.tiddler import Tiddler
+from tiddlyweb.store import NoTiddlerError
+from tiddlyweb.web import serve
+
+from tiddlywebplugins.form import images
+
+import httplib2
+
+Image = pytest.importorskip('PIL.Image')
+
+config['system_plugins'] = ['tiddlywebplugins.form']
+
+def setup_module(module):
+    config['form.image_max_size'] = 200
+    config['form.image_thumbnails'] = [32, 64]
+
+def teardown_module(module):
+    del config['form.image_max_size']
+    del config['form.image_thumbnails']
+    images.shutdown()
+
+def png(width, height):
+    output = StringIO()
+    Image.new('RGB', (width, height), (200, 30, 30)).save(output, 'PNG')
+    return output.getvalue()
+
+def size_of(data):
+    return Image.open(StringIO(data)).size
+
+def upload(title, content, content_type='image/png'):
+    http = httplib2.Http()
+    return http.request('http://test_domain:8001/bags/foo/tiddlers',
+        method='POST', headers={'Content-type': MULTIPART_TYPE},
+        body=multipart_body([('title', title)],
+            [('image', content_type, content)]))[0]
+
+def test_large_image_scaled():
+    """
+    an image larger than form.image_max_size is scaled down, and
+    thumbnails are made beside it
+    """
+    store = setup_store()
+    setup_web()
+    assert upload('large.png', png(400, 300)).status == 204
+
+    tiddler = store.get(Tiddler('large.png', 'foo'))
+    assert size_of(tiddler.text) == (200, 150)
+    assert tiddler.fields['_form_thumbnails'] == '32 64'
+
+    thumbnail = store.get(Tiddler('large.png.thumb-32', 'foo'))
+    assert thumbnail.type == 'image/png'
+    assert size_of(thumbnail.text) == (32, 24)
+    assert thumbnail.fields['_form_original'] == 'large.png'
+    assert size_of(store.get(Tiddler('large.png.thumb-64', 'foo')).text) == (
+        64, 48)
+
+def test_small_image():
+    """
+    an image is never scaled up
+    """
+    store = setup_store()
+    setup_web()
+    original = png(48, 40)
+    assert upload('small.png', original).status == 204
+
+    tiddler = store.get(Tiddler('small.png', 'foo'))
+    assert tiddler.text == original
+    assert tiddler.fields['_form_thumbnails'] == '32'
+    store.get(Tiddler('small.png.thumb-32', 'foo'))
+    with pytest.raises(NoTiddlerError):
+        store.get(Tiddler('small.png.thumb-64', 'foo'))
+
+def test_not_an_image():
+    """
+    other uploads, and images that can not be read, are stored as sent
+    """
+    store = setup_store()
+    setup_web()
+    assert upload('text', 'just text', 'text/plain').status == 204
+    assert upload('broken.png', 'not a png').status == 204
+    assert store.get(Tiddler('text', 'foo')).text == 'just text'
+    tiddler = store.get(Tiddler('broken.png', 'foo'))
+    assert tiddler.text == 'not a png'
+    assert '_form_thumbnails' not in tiddler.fields
+
+def test_pool_started_by_first_image():
+    """
+    the pool is not started when the app is loaded, only when an image
+    is scaled, and a forked process starts its own
+    """
+    images.shutdown()
+    serve.load_app()
+    assert images._POOL is None
+    setup_store()
+    setup_web()
+    assert upload('started.png', png(48, 40)).status == 204
+    pool = images._POOL
+    assert pool is not None
+    assert images.get_pool(config) is pool
+
+    images._POOL_PID = -1
+    assert images.get_pool(config) is not pool
+    pool.terminate()
+    pool.join()
+
+def test_run_once_scales_in_process():
+    """
+    a process serving one request scales its images without a pool
+    """
+    images.shutdown()
+    tiddler = Tiddler('once.png', 'foo')
+    tiddler.type = 'image/png'
+    tiddler.text = png(400, 300)
+    environ = {'tiddlyweb.config': config, 'wsgi.run_once': True}
+    thumbnails = images.derive_images(environ, [tiddler])
+    assert images._POOL is None
+    assert size_of(tiddler.text) == (200, 150)
+    assert [thumbnail.title for thumbnail in thumbnails] == [
+        'once.png.thumb-32', 'once.png.thumb-64']
+
+class SlowPool(object):
+    """
+    A pool whose jobs never finish, noting how long each was waited for.
+    """
+
+    def __init__(self):
+        self.waits = []
+
+    def apply_async(self, func, args):
+        return self
+
+    def get(self, timeout):
+        self.waits.append(timeout)
+        time.sleep(timeout)
+        raise multiprocessing.TimeoutError()
+
+def test_one_deadline_per_post():
+    """
+    form.image_timeout bounds the wait for all the images of a POST,
+    not each of them
+    """
+    images.shutdown()
+    pool = SlowPool()
+    images._POOL, images._POOL_PID = pool, os.getpid()
+    config['form.image_timeout'] = 0.2
+    try:
+        tiddlers = []
+        for title in ['one.png', 'two.png', 'three.png']:
+            tiddler = Tiddler(title, 'foo')
+            tiddler.type = 'image/png'
+            tiddler.text = 'unscaled'
+            tiddlers.append(tiddler)
+        environ = {'tiddlyweb.config': config}
+        start = time.time()
+        assert images.derive_images(environ, tiddlers) == []
+        assert time.time() - start < 0.4
+        assert len(pool.waits) == 3 and max(pool.waits[1:]) < 0.05
+        assert [tiddler.text for tiddler in tiddlers] == ['unscaled'] * 3
+    finally:
+        del config['form.image_timeout']
+        images._POOL = None
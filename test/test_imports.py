@@ -0,0 +1,50 @@
+"""
+tests that the plugin leaves imports it does not need at startup
+until they are used
+"""
+import os
+import subprocess
+import sys
+
+from tiddlyweb import manage
+from tiddlyweb.config import config
+
+from tiddlywebplugins import form
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+DEFERRED = ['uuid', 'json', 'tiddlyweb.manage',
+    'tiddlywebplugins.form.commands', 'tiddlywebplugins.form.uploads',
+    'tiddlywebplugins.form.writebehind', 'tiddlywebplugins.form.images',
+    'tiddlywebplugins.form.idempotency', 'tiddlywebplugins.form.ratelimit',
+    'tiddlywebplugins.form.memprofile', 'tiddlywebplugins.form.blobs',
+    'tiddlywebplugins.form.digests', 'tiddlywebplugins.form.redirects',
+    'tiddlywebplugins.form.timing']
+
+def test_load_app_defers_imports():
+    """
+    loading the app with the plugin imports none of the deferred modules
+    """
+    code = '\n'.join([
+        'import sys',
+        'sys.path.insert(0, %r)' % ROOT,
+        'import mangler',
+        'from tiddlyweb.config import config',
+        'from tiddlyweb.web import serve',
+        "config['system_plugins'] = ['tiddlywebplugins.form']",
+        'serve.load_app()',
+        'print(" ".join(name for name in %r if name in sys.modules))'
+            % DEFERRED])
+    output = subprocess.check_output([sys.executable, '-c', code], cwd=ROOT)
+    assert output.strip() == ''
+
+def test_init_without_selector_adds_commands():
+    """
+    under twanager there is no selector, and init registers the
+    plugin's commands
+    """
+    twanager_config = dict(config)
+    twanager_config.pop('selector', None)
+    form.init(twanager_config)
+    assert 'formblobs' in manage.COMMANDS
+    assert 'formuploads' in manage.COMMANDS
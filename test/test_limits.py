@@ -0,0 +1,209 @@
+"""
+tests for limits on the size of POSTed forms
+"""
+import sys
+from StringIO import StringIO
+
+from setup_test import (MULTIPART_TYPE, multipart_body, setup_store,
+    setup_web)
+
+from tiddlyweb.config import config
+from tiddlyweb.model.tiddler import Tiddler
+from tiddlyweb.store import NoTiddlerError
+from tiddlyweb.web import serve
+
+import httplib2
+
+config['system_plugins'] = ['tiddlywebplugins.form']
+
+
+LIMITS = ['form.max_body', 'form.max_file', 'form.max_field',
+        'form.max_fields']
+
+class CountingInput(object):
+
+    def __init__(self, data):
+        self.stream = StringIO(data)
+        self.count = 0
+
+    def read(self, size=-1):
+        data = self.stream.read(size)
+        self.count += len(data)
+        return data
+
+    def readline(self, size=-1):
+        data = self.stream.readline(size)
+        self.count += len(data)
+        return data
+
+def multipart(fields, files=()):
+    return multipart_body(fields, [(filename, 'application/octet-stream',
+        content) for filename, content in files])
+
+def post(body, content_type=MULTIPART_TYPE):
+    http = httplib2.Http()
+    return http.request('http://test_domain:8001/bags/foo/tiddlers',
+        method='POST', headers={'Content-type': content_type}, body=body)[0]
+
+def wsgi_post(body, content_length=None, path='/bags/foo/tiddlers',
+        routes=None):
+    environ = {
+        'REQUEST_METHOD': 'POST',
+        'SCRIPT_NAME': '',
+        'PATH_INFO': path,
+        'QUERY_STRING': '',
+        'SERVER_NAME': 'test_domain',
+        'SERVER_PORT': '8001',
+        'SERVER_PROTOCOL': 'HTTP/1.1',
+        'CONTENT_TYPE': MULTIPART_TYPE,
+        'wsgi.input': body,
+        'wsgi.errors': sys.stderr,
+        'wsgi.url_scheme': 'http',
+    }
+    if content_length is not None:
+        environ['CONTENT_LENGTH'] = str(content_length)
+    status = []
+
+    def start_response(response_status, headers, exc_info=None):
+        status.append(response_status)
+
+    app = serve.load_app()
+    for route, handler in (routes or {}).items():
+        config['selector'].add(route, POST=handler)
+    list(app(environ, start_response))
+    return status[0]
+
+def teardown_function(function):
+    for key in LIMITS:
+        config.pop(key, None)
+
+def test_no_limits():
+    """
+    without limits, large forms are accepted
+    """
+    setup_store()
+    setup_web()
+    response = post(multipart([('title', 'big'), ('text', 'a' * 10000)]))
+    assert response.status == 204
+
+def test_declared_length_refused_unread():
+    """
+    a body declared larger than form.max_body is refused before
+    any of it is read
+    """
+    config['form.max_body'] = 1000
+    setup_store()
+    body = CountingInput(multipart([('title', 'big'), ('text', 'a' * 2000)]))
+    status = wsgi_post(body, content_length=len(body.stream.getvalue()))
+    assert status.startswith('413')
+    assert body.count == 0
+
+def test_undeclared_length_cut_off():
+    """
+    a body without a Content-Length is cut off once it goes over
+    form.max_body
+    """
+    config['form.max_body'] = 1000
+    store = setup_store()
+    body = CountingInput(multipart([('title', 'big'),
+        ('text', 'a' * 100000)]))
+    status = wsgi_post(body)
+    assert status.startswith('413')
+    assert body.count < 100000
+    try:
+        store.get(Tiddler('big', 'foo'))
+        assert False, 'tiddler should not have been stored'
+    except NoTiddlerError:
+        pass
+
+def test_body_under_limit():
+    """
+    a body under form.max_body is stored as usual
+    """
+    config['form.max_body'] = 1000
+    setup_store()
+    setup_web()
+    response = post(multipart([('title', 'small'), ('text', 'hello')]))
+    assert response.status == 204
+
+def test_urlencoded_body():
+    """
+    form.max_body applies to urlencoded forms too
+    """
+    config['form.max_body'] = 100
+    setup_store()
+    setup_web()
+    response = post('title=big&text=' + 'a' * 200,
+        content_type='application/x-www-form-urlencoded')
+    assert response.status == 413
+
+def test_max_file():
+    """
+    a file over form.max_file is refused, large or small
+    """
+    config['form.max_file'] = 500
+    config['form.spool_size'] = 2048
+    try:
+        setup_store()
+        setup_web()
+        assert post(multipart([], [('small.bin', 'b' * 400)])).status == 204
+        assert post(multipart([], [('medium.bin', 'b' * 600)])).status == 413
+        assert post(multipart([], [('large.bin', 'b' * 5000)])).status == 413
+        # the limit is for files, not text fields
+        assert post(multipart([('title', 'text'),
+            ('text', 'a' * 5000)])).status == 204
+    finally:
+        del config['form.spool_size']
+
+def test_max_field():
+    """
+    a text field over form.max_field is refused
+    """
+    config['form.max_field'] = 500
+    setup_store()
+    setup_web()
+    assert post(multipart([('title', 'short'),
+        ('text', 'a' * 400)])).status == 204
+    assert post(multipart([('title', 'medium'),
+        ('text', 'a' * 600)])).status == 413
+    assert post(multipart([('title', 'long'),
+        ('text', 'a' * 5000)])).status == 413
+    assert post('title=long&text=' + 'a' * 600,
+        content_type='application/x-www-form-urlencoded').status == 413
+    # the limit is for text fields, not files
+    assert post(multipart([], [('large.bin', 'b' * 5000)])).status == 204
+
+def test_max_fields():
+    """
+    a form with more than form.max_fields fields and files is refused
+    """
+    config['form.max_fields'] = 3
+    setup_store()
+    setup_web()
+    assert post(multipart([('title', 'few'), ('text', 'a'),
+        ('tags', 'b')])).status == 204
+    assert post(multipart([('title', 'files'), ('text', 'a')],
+        [('one.bin', 'one'), ('two.bin', 'two')])).status == 413
+    assert post(multipart([('field%s' % index, 'x')
+        for index in range(100)])).status == 413
+
+def test_other_urls_left_to_core():
+    """
+    form POSTs to URLs other than bags and recipes tiddlers are parsed
+    by the core Query, without the form limits
+    """
+    config['form.max_body'] = 100
+    setup_store()
+    posted = []
+
+    def handler(environ, start_response):
+        posted.append(environ['tiddlyweb.query'])
+        start_response('204 No Content', [])
+        return []
+
+    body = CountingInput(multipart([('title', 'elsewhere'),
+        ('text', 'a' * 1000)]))
+    status = wsgi_post(body, content_length=len(body.stream.getvalue()),
+            path='/elsewhere', routes={'/elsewhere': handler})
+    assert status.startswith('204')
+    assert posted[0]['title'] == ['elsewhere']
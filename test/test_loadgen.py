@@ -0,0 +1,98 @@
+"""
+tests for the form load generator
+"""
+import json
+import os
+import tempfile
+
+from setup_test import setup_store
+
+from tiddlyweb.config import config
+from tiddlyweb.model.bag import Bag
+from tiddlyweb.model.recipe import Recipe
+
+from tiddlywebplugins.form import loadgen
+
+config['system_plugins'] = ['tiddlywebplugins.form']
+
+def setup_module(module):
+    config['server_prefix'] = ''
+
+def test_threads_in_process():
+    """
+    a mix of POSTs is spread over several bags and reported
+    """
+    store = setup_store()
+    summary = loadgen.run(config, requests=30, concurrency=4, bags=3,
+        mix='urlencoded=1,multipart=1,redirect=1', size=2048, seed=1)
+
+    assert summary['requests'] == 30
+    assert summary['errors'] == 0
+    assert sorted(summary['statuses']) == ['204', '303']
+    assert sorted(summary['kinds']) == ['multipart', 'redirect',
+        'urlencoded']
+    assert summary['statuses']['303'] == summary['kinds']['redirect'][
+        'requests']
+    assert summary['contention']['conflicts'] == 0
+    assert summary['latency_ms']['p50'] <= summary['latency_ms']['max']
+
+    for index in range(3):
+        bag = Bag('formload%s' % index)
+        assert len(list(store.list_bag_tiddlers(bag))) == 10
+
+    lines = loadgen.report(summary)
+    assert lines[1].startswith('30 requests in ')
+
+def test_processes_and_output():
+    """
+    a pool of processes can be used, and the results written as JSON
+    """
+    setup_store()
+    handle, output = tempfile.mkstemp()
+    os.close(handle)
+    try:
+        summary = loadgen.main(['--requests', '6', '--concurrency', '2',
+            '--processes', '--mix', 'urlencoded', '--output', output],
+            config)
+        assert summary['workers'] == 'processes'
+        assert summary['statuses'] == {'204': 6}
+        with open(output) as results:
+            assert json.load(results)['requests'] == 6
+    finally:
+        os.unlink(output)
+
+def test_recipes():
+    """
+    with recipes, POSTs go through a recipe for each bag
+    """
+    store = setup_store()
+    summary = loadgen.run(config, requests=8, concurrency=2, bags=2,
+        mix='urlencoded=1,multipart=1', seed=2, recipes=True)
+    assert summary['route'] == 'recipes'
+    assert summary['statuses'] == {'204': 8}
+    assert [list(entry) for entry in store.get(
+        Recipe('formload1')).get_recipe()] == [['formload1', '']]
+    for index in range(2):
+        bag = Bag('formload%s' % index)
+        assert len(list(store.list_bag_tiddlers(bag))) == 4
+
+def test_command_registered():
+    """
+    formload is a twanager command once the plugin is initialised
+    """
+    from tiddlyweb import manage
+    from tiddlywebplugins import form
+    twanager_config = dict(config)
+    twanager_config.pop('selector', None)
+    form.init(twanager_config)
+    assert 'formload' in manage.COMMANDS
+
+def test_bad_mix():
+    """
+    unknown kinds of POST are refused
+    """
+    try:
+        loadgen.parse_mix('urlencoded=1,unknown=2')
+        assert False, 'unknown kind should be refused'
+    except ValueError:
+        pass
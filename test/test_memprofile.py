@@ -0,0 +1,182 @@
+"""
+tests for peak memory profiling of form POSTs, and ceilings on the
+memory used per byte uploaded
+"""
+import json
+import os
+import shutil
+import tempfile
+
+from setup_test import (MULTIPART_TYPE, multipart_body, setup_store,
+    setup_web)
+
+from tiddlyweb.config import config
+
+from tiddlywebplugins.form import memprofile
+
+import httplib2
+
+config['system_plugins'] = ['tiddlywebplugins.form']
+
+SIZE = 1024 * 1024
+
+# most bytes allocated at once per byte of request body
+BINARY_CEILING = 6
+TEXT_CEILING = 12
+# most bytes the resident set grows by per byte of request body, which
+# also counts what the allocator keeps and, on Python 2, unicode text
+# held at four bytes a character. A binary upload larger than
+# form.spool_size goes from disk to the blob store, so it is never held
+# in memory whole.
+RSS_BINARY_CEILING = 1
+RSS_TEXT_CEILING = 24
+
+def setup_module(module):
+    config['server_prefix'] = ''
+    config['form.memory_profile'] = True
+    handle, module.REPORT = tempfile.mkstemp()
+    os.close(handle)
+    config['form.memory_report'] = module.REPORT
+    module.BLOB_DIR = tempfile.mkdtemp()
+    config['form.blob_dir'] = module.BLOB_DIR
+
+def teardown_module(module):
+    del config['form.memory_profile']
+    del config['form.memory_report']
+    del config['form.blob_dir']
+    os.unlink(module.REPORT)
+    shutil.rmtree(module.BLOB_DIR)
+
+def last_report():
+    with open(REPORT) as report:
+        return json.loads(report.readlines()[-1])
+
+def ceiling(report, limit, rss_limit):
+    if report['backend'] == 'rss':
+        return rss_limit
+    return limit
+
+def post_text(title):
+    http = httplib2.Http()
+    return http.request('http://test_domain:8001/bags/foo/tiddlers',
+        method='POST',
+        headers={'Content-type': 'application/x-www-form-urlencoded'},
+        body='title=%s&text=Hi' % title)[0]
+
+def report_count():
+    with open(REPORT) as report:
+        return len(report.readlines())
+
+def test_without_tracemalloc():
+    """
+    without tracemalloc the resident set size is measured
+    """
+    original = memprofile.tracemalloc
+    memprofile.tracemalloc = None
+    try:
+        setup_store()
+        setup_web()
+        assert post_text('Resident').status == 204
+        report = last_report()
+        assert report['backend'] == 'rss'
+        assert report['peak'] >= 0
+        assert report['top'] == []
+    finally:
+        memprofile.tracemalloc = original
+
+def test_rss_without_proc():
+    """
+    without /proc the growth of ru_maxrss is measured
+    """
+    original = memprofile.tracemalloc, memprofile.STATUS_FILE
+    memprofile.tracemalloc = None
+    memprofile.STATUS_FILE = '/no/such/status'
+    try:
+        assert not memprofile.reset_peak()
+        assert memprofile.peak_rss() > 0
+        setup_store()
+        setup_web()
+        assert post_text('Usage').status == 204
+        assert last_report()['backend'] == 'rss'
+    finally:
+        memprofile.tracemalloc, memprofile.STATUS_FILE = original
+
+def test_without_any_backend():
+    """
+    with neither tracemalloc nor the resident set size, POSTs are
+    handled but not profiled
+    """
+    original = (memprofile.tracemalloc, memprofile.resource,
+        memprofile.STATUS_FILE)
+    memprofile.tracemalloc = memprofile.resource = None
+    memprofile.STATUS_FILE = '/no/such/status'
+    try:
+        setup_store()
+        setup_web()
+        count = report_count()
+        assert post_text('Unprofiled').status == 204
+        assert report_count() == count
+    finally:
+        (memprofile.tracemalloc, memprofile.resource,
+            memprofile.STATUS_FILE) = original
+
+def test_busy_not_serialized():
+    """
+    a POST made while another is being profiled does not wait, and is
+    not profiled
+    """
+    setup_store()
+    setup_web()
+    count = report_count()
+    assert memprofile._LOCK.acquire(False)
+    try:
+        assert post_text('Busy').status == 204
+    finally:
+        memprofile._LOCK.release()
+    assert report_count() == count
+    assert post_text('Idle').status == 204
+    assert report_count() == count + 1
+
+def test_binary_ceiling():
+    """
+    a binary upload does not take more than BINARY_CEILING bytes of
+    memory per byte uploaded
+    """
+    setup_store()
+    setup_web()
+    http = httplib2.Http()
+
+    content = ''.join(chr(byte) for byte in range(256)) * (SIZE // 256)
+    body = multipart_body([('title', 'binary')],
+        [('data.bin', 'application/octet-stream', content)])
+    response = http.request('http://test_domain:8001/bags/foo/tiddlers',
+        method='POST', headers={'Content-type': MULTIPART_TYPE},
+        body=body)[0]
+    assert response.status == 204
+
+    report = last_report()
+    assert report['bytes'] == len(body)
+    if report['backend'] == 'tracemalloc':
+        assert report['top']
+    assert report['ratio'] < ceiling(report, BINARY_CEILING,
+        RSS_BINARY_CEILING)
+
+def test_text_ceiling():
+    """
+    a urlencoded text post does not take more than TEXT_CEILING bytes
+    of memory per byte uploaded
+    """
+    setup_store()
+    setup_web()
+    http = httplib2.Http()
+
+    body = 'title=text&text=' + 'words%20' * (SIZE // 8)
+    response = http.request('http://test_domain:8001/bags/foo/tiddlers',
+        method='POST',
+        headers={'Content-type': 'application/x-www-form-urlencoded'},
+        body=body)[0]
+    assert response.status == 204
+
+    report = last_report()
+    assert report['bytes'] == len(body)
+    assert report['ratio'] < ceiling(report, TEXT_CEILING, RSS_TEXT_CEILING)
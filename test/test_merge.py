@@ -0,0 +1,139 @@
+"""
+tests for merging a form into the stored tiddler
+"""
+from setup_test import setup_store, setup_web
+
+from tiddlyweb.config import config
+from tiddlyweb.model.bag import Bag
+from tiddlyweb.model.tiddler import Tiddler
+
+import httplib2
+
+config['system_plugins'] = ['tiddlywebplugins.form']
+
+def setup_tiddler(store):
+    tiddler = Tiddler('Merged', 'bar')
+    tiddler.text = 'a long text'
+    tiddler.type = 'text/x-markdown'
+    tiddler.tags = ['one', 'two', 'three']
+    tiddler.fields['colour'] = 'red'
+    tiddler.fields['size'] = 'large'
+    store.put(tiddler)
+    return store.get(Tiddler('Merged', 'bar'))
+
+def post(http, url, body):
+    return http.request(url, method='POST',
+        headers={'Content-type': 'application/x-www-form-urlencoded'},
+        body=body)[0]
+
+def test_merge_fields_and_tags():
+    """
+    only the keys in the form are changed, and tags can be added
+    and removed
+    """
+    store = setup_store()
+    setup_web()
+    http = httplib2.Http()
+    original = setup_tiddler(store)
+
+    response = post(http, 'http://test_domain:8001/bags/bar/tiddlers',
+        'title=Merged&_merge=1&colour=blue'
+        '&_add_tags=four%20[[five%20six]]%20one&_remove_tags=two')
+    assert response.status == 204
+
+    tiddler = store.get(Tiddler('Merged', 'bar'))
+    assert tiddler.text == 'a long text'
+    assert tiddler.type == 'text/x-markdown'
+    assert sorted(tiddler.tags) == ['five six', 'four', 'one', 'three']
+    assert tiddler.fields['colour'] == 'blue'
+    assert tiddler.fields['size'] == 'large'
+    assert '_merge' not in tiddler.fields
+    assert '_add_tags' not in tiddler.fields
+    assert tiddler.created == original.created
+    assert tiddler.revision != original.revision
+
+def test_merge_by_query_via_recipe():
+    """
+    merge mode may be asked for in the query string, and a recipe
+    merges into the bag it would put the tiddler in
+    """
+    store = setup_store()
+    setup_web()
+    http = httplib2.Http()
+    setup_tiddler(store)
+
+    response = post(http,
+        'http://test_domain:8001/recipes/foobar/tiddlers?_merge=true',
+        'title=Merged&text=short&tags=replaced')
+    assert response.status == 204
+
+    tiddler = store.get(Tiddler('Merged', 'bar'))
+    assert tiddler.text == 'short'
+    assert tiddler.type == 'text/x-markdown'
+    assert tiddler.tags == ['replaced']
+    assert tiddler.fields['colour'] == 'red'
+
+def test_merge_missing_or_off():
+    """
+    there must be a tiddler to merge into, and _merge=0 replaces
+    the tiddler as usual
+    """
+    store = setup_store()
+    setup_web()
+    http = httplib2.Http()
+    setup_tiddler(store)
+
+    response = post(http, 'http://test_domain:8001/bags/foo/tiddlers',
+        'title=Nothing&_merge=1&colour=blue')
+    assert response.status == 404
+
+    response = post(http, 'http://test_domain:8001/bags/bar/tiddlers',
+        'title=Merged&_merge=0&colour=blue')
+    assert response.status == 204
+    tiddler = store.get(Tiddler('Merged', 'bar'))
+    assert tiddler.text == ''
+    assert tiddler.tags == []
+    assert tiddler.fields == {'colour': 'blue'}
+
+def test_merge_rows():
+    """
+    rows of a bulk form are merged, and the merge options are never
+    kept as fields
+    """
+    store = setup_store()
+    setup_web()
+    http = httplib2.Http()
+    setup_tiddler(store)
+
+    response = post(http, 'http://test_domain:8001/bags/bar/tiddlers',
+        'title.0=Merged&_merge.0=1&colour.0=green&_add_tags.0=four'
+        '&title.1=Fresh&text.1=new&_add_tags=ignored')
+    assert response.status == 200
+
+    merged = store.get(Tiddler('Merged', 'bar'))
+    assert merged.text == 'a long text'
+    assert merged.fields['colour'] == 'green'
+    assert sorted(merged.tags) == ['four', 'one', 'three', 'two']
+    fresh = store.get(Tiddler('Fresh', 'bar'))
+    assert fresh.text == 'new'
+    for tiddler in [merged, fresh]:
+        for key in ['_merge', '_add_tags', '_remove_tags']:
+            assert key not in tiddler.fields
+
+def test_merge_checks_policy_first():
+    """
+    a user who may not read the bag can not learn whether a tiddler
+    is there by merging into it
+    """
+    store = setup_store()
+    setup_web()
+    http = httplib2.Http()
+    setup_tiddler(store)
+    bag = store.get(Bag('bar'))
+    bag.policy.read = ['R:ADMIN']
+    store.put(bag)
+
+    for title in ['Merged', 'Nothing']:
+        response = post(http, 'http://test_domain:8001/bags/bar/tiddlers',
+            'title=%s&_merge=1&colour=blue' % title)
+        assert response.status == 403
@@ -0,0 +1,162 @@
+"""
+tests that form POSTs the user may not make are refused before their
+body is read
+"""
+import sys
+from base64 import b64encode
+
+from setup_test import setup_store, setup_web
+
+from tiddlyweb.config import config
+from tiddlyweb.model.bag import Bag
+from tiddlyweb.model.recipe import Recipe
+from tiddlyweb.model.tiddler import Tiddler
+from tiddlyweb.model.user import User
+from tiddlyweb.web import serve
+
+import httplib2
+
+config['system_plugins'] = ['tiddlywebplugins.form']
+
+BODY = 'title=Refused&text=Hi'
+
+class UnreadInput(object):
+    """
+    A wsgi.input that records whether it was read.
+    """
+
+    def __init__(self, body):
+        self.body = body
+        self.read_from = False
+
+    def read(self, size=-1):
+        self.read_from = True
+        body, self.body = self.body, ''
+        return body
+
+    def readline(self, size=-1):
+        return self.read(size)
+
+def setup_module(module):
+    config['server_prefix'] = ''
+
+def lock_bag(store, name, constraints=['create', 'write'], users=['R:ADMIN']):
+    bag = store.get(Bag(name))
+    for constraint in constraints:
+        setattr(bag.policy, constraint, users)
+    store.put(bag)
+
+def post(path, stream, headers=None):
+    environ = {
+        'REQUEST_METHOD': 'POST',
+        'SCRIPT_NAME': '',
+        'PATH_INFO': path,
+        'QUERY_STRING': '',
+        'SERVER_NAME': 'test_domain',
+        'SERVER_PORT': '8001',
+        'SERVER_PROTOCOL': 'HTTP/1.1',
+        'REMOTE_ADDR': '127.0.0.1',
+        'CONTENT_TYPE': 'application/x-www-form-urlencoded',
+        'CONTENT_LENGTH': str(len(stream.body)),
+        'wsgi.input': stream,
+        'wsgi.errors': sys.stderr,
+        'wsgi.url_scheme': 'http',
+        'wsgi.multithread': False,
+        'wsgi.multiprocess': False,
+        'wsgi.run_once': False,
+    }
+    environ.update(headers or {})
+    status = []
+
+    def start_response(response_status, headers, exc_info=None):
+        status.append(response_status)
+
+    ''.join(serve.load_app()(environ, start_response))
+    return int(status[0].split(' ', 1)[0])
+
+def test_bag_refused_unread():
+    """
+    a guest POSTing to a bag they may not create or write in is
+    refused, and the body is never read
+    """
+    store = setup_store()
+    lock_bag(store, 'foo')
+
+    stream = UnreadInput(BODY)
+    assert post('/bags/foo/tiddlers', stream) == 403
+    assert not stream.read_from
+
+    stream = UnreadInput(BODY)
+    assert post('/bags/bar/tiddlers', stream) == 204
+    assert stream.read_from
+    store.get(Tiddler('Refused', 'bar'))
+
+def test_bag_forbidden_unread():
+    """
+    a user that is not allowed is refused too
+    """
+    store = setup_store()
+    lock_bag(store, 'foo', users=['someone'])
+    user = User('other')
+    user.set_password('secret')
+    store.put(user)
+
+    stream = UnreadInput(BODY)
+    status = post('/bags/foo/tiddlers', stream, {'HTTP_AUTHORIZATION':
+        'Basic %s' % b64encode('other:secret')})
+    assert status == 403
+    assert not stream.read_from
+
+def test_write_or_create_is_enough():
+    """
+    the body is read if either create or write is allowed, leaving the
+    full check to the handler
+    """
+    store = setup_store()
+    lock_bag(store, 'foo', constraints=['create'])
+
+    stream = UnreadInput(BODY)
+    status = post('/bags/foo/tiddlers', stream)
+    assert stream.read_from
+    assert status == 403
+
+def test_recipe_refused_unread():
+    """
+    a POST to a recipe is refused unread only if no bag a tiddler
+    could go to would take it
+    """
+    store = setup_store()
+    lock_bag(store, 'bar')
+
+    stream = UnreadInput(BODY)
+    assert post('/recipes/foobar/tiddlers', stream) == 403
+    assert not stream.read_from
+
+    # foo is never reached, as bar takes every tiddler
+    lock_bag(store, 'foo')
+    lock_bag(store, 'bar', users=[])
+    stream = UnreadInput(BODY)
+    assert post('/recipes/foobar/tiddlers', stream) == 204
+    assert stream.read_from
+
+    # bags before a filtered bag may take the tiddler
+    recipe = Recipe('foobar')
+    recipe.set_recipe([('bar', ''), ('foo', 'select=tag:foo')])
+    store.put(recipe)
+    stream = UnreadInput(BODY)
+    assert post('/recipes/foobar/tiddlers', stream) == 204
+    assert stream.read_from
+    store.get(Tiddler('Refused', 'bar'))
+
+def test_missing_bag_left_to_handler():
+    """
+    a missing bag is reported by the handler as before
+    """
+    setup_store()
+    setup_web()
+    http = httplib2.Http()
+    response = http.request('http://test_domain:8001/bags/nothing/tiddlers',
+        method='POST',
+        headers={'Content-type': 'application/x-www-form-urlencoded'},
+        body=BODY)[0]
+    assert response.status == 409
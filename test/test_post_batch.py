@@ -0,0 +1,116 @@
+"""
+tests to ensure several files uploaded in one form become several tiddlers
+"""
+import json
+
+from setup_test import (MULTIPART_TYPE, multipart_body, setup_store,
+    setup_web)
+
+from tiddlyweb.config import config
+from tiddlyweb.model.bag import Bag
+from tiddlyweb.model.tiddler import Tiddler
+from tiddlyweb.store import NoTiddlerError
+
+import httplib2
+
+config['system_plugins'] = ['tiddlywebplugins.form']
+
+def batch_body(extra_fields=None):
+    """
+    build a multipart body holding two files and any extra fields
+    """
+    return multipart_body(extra_fields or [],
+        [('one.txt', 'text/plain', 'first file'),
+        ('two.txt', 'text/plain', 'second file')])
+
+def test_upload_several_files():
+    """
+    upload two files to a bag with shared tags
+    """
+    store = setup_store()
+    setup_web()
+    http = httplib2.Http()
+
+    response, content = http.request(
+        'http://test_domain:8001/bags/foo/tiddlers',
+        method='POST',
+        headers={'Content-type': MULTIPART_TYPE},
+        body=batch_body([('tags', 'upload [[shared tag]]')]))
+    assert response.status == 200
+    assert response['content-type'].startswith('text/uri-list')
+    uris = content.split('\r\n')[:-1]
+    assert len(uris) == 2
+    assert uris[0].endswith('/bags/foo/tiddlers/one.txt')
+    assert uris[1].endswith('/bags/foo/tiddlers/two.txt')
+
+    for title, text in [('one.txt', 'first file'),
+            ('two.txt', 'second file')]:
+        try:
+            tiddler = store.get(Tiddler(title, 'foo'))
+        except NoTiddlerError:
+            raise AssertionError('tiddler %s not put into store' % title)
+        assert tiddler.text == text
+        assert sorted(tiddler.tags) == ['shared tag', 'upload']
+
+def test_upload_several_files_to_recipe():
+    """
+    upload two files to a recipe and redirect afterwards
+    """
+    store = setup_store()
+    setup_web()
+    http = httplib2.Http()
+    http.follow_redirects = False
+
+    response = http.request(
+        'http://test_domain:8001/recipes/foobar/tiddlers',
+        method='POST',
+        headers={'Content-type': MULTIPART_TYPE},
+        body=batch_body([('redirect', '/bags/bar/tiddlers')]))[0]
+    assert response.status == 303
+    assert response['location'].split('?')[0] == '/bags/bar/tiddlers'
+
+    bag = store.get(Bag('bar'))
+    titles = sorted(tiddler.title for tiddler in store.list_bag_tiddlers(bag))
+    assert titles == ['one.txt', 'two.txt']
+
+def test_upload_several_files_denied():
+    """
+    no tiddler is written when the bag policy refuses the upload
+    """
+    store = setup_store()
+    setup_web()
+    http = httplib2.Http()
+
+    bag = store.get(Bag('foo'))
+    bag.policy.create = ['NONE']
+    store.put(bag)
+
+    response = http.request(
+        'http://test_domain:8001/bags/foo/tiddlers',
+        method='POST',
+        headers={'Content-type': MULTIPART_TYPE},
+        body=batch_body())[0]
+    assert response.status == 403
+
+    assert list(store.list_bag_tiddlers(bag)) == []
+
+def test_upload_several_files_metadata():
+    """
+    a .json route gets a JSON list describing each tiddler put
+    """
+    setup_store()
+    setup_web()
+    http = httplib2.Http()
+
+    response, content = http.request(
+        'http://test_domain:8001/bags/foo/tiddlers.json',
+        method='POST',
+        headers={'Content-type': MULTIPART_TYPE},
+        body=batch_body())
+    assert response.status == 201
+    metadata = json.loads(content)
+    assert [item['title'] for item in metadata] == ['one.txt', 'two.txt']
+    for item in metadata:
+        assert item['bag'] == 'foo'
+        assert item['etag'].startswith('"foo/%s/' % item['title'])
+        assert item['uri'].endswith('/bags/foo/tiddlers/%s' % item['title'])
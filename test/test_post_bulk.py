@@ -0,0 +1,92 @@
+"""
+tests to ensure indexed form fields create several tiddlers in one POST
+"""
+
+from setup_test import setup_store, setup_web
+
+from tiddlyweb.config import config
+from tiddlyweb.model.bag import Bag
+from tiddlyweb.model.tiddler import Tiddler
+from tiddlyweb.store import NoTiddlerError
+
+import httplib2
+
+config['system_plugins'] = ['tiddlywebplugins.form']
+
+def test_post_bulk():
+    """
+    post three rows to a bag, with a field shared by all of them
+    """
+    store = setup_store()
+    setup_web()
+    http = httplib2.Http()
+
+    response, content = http.request(
+        'http://test_domain:8001/bags/foo/tiddlers',
+        method='POST',
+        headers={'Content-type': 'application/x-www-form-urlencoded'},
+        body='source=import&'
+            'title.0=First&text.0=one&tags.0=a%20[[b%20c]]&'
+            'title.1=Second&text.1=two&colour.1=red&'
+            'title.10=Third&text.10=three')
+    assert response.status == 200
+    uris = content.split('\r\n')[:-1]
+    assert [uri.rsplit('/', 1)[1] for uri in uris] == \
+        ['First', 'Second', 'Third']
+
+    first = store.get(Tiddler('First', 'foo'))
+    assert first.text == 'one'
+    assert sorted(first.tags) == ['a', 'b c']
+    assert first.fields == {'source': 'import'}
+
+    second = store.get(Tiddler('Second', 'foo'))
+    assert second.text == 'two'
+    assert second.tags == []
+    assert second.fields == {'source': 'import', 'colour': 'red'}
+
+    third = store.get(Tiddler('Third', 'foo'))
+    assert third.text == 'three'
+
+def test_post_bulk_untitled_row():
+    """
+    a row without a title is still stored, with a uuid title
+    """
+    store = setup_store()
+    setup_web()
+    http = httplib2.Http()
+
+    response = http.request('http://test_domain:8001/bags/foo/tiddlers',
+        method='POST',
+        headers={'Content-type': 'application/x-www-form-urlencoded'},
+        body='title.0=First&text.0=one&text.1=untitled')[0]
+    assert response.status == 200
+
+    bag = store.get(Bag('foo'))
+    tiddlers = [store.get(tiddler) for tiddler
+            in store.list_bag_tiddlers(bag)]
+    assert sorted(tiddler.text for tiddler in tiddlers) == \
+        ['one', 'untitled']
+
+def test_post_bulk_to_recipe_with_redirect():
+    """
+    post rows to a recipe and be redirected afterwards
+    """
+    store = setup_store()
+    setup_web()
+    http = httplib2.Http()
+    http.follow_redirects = False
+
+    response = http.request('http://test_domain:8001/recipes/foobar/tiddlers',
+        method='POST',
+        headers={'Content-type': 'application/x-www-form-urlencoded'},
+        body='title.0=First&text.0=one&title.1=Second&text.1=two&'
+            'redirect=/bags/bar/tiddlers')[0]
+    assert response.status == 303
+    assert response['location'].split('?')[0] == '/bags/bar/tiddlers'
+
+    for title in ['First', 'Second']:
+        try:
+            tiddler = store.get(Tiddler(title, 'bar'))
+        except NoTiddlerError:
+            raise AssertionError('tiddler %s not put into store' % title)
+        assert tiddler.fields.get('redirect') is None
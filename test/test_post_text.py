@@ -1,6 +1,7 @@
 """
 tests to ensure non binary tiddlers are inserted properly when POSTed
 """
+import json
 
 from setup_test import setup_store, setup_web
 
@@ -283,3 +284,70 @@ Hi There
     assert tiddler.title == 'HelloWorld'
     assert tiddler.text == 'Hi There'
     assert len(tiddler.tags) == 2
+
+def test_post_etag():
+    """
+    the response carries the new tiddler's ETag, and If-Match is
+    checked as it would be for a PUT
+    """
+    store = setup_store()
+    setup_web()
+    http = httplib2.Http()
+
+    response = http.request('http://test_domain:8001/bags/foo/tiddlers',
+        method='POST',
+        headers={'Content-type': 'application/x-www-form-urlencoded'},
+        body='title=HelloWorld&text=Hi%20There')[0]
+    assert response.status == 204
+    assert response['etag'].startswith('"foo/HelloWorld/1:')
+    assert response['location'].endswith('/bags/foo/tiddlers/HelloWorld')
+
+    response = http.request('http://test_domain:8001/bags/foo/tiddlers',
+        method='POST',
+        headers={'Content-type': 'application/x-www-form-urlencoded',
+            'If-Match': '"foo/HelloWorld/5"'},
+        body='title=HelloWorld&text=Changed')[0]
+    assert response.status == 412
+
+    response = http.request('http://test_domain:8001/bags/foo/tiddlers',
+        method='POST',
+        headers={'Content-type': 'application/x-www-form-urlencoded',
+            'If-Match': '"foo/HelloWorld/1"'},
+        body='title=HelloWorld&text=Changed')[0]
+    assert response.status == 204
+
+    tiddler = store.get(Tiddler('HelloWorld', 'foo'))
+    assert tiddler.text == 'Changed'
+
+def test_post_metadata_response():
+    """
+    a client that asks for JSON gets 201 and the title, bag, revision
+    and ETag of the tiddler put, while browsers still get 204
+    """
+    store = setup_store()
+    setup_web()
+    http = httplib2.Http()
+
+    response, content = http.request(
+        'http://test_domain:8001/recipes/foobar/tiddlers',
+        method='POST',
+        headers={'Content-type': 'application/x-www-form-urlencoded',
+            'Accept': 'application/json'},
+        body='text=Untitled')
+    assert response.status == 201
+    assert response['content-type'].startswith('application/json')
+    metadata = json.loads(content)
+    assert metadata['bag'] == 'bar'
+    assert metadata['recipe'] == 'foobar'
+    assert metadata['revision'] == 1
+    assert metadata['etag'] == response['etag']
+    assert metadata['uri'] == response['location']
+    assert store.get(Tiddler(metadata['title'], 'bar')).text == 'Untitled'
+
+    response = http.request('http://test_domain:8001/bags/foo/tiddlers',
+        method='POST',
+        headers={'Content-type': 'application/x-www-form-urlencoded',
+            'Accept': 'text/html,application/xhtml+xml,'
+                'application/xml;q=0.9,*/*;q=0.8'},
+        body='title=Browser&text=Hi')[0]
+    assert response.status == 204
@@ -0,0 +1,130 @@
+"""
+tests for rate limits on form POSTs
+"""
+import os
+import shutil
+import tempfile
+
+from setup_test import setup_store, setup_web
+
+from tiddlyweb.config import config
+from tiddlyweb.model.tiddler import Tiddler
+from tiddlyweb.store import NoTiddlerError
+
+from tiddlywebplugins.form import ratelimit
+
+import httplib2
+
+config['system_plugins'] = ['tiddlywebplugins.form']
+
+SETTINGS = ['form.rate_user', 'form.rate_address', 'form.rate_bag',
+        'form.rate_backend', 'form.rate_path']
+
+def setup_function(function):
+    ratelimit._BUCKETS.clear()
+
+def teardown_function(function):
+    for key in SETTINGS:
+        config.pop(key, None)
+
+def post(http, url, title):
+    return http.request(url, method='POST',
+        headers={'Content-type': 'application/x-www-form-urlencoded'},
+        body='title=%s&text=Hi' % title)[0]
+
+def test_bag_limit():
+    """
+    POSTs over the limit of a bag get 429 and are not stored, while
+    other bags are not limited
+    """
+    config['form.rate_bag'] = (2, 60)
+    store = setup_store()
+    setup_web()
+    http = httplib2.Http()
+
+    url = 'http://test_domain:8001/bags/foo/tiddlers'
+    assert post(http, url, 'one').status == 204
+    assert post(http, url, 'two').status == 204
+    response = post(http, url, 'three')
+    assert response.status == 429
+    assert 25 <= int(response['retry-after']) <= 30
+    try:
+        store.get(Tiddler('three', 'foo'))
+        assert False, 'a limited POST should not be stored'
+    except NoTiddlerError:
+        pass
+
+    assert post(http, 'http://test_domain:8001/recipes/foobar/tiddlers',
+        'other').status == 204
+    # GETs and PUTs are not limited
+    response = http.request('http://test_domain:8001/bags/foo/tiddlers/one')[0]
+    assert response.status == 200
+
+def test_address_and_user_limits():
+    """
+    guests are limited by address only
+    """
+    config['form.rate_user'] = (1, 60)
+    config['form.rate_address'] = (3, 60)
+    setup_store()
+    setup_web()
+    http = httplib2.Http()
+
+    url = 'http://test_domain:8001/bags/foo/tiddlers'
+    for title in ['one', 'two', 'three']:
+        assert post(http, url, title).status == 204
+    assert post(http, url, 'four').status == 429
+
+def test_buckets_refill():
+    """
+    a bucket refills at requests per seconds, and a request is only
+    counted when every bucket has a token
+    """
+    buckets = ratelimit.MemoryBuckets()
+    both = [('a', 2.0, 10.0), ('b', 1.0, 10.0)]
+    assert buckets.take(both, 100) == 0
+    assert buckets.take([('a', 2.0, 10.0)], 100) == 0
+    assert buckets.take(both, 100) == 10
+    assert buckets.take([('b', 1.0, 10.0)], 105) == 5
+    assert buckets.take(both, 110) == 0
+
+def test_shared_backends():
+    """
+    the file and sqlite backends are shared by every instance using
+    the same path, as they would be by several processes
+    """
+    directory = tempfile.mkdtemp()
+    try:
+        for make in [
+                lambda: ratelimit.FileBuckets(
+                    os.path.join(directory, 'buckets')),
+                lambda: ratelimit.SQLiteBuckets(
+                    os.path.join(directory, 'buckets.db'))]:
+            first, second = make(), make()
+            bucket = [(u'user:\xe9', 2.0, 60.0)]
+            assert first.take(bucket, 100) == 0
+            assert second.take(bucket, 100) == 0
+            assert first.take(bucket, 100) == 30
+            assert second.take(bucket, 130) == 0
+    finally:
+        shutil.rmtree(directory)
+
+def test_configured_backend():
+    """
+    form.rate_backend chooses where the buckets are kept
+    """
+    directory = tempfile.mkdtemp()
+    try:
+        config['form.rate_bag'] = (1, 60)
+        config['form.rate_backend'] = 'sqlite'
+        config['form.rate_path'] = os.path.join(directory, 'limits.db')
+        setup_store()
+        setup_web()
+        http = httplib2.Http()
+
+        url = 'http://test_domain:8001/bags/foo/tiddlers'
+        assert post(http, url, 'one').status == 204
+        assert post(http, url, 'two').status == 429
+        assert os.path.exists(config['form.rate_path'])
+    finally:
+        shutil.rmtree(directory)
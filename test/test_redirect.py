@@ -1,12 +1,16 @@
 """
 tests to ensure that the optional redirect works properly
 """
+import shutil
+import tempfile
 
 from setup_test import setup_store, setup_web
 
 from tiddlyweb.model.tiddler import Tiddler
 from tiddlyweb.config import config
 
+from tiddlywebplugins.form import writebehind
+
 import httplib2
 
 config['system_plugins'] = ['tiddlywebplugins.form']
@@ -87,3 +91,91 @@ def test_unicode_redirect():
 
     #check that we get a 303 response
     assert response.status == 303
+
+def post_with_redirect(http, title, text, container='recipes/foobar'):
+    http.follow_redirects = False
+    return http.request('http://test_domain:8001/%s/tiddlers' % container,
+        method='POST',
+        headers={'Content-type': 'application/x-www-form-urlencoded'},
+        body='title=%s&text=%s&redirect=/bags/foo/tiddlers' % (title,
+            text))[0]
+
+def test_revision_redirect():
+    """
+    with form.redirect_cache set to revision, the redirect names the
+    revision stored, so it changes with every write, even of content
+    the tiddler held before
+    """
+    config['form.redirect_cache'] = 'revision'
+    try:
+        setup_store()
+        setup_web()
+        http = httplib2.Http()
+
+        first = post_with_redirect(http, 'HelloWorld', 'one')['location']
+        second = post_with_redirect(http, 'HelloWorld', 'two')['location']
+        again = post_with_redirect(http, 'HelloWorld', 'one')['location']
+        other = post_with_redirect(http, 'Other', 'one')['location']
+        assert '.no-cache=' in first
+        assert len(set([first, second, again, other])) == 4
+    finally:
+        del config['form.redirect_cache']
+
+def test_revision_redirect_write_behind():
+    """
+    with form.write_behind set there is no revision when the redirect
+    is sent, so revision mode uses the bag count
+    """
+    directory = tempfile.mkdtemp()
+    config['form.redirect_cache'] = 'revision'
+    config['form.counter_dir'] = directory
+    config['form.write_behind'] = True
+    try:
+        setup_store()
+        setup_web()
+        http = httplib2.Http()
+
+        first = post_with_redirect(http, 'HelloWorld', 'one')['location']
+        second = post_with_redirect(http, 'HelloWorld', 'one')['location']
+        assert first.endswith('.no-cache=bar:1')
+        assert second.endswith('.no-cache=bar:2')
+    finally:
+        del config['form.redirect_cache']
+        del config['form.counter_dir']
+        del config['form.write_behind']
+        writebehind.shutdown()
+        shutil.rmtree(directory)
+
+def test_counter_redirect():
+    """
+    with form.redirect_cache set to counter, the redirect carries the
+    bag name and its count of form POSTs with a redirect
+    """
+    directory = tempfile.mkdtemp()
+    config['form.redirect_cache'] = 'counter'
+    config['form.counter_dir'] = directory
+    try:
+        setup_store()
+        setup_web()
+        http = httplib2.Http()
+
+        first = post_with_redirect(http, 'HelloWorld', 'one')['location']
+        second = post_with_redirect(http, 'Other', 'one')['location']
+        other_bag = post_with_redirect(http, 'Third', 'one',
+            container='bags/foo')['location']
+        assert first.endswith('.no-cache=bar:1')
+        assert second.endswith('.no-cache=bar:2')
+        assert other_bag.endswith('.no-cache=foo:1')
+
+        # POSTs without a redirect are not counted
+        response = http.request('http://test_domain:8001/bags/bar/tiddlers',
+            method='POST',
+            headers={'Content-type': 'application/x-www-form-urlencoded'},
+            body='title=Quiet&text=one')[0]
+        assert response.status == 204
+        assert post_with_redirect(http, 'Fourth', 'one')['location'].endswith(
+            '.no-cache=bar:3')
+    finally:
+        del config['form.redirect_cache']
+        del config['form.counter_dir']
+        shutil.rmtree(directory)
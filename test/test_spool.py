@@ -0,0 +1,97 @@
+"""
+tests to ensure uploads are spooled to disk above the configured size
+"""
+import os
+import shutil
+import tempfile
+
+from setup_test import (MULTIPART_TYPE, multipart_body, setup_store,
+    setup_web)
+
+from tiddlyweb.config import config
+from tiddlyweb.model.tiddler import Tiddler
+
+from tiddlywebplugins.form.blobs import BlobStore
+from tiddlywebplugins.form.spool import SpoolFile
+
+import httplib2
+
+config['system_plugins'] = ['tiddlywebplugins.form']
+
+def test_spool_stays_in_memory():
+    """
+    data smaller than max_size is not written to disk
+    """
+    spool = SpoolFile(max_size=100)
+    spool.write('a' * 50)
+    assert not spool.rolled
+
+    spool.write('a' * 100)
+    assert spool.rolled
+    assert os.path.exists(spool.name)
+
+    spool.seek(0)
+    assert spool.read() == 'a' * 150
+
+def test_spool_persist():
+    """
+    persisting a spool makes its data available at the new path
+    whether it is in memory or on disk
+    """
+    directory = tempfile.mkdtemp()
+
+    small = SpoolFile(max_size=100, dir=directory)
+    small.write('small')
+    small.persist(os.path.join(directory, 'small'))
+    assert open(os.path.join(directory, 'small')).read() == 'small'
+
+    large = SpoolFile(max_size=100, dir=directory)
+    large.write('b' * 500)
+    large.persist(os.path.join(directory, 'large'))
+    large.close()
+    assert open(os.path.join(directory, 'large')).read() == 'b' * 500
+
+def post_file(http, title, content):
+    return http.request('http://test_domain:8001/bags/foo/tiddlers',
+        method='POST', headers={'Content-type': MULTIPART_TYPE},
+        body=multipart_body(files=[(title, 'application/octet-stream',
+            content)]))[0]
+
+def test_upload_larger_than_spool():
+    """
+    upload a file bigger than form.spool_size and check it is stored
+    intact, as a blob moved from its spool file, unless
+    form.blob_threshold keeps it in the text
+    """
+    blob_dir = tempfile.mkdtemp()
+    config['form.spool_size'] = 2048
+    config['form.blob_dir'] = blob_dir
+    try:
+        store = setup_store()
+        setup_web()
+        http = httplib2.Http()
+
+        binary_data = ''.join(chr(index % 256) for index in range(8192))
+        assert post_file(http, 'test.bin', binary_data).status == 204
+        assert post_file(http, 'small.bin', 'small').status == 204
+
+        tiddler = store.get(Tiddler('test.bin', 'foo'))
+        assert tiddler.text == ''
+        digest = tiddler.fields['_form_blob']
+        assert open(BlobStore(blob_dir).path(digest), 'rb').read() == (
+            binary_data)
+        response, content = http.request('http://test_domain:8001%s'
+            % tiddler.fields['_canonical_uri'])
+        assert content == binary_data
+        assert store.get(Tiddler('small.bin', 'foo')).text == 'small'
+
+        config['form.blob_threshold'] = 10000
+        assert post_file(http, 'text.bin', binary_data).status == 204
+        tiddler = store.get(Tiddler('text.bin', 'foo'))
+        assert tiddler.text == binary_data
+        assert '_form_blob' not in tiddler.fields
+    finally:
+        for key in ['form.spool_size', 'form.blob_dir',
+                'form.blob_threshold']:
+            config.pop(key, None)
+        shutil.rmtree(blob_dir)
@@ -0,0 +1,45 @@
+"""
+tests for the tag parser
+"""
+
+from tiddlywebplugins.form.tags import TagParser
+
+def test_parse_order():
+    """
+    tags come back in the order they appear, without duplicates
+    """
+    parser = TagParser()
+    assert parser.parse(u'b a [[c d]] b a') == [u'b', u'a', u'c d']
+    assert parser.parse(u'') == []
+
+def test_parse_returns_copies():
+    """
+    changing a returned list does not change the cached result
+    """
+    parser = TagParser()
+    tags = parser.parse(u'one two')
+    tags.append(u'three')
+    assert parser.parse(u'one two') == [u'one', u'two']
+
+def test_tags_are_interned():
+    """
+    the same tag from different tag strings is the same object
+    """
+    parser = TagParser()
+    first = parser.parse(u'shared first')[0]
+    second = parser.parse(u'second shared')[1]
+    assert first == second
+    assert first is second
+
+def test_cache_is_bounded():
+    """
+    the cache holds at most two generations of cache_size entries,
+    and keeps strings that are still being used
+    """
+    parser = TagParser(cache_size=10)
+    for index in range(100):
+        parser.parse(u'common')
+        parser.parse(u'tag%s' % index)
+    assert len(parser._current) <= 10
+    assert len(parser._old) <= 10
+    assert u'common' in parser._current or u'common' in parser._old
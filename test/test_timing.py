@@ -0,0 +1,82 @@
+"""
+tests for timing of form POSTs
+"""
+import logging
+
+from setup_test import setup_store, setup_web
+
+from tiddlyweb.config import config
+
+from tiddlywebplugins.form.timing import Collector, phase, NULL_PHASE
+
+import httplib2
+
+config['system_plugins'] = ['tiddlywebplugins.form']
+
+class RecordingHandler(logging.Handler):
+
+    def __init__(self):
+        logging.Handler.__init__(self)
+        self.messages = []
+
+    def emit(self, record):
+        self.messages.append(record.getMessage())
+
+def test_phase_without_timing():
+    """
+    when a request is not timed, phase does nothing
+    """
+    assert phase({}, 'store') is NULL_PHASE
+
+def test_timing_collected():
+    """
+    timed POSTs are logged and counted by the collector
+    """
+    collector = Collector()
+    config['form.timing'] = True
+    config['form.timing_collector'] = collector
+    handler = RecordingHandler()
+    logger = logging.getLogger('tiddlywebplugins.form.timing')
+    logger.addHandler(handler)
+    logger.setLevel(logging.INFO)
+    try:
+        store = setup_store()
+        setup_web()
+        http = httplib2.Http()
+
+        response = http.request('http://test_domain:8001/bags/foo/tiddlers',
+            method='POST',
+            headers={'Content-type': 'application/x-www-form-urlencoded'},
+            body='title=HelloWorld&text=Hi%20There&tags=one%20two')[0]
+        assert response.status == 204
+
+        response = http.request(
+            'http://test_domain:8001/bags/missing/tiddlers',
+            method='POST',
+            headers={'Content-type': 'application/x-www-form-urlencoded'},
+            body='title=HelloWorld&text=Hi%20There')[0]
+        assert response.status == 409
+
+        # GETs are not timed
+        response = http.request(
+            'http://test_domain:8001/bags/foo/tiddlers/HelloWorld')[0]
+        assert response.status == 200
+    finally:
+        del config['form.timing']
+        del config['form.timing_collector']
+        logger.removeHandler(handler)
+
+    timing_lines = [message for message in handler.messages
+            if message.startswith('form timing')]
+    assert len(timing_lines) == 2
+    for name in ['parse', 'build', 'tags', 'policy', 'store', 'total']:
+        assert '%s_ms=' % name in timing_lines[0]
+    assert 'status=204' in timing_lines[0]
+    assert 'status=409' in timing_lines[1]
+
+    snapshot = collector.snapshot()
+    assert snapshot['requests'] == 2
+    assert snapshot['bytes_uploaded'] == 47 + 32
+    assert snapshot['errors'] == {'409': 1}
+    assert sum(snapshot['histograms']['total']) == 2
+    assert sum(snapshot['histograms']['store']) == 1
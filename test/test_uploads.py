@@ -0,0 +1,256 @@
+"""
+tests for resumable uploads in numbered parts
+"""
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import time
+from urlparse import urlparse
+
+from setup_test import setup_store, setup_web
+
+from tiddlyweb.config import config
+from tiddlyweb.model.bag import Bag
+from tiddlyweb.model.tiddler import Tiddler
+
+from tiddlywebplugins.form.uploads import upload_sessions
+
+import httplib2
+
+config['system_plugins'] = ['tiddlywebplugins.form']
+
+def setup_module(module):
+    module.UPLOAD_DIR = tempfile.mkdtemp()
+    config['form.upload_dir'] = module.UPLOAD_DIR
+
+def teardown_module(module):
+    del config['form.upload_dir']
+    shutil.rmtree(module.UPLOAD_DIR)
+
+def start(http, body, container='bags/foo'):
+    """
+    open an upload session, pointing its location at the test server
+    """
+    response = http.request('http://test_domain:8001/%s/tiddlers' % container,
+        method='POST',
+        headers={'Content-type': 'application/x-www-form-urlencoded'},
+        body=body)[0]
+    if 'location' in response:
+        response['location'] = ('http://test_domain:8001'
+            + urlparse(response['location']).path)
+    return response
+
+def put_part(http, location, number, content):
+    return http.request('%s/%s' % (location, number), method='PUT',
+        headers={'Content-type': 'application/octet-stream'},
+        body=content)[0]
+
+def test_upload_in_parts():
+    """
+    parts sent out of order, and a part sent twice, make one tiddler
+    """
+    store = setup_store()
+    setup_web()
+    http = httplib2.Http()
+
+    response = start(http, '_upload=start&title=big.bin&tags=one%20two'
+        '&type=application/octet-stream&note=hello')
+    assert response.status == 201
+    location = response['location']
+    assert '/form/uploads/' in location
+
+    assert put_part(http, location, 3, 'ccc').status == 204
+    assert put_part(http, location, 1, 'xxx').status == 204
+    # a retried part replaces the earlier copy
+    assert put_part(http, location, 1, 'aaa').status == 204
+    assert put_part(http, location, 2, 'bbb').status == 204
+
+    response, content = http.request(location, method='GET')
+    assert response.status == 200
+    status = json.loads(content)
+    assert status['parts'] == {'1': 3, '2': 3, '3': 3}
+    assert status['size'] == 9
+
+    response = http.request(location, method='POST')[0]
+    assert response.status == 204
+    assert response['location'].endswith('/bags/foo/tiddlers/big.bin')
+
+    tiddler = store.get(Tiddler('big.bin', 'foo'))
+    assert tiddler.text == 'aaabbbccc'
+    assert tiddler.type == 'application/octet-stream'
+    assert sorted(tiddler.tags) == ['one', 'two']
+    assert tiddler.fields['note'] == 'hello'
+
+    # the session is gone once committed
+    assert http.request(location, method='GET')[0].status == 404
+
+def test_upload_via_recipe():
+    """
+    an upload opened on a recipe puts the tiddler in the recipe's bag
+    """
+    store = setup_store()
+    setup_web()
+    http = httplib2.Http()
+
+    location = start(http, '_upload=start&title=recipe.bin',
+        container='recipes/foobar')['location']
+    assert put_part(http, location, 1, 'data').status == 204
+    assert http.request(location, method='POST')[0].status == 204
+    assert store.get(Tiddler('recipe.bin', 'bar')).text == 'data'
+
+def test_missing_part():
+    """
+    committing with a gap in the parts fails, and the upload can
+    then be completed
+    """
+    store = setup_store()
+    setup_web()
+    http = httplib2.Http()
+
+    location = start(http, '_upload=start&title=gap.bin')['location']
+    put_part(http, location, 1, 'aaa')
+    put_part(http, location, 3, 'ccc')
+    response, content = http.request(location, method='POST')
+    assert response.status == 409
+    assert 'missing parts 2' in content
+
+    put_part(http, location, 2, 'bbb')
+    assert http.request(location, method='POST')[0].status == 204
+    assert store.get(Tiddler('gap.bin', 'foo')).text == 'aaabbbccc'
+
+def test_part_numbers_bounded():
+    """
+    part numbers past form.upload_max_parts are refused, and gaps are
+    reported as ranges
+    """
+    setup_store()
+    setup_web()
+    http = httplib2.Http()
+
+    location = start(http, '_upload=start&title=bounded.bin')['location']
+    assert put_part(http, location, 0, 'zero').status == 400
+    assert put_part(http, location, 10001, 'far').status == 400
+    assert put_part(http, location, 999999999, 'farther').status == 400
+
+    config['form.upload_max_parts'] = 50
+    try:
+        assert put_part(http, location, 51, 'over').status == 400
+        assert put_part(http, location, 50, 'last').status == 204
+    finally:
+        del config['form.upload_max_parts']
+    put_part(http, location, 2, 'two')
+    response, content = http.request(location, method='POST')
+    assert response.status == 409
+    assert 'missing parts 1, 3-49' in content
+
+def test_start_checks_policy():
+    """
+    a session can not be opened on a bag the user may not create in
+    """
+    store = setup_store()
+    setup_web()
+    bag = Bag('foo')
+    bag.policy.create = ['NONE']
+    store.put(bag)
+    http = httplib2.Http()
+
+    assert start(http, '_upload=start&title=no.bin').status == 403
+    assert start(http, '_upload=start&title=no.bin',
+        container='bags/missing').status == 409
+
+def test_delete_upload():
+    """
+    deleting a session removes it and its parts
+    """
+    setup_store()
+    setup_web()
+    http = httplib2.Http()
+
+    location = start(http, '_upload=start&title=gone.bin')['location']
+    put_part(http, location, 1, 'aaa')
+    assert http.request(location, method='DELETE')[0].status == 204
+    assert http.request(location, method='GET')[0].status == 404
+    assert put_part(http, location, 2, 'bbb').status == 404
+
+def test_collect_stale_sessions():
+    """
+    sessions idle for longer than form.upload_ttl are removed
+    """
+    sessions = upload_sessions(config)
+    stale = sessions.create({'user': 'GUEST'})
+    fresh = sessions.create({'user': 'GUEST'})
+    old = time.time() - sessions.ttl - 10
+    os.utime(sessions.path(stale), (old, old))
+
+    assert sessions.collect() == [stale]
+    assert not os.path.exists(sessions.path(stale))
+    assert os.path.exists(sessions.path(fresh))
+    sessions.remove(fresh)
+
+def test_large_upload_persisted_from_parts():
+    """
+    an upload stored as a blob is written from its parts straight to
+    the blob store, and a single part is linked there, not copied
+    """
+    blob_dir = tempfile.mkdtemp()
+    config['form.blob_dir'] = blob_dir
+    config['form.blob_threshold'] = 4
+    try:
+        store = setup_store()
+        setup_web()
+        http = httplib2.Http()
+
+        location = start(http, '_upload=start&title=blob.bin')['location']
+        for number, content in enumerate(['aaa', 'bbb', 'ccc'], 1):
+            assert put_part(http, location, number, content).status == 204
+        assert http.request(location, method='POST')[0].status == 204
+        digest = store.get(Tiddler('blob.bin', 'foo')).fields['_form_blob']
+        content = http.request(
+            'http://test_domain:8001/form/blobs/foo/%s' % digest)[1]
+        assert content == 'aaabbbccc'
+
+        location = start(http, '_upload=start&title=one.bin')['location']
+        assert put_part(http, location, 1, 'single part').status == 204
+        part = os.path.join(upload_sessions(config).path(
+            location.rsplit('/', 1)[1]), 'part-00000001')
+        inode = os.stat(part).st_ino
+        assert http.request(location, method='POST')[0].status == 204
+        digest = store.get(Tiddler('one.bin', 'foo')).fields['_form_blob']
+        assert os.stat(os.path.join(blob_dir, digest[:2],
+            digest)).st_ino == inode
+    finally:
+        del config['form.blob_dir']
+        del config['form.blob_threshold']
+        shutil.rmtree(blob_dir)
+
+def test_joined_parts():
+    """
+    parts are read and sought through as one file
+    """
+    from tiddlywebplugins.form.uploads import JoinedParts
+    directory = tempfile.mkdtemp()
+    try:
+        paths = []
+        for index, content in enumerate(['abc', '', 'defg', 'h']):
+            paths.append(os.path.join(directory, 'part-%s' % index))
+            with open(paths[-1], 'wb') as part:
+                part.write(content)
+        joined = JoinedParts(paths, ['md5'])
+        assert joined.hashes['md5'].hexdigest() == (
+            hashlib.md5('abcdefgh').hexdigest())
+        assert joined.read() == 'abcdefgh'
+        joined.seek(2)
+        assert joined.read(3) == 'cde'
+        assert joined.read(10) == 'fgh'
+        assert joined.read(1) == ''
+        joined.seek(0, 2)
+        assert joined.tell() == 8
+        joined.close()
+
+        target = os.path.join(directory, 'joined')
+        joined.persist(target)
+        assert open(target, 'rb').read() == 'abcdefgh'
+    finally:
+        shutil.rmtree(directory)
@@ -0,0 +1,142 @@
+"""
+tests for queued writes of form POSTs
+"""
+import json
+from urlparse import urlparse
+
+from setup_test import setup_store, setup_web
+
+from tiddlyweb.config import config
+from tiddlyweb.model.tiddler import Tiddler
+
+from tiddlywebplugins.form import writebehind
+from tiddlywebplugins.form.exceptions import HTTP503
+
+import httplib2
+
+config['system_plugins'] = ['tiddlywebplugins.form']
+
+def setup_module(module):
+    config['server_prefix'] = ''
+    config['form.write_behind'] = True
+
+def teardown_module(module):
+    del config['form.write_behind']
+    writebehind.shutdown()
+
+def environ():
+    return {'tiddlyweb.config': config,
+        'tiddlyweb.usersign': {'name': 'GUEST', 'roles': []}}
+
+def test_post_queued():
+    """
+    a POST is answered with 202 and a status URL, and the tiddler is
+    stored once the queue is flushed
+    """
+    store = setup_store()
+    setup_web()
+    http = httplib2.Http()
+
+    response, content = http.request(
+        'http://test_domain:8001/bags/foo/tiddlers',
+        method='POST',
+        headers={'Content-type': 'application/x-www-form-urlencoded'},
+        body='title=Later&text=Hi%20There')
+    assert response.status == 202
+    status = json.loads(content)
+    assert status['tiddlers'][0].endswith('/bags/foo/tiddlers/Later')
+    location = 'http://test_domain:8001' + urlparse(
+        response['location']).path
+    assert '/form/writes/' in location
+
+    writebehind.get_writer(config).flush()
+    assert store.get(Tiddler('Later', 'foo')).text == 'Hi There'
+
+    response, content = http.request(location)
+    assert response.status == 200
+    assert json.loads(content)['status'] == 'done'
+
+    response = http.request('http://test_domain:8001/form/writes/unknown')[0]
+    assert response.status == 404
+
+def test_policy_checked_before_queueing():
+    """
+    a POST to a missing bag fails in the request, not in the queue
+    """
+    setup_store()
+    setup_web()
+    http = httplib2.Http()
+
+    response = http.request('http://test_domain:8001/bags/missing/tiddlers',
+        method='POST',
+        headers={'Content-type': 'application/x-www-form-urlencoded'},
+        body='title=Nowhere&text=Hi')[0]
+    assert response.status == 409
+
+def test_queue_full():
+    """
+    when the queue is full, writes are refused with 503
+    """
+    writer = writebehind.Writer(config, workers=0, queue_size=1)
+    writer.submit(environ(), [Tiddler('one', 'foo')])
+    try:
+        writer.submit(environ(), [Tiddler('two', 'foo')])
+        assert False, 'second write should not fit'
+    except HTTP503 as exc:
+        assert ('Retry-After', '1') in exc.headers()
+
+def test_failed_write():
+    """
+    a write that fails is reported as failed
+    """
+    setup_store()
+    writer = writebehind.Writer(config, workers=1)
+    write_id = writer.submit(environ(), [Tiddler('lost', 'missing')])
+    writer.flush()
+    status = writer.status(write_id)
+    assert status['status'] == 'failed'
+    assert 'missing' in status['error']
+    writer.shutdown()
+
+def test_shutdown_finishes_writes():
+    """
+    writes queued before shutdown are done
+    """
+    store = setup_store()
+    writer = writebehind.Writer(config, workers=1)
+    for index in range(10):
+        tiddler = Tiddler('queued%s' % index, 'foo')
+        tiddler.text = 'text %s' % index
+        writer.submit(environ(), [tiddler])
+    writer.shutdown()
+    for index in range(10):
+        assert store.get(Tiddler('queued%s' % index, 'foo')).text == (
+            'text %s' % index)
+    try:
+        writer.submit(environ(), [Tiddler('late', 'foo')])
+        assert False, 'writes after shutdown should be refused'
+    except HTTP503:
+        pass
+
+def test_writes_of_a_tiddler_in_order():
+    """
+    with several workers, the writes of one tiddler are done in the
+    order they were accepted, by the worker its bag and title choose
+    """
+    store = setup_store()
+    writer = writebehind.Writer(config, workers=4)
+    write_ids = []
+    for index in range(40):
+        tiddler = Tiddler('ordered', 'foo')
+        tiddler.text = 'text %s' % index
+        other = Tiddler('other%s' % index, 'foo')
+        other.text = 'other'
+        write_ids.append(writer.submit(environ(), [tiddler, other]))
+    writer.flush()
+    assert store.get(Tiddler('ordered', 'foo')).text == 'text 39'
+    assert store.get(Tiddler('other39', 'foo')).text == 'other'
+    assert all(writer.status(write_id)['status'] == 'done'
+        for write_id in write_ids)
+    assert (writer._queue_for(Tiddler('ordered', 'foo'))
+        is writer._queue_for(Tiddler('ordered', 'foo')))
+    writer.shutdown()
@@ -0,0 +1,868 @@
+"""
+Provides a Serializer to transform HTML form-data into an object that can be
+put into the store.
+
+Also adds POST support to the standard set of URLs
+
+NOTE - A large proportion of this code will disappear when TiddlyWeb 1.1 is released.
+This is due to improved handling in TiddlyWeb that allows items to be put into the store
+from any content type as long as their is a serialization for it. Pre 1.1 TiddlyWeb
+requires the content type to be text/plain or application/json only, hence most of this
+code is just a replication of TiddlyWeb core with subtle changes to it.
+"""
+import logging
+import re
+
+import mimeparse
+from httpexceptor import HTTP400, HTTP404, HTTP409, HTTP412
+
+from tiddlyweb import control
+from tiddlyweb.fixups import quote
+from tiddlyweb.model.bag import Bag
+from tiddlyweb.model.policy import PermissionsError, UserRequiredError
+from tiddlyweb.model.recipe import Recipe
+from tiddlyweb.model.tiddler import Tiddler, current_timestring
+from tiddlyweb.store import (NoBagError, NoRecipeError, NoTiddlerError,
+        StoreMethodNotImplemented)
+from tiddlyweb.web.validator import validate_tiddler, InvalidTiddlerError
+from tiddlyweb.serializer import TiddlerFormatError, NoSerializationError
+from tiddlyweb.serializations import SerializationInterface
+from tiddlyweb.web import util as web
+
+# Only modules needed to serve an ordinary form POST are imported
+# here. The rest (uuid, json, the core tiddler handler, twanager
+# commands, uploads, write-behind, blobs, digests, redirects and
+# timing) are imported where they are used, as under CGI the plugin
+# is loaded for every request.
+from tiddlywebplugins.form.tags import (parse_tags, PARSER as TAG_PARSER,
+        DEFAULT_CACHE_SIZE as DEFAULT_TAG_CACHE_SIZE)
+
+LOGGER = logging.getLogger(__name__)
+
+INDEXED_KEY = re.compile(r'^(.+)\.(\d+)$')
+JSON_TYPE = 'application/json'
+REDIRECT_KEY = 'tiddlyweb.form.redirect'
+TIMINGS_KEY = 'tiddlyweb.form.timings'
+MERGE_KEY = '_merge'
+ADD_TAGS_KEY = '_add_tags'
+REMOVE_TAGS_KEY = '_remove_tags'
+MERGE_KEYS = [MERGE_KEY, ADD_TAGS_KEY, REMOVE_TAGS_KEY]
+
+
+class _NullPhase(object):
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+
+NULL_PHASE = _NullPhase()
+
+
+def phase(environ, name):
+    """
+    timing.phase, importing timing only for requests that are timed
+    """
+    if environ.get(TIMINGS_KEY) is None:
+        return NULL_PHASE
+    from tiddlywebplugins.form import timing
+    return timing.phase(environ, name)
+
+
+def retrieve_item(obj, key):
+    if getattr(obj, 'getfirst', None):
+        return obj.getfirst(key)
+    else:
+        return obj[key][0]
+
+
+def post_tiddler_to_container(environ, start_response):
+    """
+    entry point for recipes/foo/tiddlers or bags/foo/tiddlers
+
+    we have included the tiddler name in the form, so build the
+    tiddler from the form and put it straight into the store,
+    responding as a PUT to the tiddler would (or with a redirect)
+
+    with _merge set the form is merged into the stored tiddler
+    """
+    form = environ['tiddlyweb.query']
+    files = environ['tiddlyweb.input_files']
+
+    if '_upload' in form:
+        from tiddlywebplugins.form.uploads import start_upload
+        return start_upload(environ, start_response)
+    if len(files) > 1:
+        return post_files_to_container(environ, start_response)
+    if not files and is_bulk_form(form):
+        return post_rows_to_container(environ, start_response)
+
+    def get_name():
+        if 'title' in form:
+            return retrieve_item(form, 'title')
+        else:
+            return files[0].filename
+
+    try:
+        tiddler_name = get_name()
+    except (KeyError, IndexError):
+        from uuid import uuid4
+        tiddler_name = str(uuid4())
+
+    environ['tiddlyweb.form'] = form
+    redirect = get_redirect(environ, form)
+    merge = get_merge(environ, form)
+
+    tiddler = Tiddler(tiddler_name)
+    try:
+        with phase(environ, 'build'):
+            if merge is not None:
+                load_for_merge(environ, tiddler, bool(files)
+                        or 'text' in form)
+            Serialization(environ).as_tiddler(tiddler)
+            if merge is not None:
+                merge_tags(tiddler, *merge)
+    except TiddlerFormatError as exc:
+        raise HTTP400('unable to put tiddler: %s' % exc)
+
+    write_id = put_tiddlers(environ, [tiddler])
+    return respond_put(environ, start_response, tiddler, redirect, write_id)
+
+
+def respond_put(environ, start_response, tiddler, redirect, write_id=None):
+    """
+    respond to a POST that put one tiddler, as a PUT to the
+    tiddler would, with the redirect, or with the status of the
+    queued write
+    """
+    if redirect:
+        start_response('303 See Other', [('Location',
+            redirect_location(environ, redirect, [tiddler], write_id))])
+    elif write_id:
+        from tiddlywebplugins.form.writebehind import send_accepted
+        return send_accepted(environ, start_response, write_id)
+    elif wants_metadata(environ):
+        return send_metadata(environ, start_response, [tiddler],
+                single=True)
+    else:
+        start_response('204 No Content', [
+            ('Location', web.tiddler_url(environ, tiddler)),
+            ('ETag', web.tiddler_etag(environ, tiddler))])
+    return []
+
+
+def post_files_to_container(environ, start_response):
+    """
+    batch upload: every file in the form becomes its own tiddler,
+    titled with its filename. tags in the form apply to all of them.
+
+    responds with a text/uri-list of the created tiddlers, or a
+    redirect if one was requested.
+    """
+    form = environ['tiddlyweb.query']
+    redirect = get_redirect(environ, form)
+    merge = get_merge(environ, form)
+    tags = form_tags(environ, form)
+
+    tiddlers = []
+    with phase(environ, 'build'):
+        for my_file in environ['tiddlyweb.input_files']:
+            tiddler = Tiddler(my_file.filename)
+            if merge is not None:
+                load_for_merge(environ, tiddler, True)
+            try:
+                file_to_tiddler(environ, tiddler, my_file)
+            except TiddlerFormatError as exc:
+                raise HTTP400('unable to put tiddler: %s' % exc)
+            if tags is not None:
+                tiddler.tags = list(tags)
+            if merge is not None:
+                merge_tags(tiddler, *merge)
+            tiddlers.append(tiddler)
+
+    write_id = put_tiddlers(environ, tiddlers)
+    return send_created(environ, start_response, tiddlers, redirect,
+            write_id)
+
+
+def post_rows_to_container(environ, start_response):
+    """
+    bulk post: indexed form keys (title.0, text.0, tags.0, title.1...)
+    are grouped by index and each group becomes its own tiddler.
+    unindexed keys apply to every tiddler. groups without a title
+    are given a uuid title.
+
+    responds in the same way as post_files_to_container.
+    """
+    form = environ['tiddlyweb.query']
+    redirect = get_redirect(environ, form)
+
+    tiddlers = []
+    with phase(environ, 'build'):
+        for row in split_bulk_form(form):
+            try:
+                title = row['title'][0]
+            except (KeyError, IndexError):
+                from uuid import uuid4
+                title = str(uuid4())
+            tiddler = Tiddler(title)
+            merge = get_merge(environ, row)
+            if merge is not None:
+                load_for_merge(environ, tiddler, 'text' in row)
+            form_to_tiddler(environ, tiddler, row)
+            if merge is not None:
+                merge_tags(tiddler, *merge)
+            tiddlers.append(tiddler)
+
+    write_id = put_tiddlers(environ, tiddlers)
+    return send_created(environ, start_response, tiddlers, redirect,
+            write_id)
+
+
+def send_created(environ, start_response, tiddlers, redirect,
+        write_id=None):
+    """
+    respond to a POST that created several tiddlers, with either
+    the redirect, the status of the queued write, a JSON description
+    of the tiddlers if asked for or a text/uri-list of the tiddlers
+    """
+    if redirect:
+        start_response('303 See Other', [('Location',
+            redirect_location(environ, redirect, tiddlers, write_id))])
+        return []
+    if write_id:
+        from tiddlywebplugins.form.writebehind import send_accepted
+        return send_accepted(environ, start_response, write_id)
+    if wants_metadata(environ):
+        return send_metadata(environ, start_response, tiddlers)
+    start_response('200 OK',
+            [('Content-Type', 'text/uri-list; charset=UTF-8')])
+    return [''.join('%s\r\n' % web.tiddler_url(environ, tiddler)
+        for tiddler in tiddlers).encode('utf-8')]
+
+
+def wants_metadata(environ):
+    """
+    whether the client asked for a JSON description of the tiddlers
+    put, with a route extension of a JSON type, such as .json, or an
+    Accept header that names application/json and prefers it to
+    text/html
+    """
+    extension = environ.get('wsgiorg.routing_args', ([], {}))[1].get(
+            'format')
+    if extension:
+        media_type = environ['tiddlyweb.config']['extension_types'].get(
+                extension, '')
+        return media_type.endswith(('/json', '+json'))
+    accept = environ.get('HTTP_ACCEPT', '')
+    if JSON_TYPE not in accept:
+        return False
+    try:
+        quality = mimeparse.quality(JSON_TYPE, accept)
+        return quality > 0 and quality >= mimeparse.quality('text/html',
+                accept)
+    except ValueError:
+        return False
+
+
+def send_metadata(environ, start_response, tiddlers, single=False):
+    """
+    respond to a POST with 201 and a JSON description of the tiddlers
+    put: for each its title, bag, recipe, revision, ETag and URI. if
+    single the description of the one tiddler is sent alone, with
+    its Location and ETag in the headers as well.
+    """
+    import json
+    metadata = []
+    for tiddler in tiddlers:
+        metadata.append({
+            'title': tiddler.title,
+            'bag': tiddler.bag,
+            'recipe': tiddler.recipe,
+            'revision': tiddler.revision,
+            'etag': web.tiddler_etag(environ, tiddler),
+            'uri': web.tiddler_url(environ, tiddler),
+        })
+    headers = [('Content-Type', '%s; charset=UTF-8' % JSON_TYPE)]
+    if single:
+        headers.extend([('Location', metadata[0]['uri']),
+            ('ETag', metadata[0]['etag'])])
+        metadata = metadata[0]
+    start_response('201 Created', headers)
+    return [json.dumps(metadata, separators=(',', ':'))]
+
+
+def is_bulk_form(form):
+    """
+    a form is a bulk form if it has at least one indexed title
+    """
+    for key in form:
+        match = INDEXED_KEY.match(key)
+        if match and match.group(1) == 'title':
+            return True
+    return False
+
+
+def split_bulk_form(form):
+    """
+    split a bulk form into a list of forms, one per index, in index
+    order. unindexed keys are copied into each of them.
+    """
+    shared = {}
+    rows = {}
+    for key in form:
+        values = form_values(form, key)
+        match = INDEXED_KEY.match(key)
+        if match:
+            name, index = match.groups()
+            rows.setdefault(int(index), {})[name] = values
+        else:
+            shared[key] = values
+
+    forms = []
+    for index in sorted(rows):
+        row = dict(shared)
+        row.update(rows[index])
+        forms.append(row)
+    return forms
+
+
+def form_values(form, key):
+    """
+    return the list of values for key in form
+    """
+    if getattr(form, 'getfirst', None):
+        return form.getlist(key)
+    return form[key]
+
+
+def form_to_tiddler(environ, tiddler, form):
+    """
+    set the attributes, tags and fields of tiddler from the
+    keys in form. the merge options are never kept as fields.
+    """
+    keys = ['created', 'modified', 'modifier', 'text']
+    for key in form:
+        if key == 'title' or key in MERGE_KEYS:
+            continue
+        if key in keys:
+            setattr(tiddler, key, retrieve_item(form, key))
+        elif key == 'tags':
+            tiddler.tags = form_tags(environ, form)
+        else:
+            tiddler.fields[key] = retrieve_item(form, key)
+    return tiddler
+
+
+def get_redirect(environ, form):
+    """
+    remove redirect from the form and return it, noting in the
+    environ that there is one. returns None if no redirect was
+    requested.
+    """
+    with phase(environ, 'redirect'):
+        try:
+            redirect = form.pop('redirect')[0] or None
+        except KeyError:
+            return None
+        environ[REDIRECT_KEY] = redirect
+        return redirect
+
+
+def get_merge(environ, form):
+    """
+    remove the merge options from the form. returns None unless
+    _merge asked for the form to be merged into the stored tiddler,
+    else the lists of tags to add to and remove from it.
+    """
+    merge = form.pop(MERGE_KEY, [''])[0]
+    if merge.lower() in ['', '0', 'false', 'no']:
+        return None
+    tags = []
+    for key in [ADD_TAGS_KEY, REMOVE_TAGS_KEY]:
+        key_tags = []
+        with phase(environ, 'tags'):
+            for tag_string in form.pop(key, []):
+                key_tags.extend(parse_tags(tag_string))
+        tags.append(key_tags)
+    return tags
+
+
+def load_for_merge(environ, tiddler, new_content):
+    """
+    set tiddler to a copy of the stored tiddler it will replace,
+    which the form is merged into. if the form has new content, the
+    stored content is not copied, so that a stored blob does not
+    shadow it.
+
+    the user must be able to read and write the bag before it is
+    looked in, so that whether the tiddler exists is not given away.
+    """
+    place_tiddlers(environ, [tiddler])
+    store = environ['tiddlyweb.store']
+    try:
+        bag = store.get(Bag(tiddler.bag))
+    except NoBagError as exc:
+        raise HTTP409('Unable to put tiddlers. There is no bag named: '
+                '%s. Create the bag.' % exc)
+    for constraint in ['read', 'write']:
+        check_policy(environ, bag, constraint)
+    try:
+        stored = store.get(Tiddler(tiddler.title, tiddler.bag))
+    except NoTiddlerError:
+        raise HTTP404('unable to merge, there is no tiddler %s in bag %s'
+                % (tiddler.title, tiddler.bag))
+    tiddler.created = stored.created
+    tiddler.type = stored.type
+    tiddler.tags = list(stored.tags)
+    tiddler.fields = dict(stored.fields)
+    if new_content:
+        from tiddlywebplugins.form.blobs import (BLOB_FIELD,
+                CANONICAL_URI_FIELD)
+        from tiddlywebplugins.form.digests import DIGEST_FIELD
+        for field in [BLOB_FIELD, CANONICAL_URI_FIELD, DIGEST_FIELD]:
+            tiddler.fields.pop(field, None)
+    else:
+        tiddler.text = stored.text
+
+
+def merge_tags(tiddler, add_tags, remove_tags):
+    """
+    add and remove tags of a merged tiddler, keeping their order
+    """
+    tags = [tag for tag in tiddler.tags if tag not in remove_tags]
+    tags.extend(tag for tag in add_tags
+            if tag not in tags and tag not in remove_tags)
+    tiddler.tags = tags
+
+
+def redirect_location(environ, redirect, tiddlers, write_id=None):
+    """
+    add cache busting to the redirect that follows putting tiddlers,
+    as set by form.redirect_cache, ready to be used in a Location
+    header.
+    """
+    from tiddlywebplugins.form.redirects import cache_buster
+    with phase(environ, 'redirect'):
+        if '?' in redirect and not redirect.endswith('?'):
+            redirect += '&'
+        else:
+            redirect += '?'
+        redirect += '.no-cache=%s' % cache_buster(environ, tiddlers)
+        # Extra safe characters used to preserve query strings.
+        return quote(redirect.encode('utf-8'), safe="/?&=:.!~*'()")
+
+
+def form_tags(environ, form):
+    """
+    return the list of tags given in the form, or None if
+    the form has no tags
+    """
+    if 'tags' not in form:
+        return None
+    tags = []
+    with phase(environ, 'tags'):
+        for tag_string in form_values(form, 'tags'):
+            tags.extend(parse_tags(tag_string))
+    return tags
+
+
+def file_to_tiddler(environ, tiddler, my_file):
+    """
+    set the type and text of tiddler from an uploaded file
+
+    with form.dedup set, or a file over form.blob_threshold, the text
+    is left empty and the file is hashed and kept in
+    tiddlyweb.form.blobs, to be stored as a blob by put_tiddlers once
+    the tiddler is known to be allowed
+
+    the digest of the file, made as it was spooled, goes in the
+    _form_digest field
+    """
+    if not my_file.file:
+        raise TiddlerFormatError
+    from tiddlywebplugins.form.blobs import (BLOB_FIELD, blob_wanted,
+            digest_file)
+    from tiddlywebplugins.form.digests import set_digest
+    config = environ['tiddlyweb.config']
+    tiddler.type = my_file.type
+    set_digest(config, tiddler, my_file.file)
+    if blob_wanted(config, my_file.file):
+        digest, size = digest_file(my_file.file)
+        tiddler.text = ''
+        tiddler.fields[BLOB_FIELD] = digest
+        environ.setdefault('tiddlyweb.form.blobs', {})[digest] = (
+                my_file.file, size)
+    else:
+        my_file.file.seek(0)
+        tiddler.text = my_file.file.read()
+
+
+def store_blobs(environ, tiddlers):
+    """
+    write the pending uploads of tiddlers to the blob store, note
+    which tiddlers refer to them and point the tiddlers at them. if a
+    different file is already stored under
+    the same digest, the upload is kept in the tiddler text instead.
+    """
+    pending = environ.get('tiddlyweb.form.blobs')
+    if not pending:
+        return
+    from tiddlywebplugins.form.blobs import (BLOB_FIELD,
+            CANONICAL_URI_FIELD, blob_store, blob_uri)
+    blobs = blob_store(environ['tiddlyweb.config'])
+    for tiddler in tiddlers:
+        digest = tiddler.fields.get(BLOB_FIELD)
+        if digest not in pending:
+            continue
+        fileobj, size = pending[digest]
+        if blobs.put(fileobj, digest, size, tiddler.type):
+            blobs.add_reference(digest, tiddler.bag, tiddler.title)
+            tiddler.fields[CANONICAL_URI_FIELD] = blob_uri(environ,
+                    tiddler.bag, digest)
+        else:
+            LOGGER.warning('blob digest collision on %s, storing %s:%s '
+                    'in full', digest, tiddler.bag, tiddler.title)
+            del tiddler.fields[BLOB_FIELD]
+            fileobj.seek(0)
+            tiddler.text = fileobj.read()
+
+
+def put_tiddlers(environ, tiddlers):
+    """
+    put several tiddlers into the store at once
+
+    each tiddler is placed in a bag (via the recipe if the route has
+    one), then the bag policies are checked once per bag and
+    constraint before any tiddler is written, so either all the
+    tiddlers are stored or none are.
+
+    with form.image_max_size or form.image_thumbnails set, images
+    are scaled and their thumbnails are put alongside them.
+
+    with form.write_behind set the writes are queued rather than
+    done, and the id of the queued write is returned.
+    """
+    store = environ['tiddlyweb.store']
+    place_tiddlers(environ, tiddlers)
+
+    try:
+        with phase(environ, 'policy'):
+            check_tiddlers(environ, tiddlers)
+
+        config = environ['tiddlyweb.config']
+        if (config.get('form.image_max_size')
+                or config.get('form.image_thumbnails')):
+            from tiddlywebplugins.form.images import derive_images
+            with phase(environ, 'images'):
+                thumbnails = derive_images(environ, tiddlers)
+            with phase(environ, 'policy'):
+                # If-Match in the request is for the uploaded tiddlers
+                check_tiddlers(dict(environ, HTTP_IF_MATCH=None),
+                        thumbnails)
+            tiddlers = tiddlers + thumbnails
+
+        with phase(environ, 'store'):
+            store_blobs(environ, tiddlers)
+            user = environ['tiddlyweb.usersign']['name']
+            modified = current_timestring()
+            for tiddler in tiddlers:
+                tiddler.modifier = user
+                tiddler.modified = modified
+            # revision mode falls back to counting when writes are
+            # queued, as they have no revision yet
+            mode = config.get('form.redirect_cache')
+            if environ.get(REDIRECT_KEY) and (mode == 'counter' or (
+                    mode == 'revision' and config.get('form.write_behind'))):
+                from tiddlywebplugins.form.redirects import count_writes
+                count_writes(environ, tiddlers)
+            if config.get('form.write_behind'):
+                from tiddlywebplugins.form.writebehind import get_writer
+                return get_writer(config).submit(environ, tiddlers)
+            for tiddler in tiddlers:
+                store.put(tiddler)
+    except NoBagError as exc:
+        raise HTTP409('Unable to put tiddlers. There is no bag named: '
+                '%s. Create the bag.' % exc)
+    except NoTiddlerError as exc:
+        raise HTTP404('Unable to put tiddlers. %s' % exc)
+    except TypeError as exc:
+        raise HTTP409('Unable to put badly formed tiddler: %s' % exc)
+
+
+def check_tiddlers(environ, tiddlers):
+    """
+    check that the current user may put tiddlers, which have been
+    placed in their bags: create or write for each bag depending on
+    whether the tiddlers exist, If-Match headers as for a PUT, and
+    accept, validating the tiddlers if the user lacks it
+    """
+    from tiddlyweb.web.handler.tiddler import validate_tiddler_headers
+    store = environ['tiddlyweb.store']
+    constraints = {}
+    for tiddler in tiddlers:
+        revision = current_revision(store, tiddler)
+        if revision is None:
+            constraint = 'create'
+            check_new_tiddler_etag(environ, tiddler)
+        else:
+            constraint = 'write'
+            tiddler.revision = revision
+            validate_tiddler_headers(environ, tiddler)
+        constraints.setdefault(tiddler.bag, set()).add(constraint)
+
+    for bag_name, bag_constraints in constraints.items():
+        bag = store.get(Bag(bag_name))
+        for constraint in sorted(bag_constraints):
+            check_policy(environ, bag, constraint)
+        try:
+            check_policy(environ, bag, 'accept')
+        except PermissionsError:
+            for tiddler in tiddlers:
+                if tiddler.bag == bag_name:
+                    try:
+                        validate_tiddler(tiddler, environ)
+                    except InvalidTiddlerError as exc:
+                        raise HTTP409('Tiddler content is invalid: %s'
+                                % exc)
+
+
+def check_container(environ, bag_name=None, recipe_name=None):
+    """
+    before the form is read, check that the current user could put a
+    tiddler in the bag named in the route, or in one of the bags of
+    the recipe named in the route that a tiddler could go to: one of
+    them must allow create or write. raises the PermissionsError of
+    the bag that would take any tiddler if none do, preferring
+    UserRequiredError.
+
+    missing bags and recipes are left to put_tiddlers to report,
+    which also checks the policies in full once the tiddlers are known.
+    """
+    store = environ['tiddlyweb.store']
+    if recipe_name is not None:
+        try:
+            recipe = store.get(Recipe(recipe_name))
+        except NoRecipeError:
+            return
+        bag_names = []
+        for name, filter_string in reversed(recipe.get_recipe(
+                control.recipe_template(environ))):
+            bag_names.append(name)
+            if not filter_string:
+                break
+    else:
+        bag_names = [bag_name]
+
+    errors = []
+    for name in bag_names:
+        try:
+            bag = store.get(Bag(name))
+        except NoBagError:
+            continue
+        for constraint in ['create', 'write']:
+            try:
+                check_policy(environ, bag, constraint)
+                return
+            except PermissionsError as exc:
+                errors.append(exc)
+    for exc in errors:
+        if isinstance(exc, UserRequiredError):
+            raise exc
+    if errors:
+        raise errors[0]
+
+
+def check_policy(environ, bag, constraint):
+    """
+    as tiddlyweb.web.util.check_bag_constraint, but for a bag that
+    has already been read from the store, so that several constraints
+    can be checked with one read
+    """
+    try:
+        bag.policy.allows(environ['tiddlyweb.usersign'], constraint)
+    except PermissionsError as exc:
+        raise exc.__class__('for bag %s: %s' % (bag.name, exc))
+
+
+def place_tiddlers(environ, tiddlers):
+    """
+    set the bag (and recipe) of each tiddler from the route
+    """
+    store = environ['tiddlyweb.store']
+    try:
+        recipe_name = web.get_route_value(environ, 'recipe_name')
+    except KeyError:
+        bag_name = web.get_route_value(environ, 'bag_name')
+        for tiddler in tiddlers:
+            tiddler.bag = bag_name
+        return
+
+    try:
+        recipe = store.get(Recipe(recipe_name))
+    except NoRecipeError as exc:
+        raise HTTP404('recipe %s not found, %s' % (recipe_name, exc))
+    for tiddler in tiddlers:
+        try:
+            bag = control.determine_bag_for_tiddler(recipe, tiddler, environ)
+        except NoBagError as exc:
+            raise HTTP404('%s not found via bag, %s' % (tiddler.title, exc))
+        tiddler.bag = bag.name
+        tiddler.recipe = recipe.name
+
+
+def current_revision(store, tiddler):
+    """
+    return the current revision of tiddler in the store, or None if
+    it is not there, without reading its text where the store allows it
+    """
+    try:
+        try:
+            return store.list_tiddler_revisions(tiddler)[0]
+        except StoreMethodNotImplemented:
+            store.get(Tiddler(tiddler.title, tiddler.bag))
+            return 1
+    except (NoTiddlerError, IndexError):
+        return None
+
+
+def check_new_tiddler_etag(environ, tiddler):
+    """
+    If-Match on a tiddler that does not exist yet must name
+    revision 0 of it, as in a PUT
+    """
+    tiddler.revision = None
+    incoming_etag = environ.get('HTTP_IF_MATCH')
+    if incoming_etag and incoming_etag != str('"%s/%s/0"' % (
+            web.encode_name(tiddler.bag), web.encode_name(tiddler.title))):
+        raise HTTP412('ETag incorrect for new tiddler')
+
+
+class Serialization(SerializationInterface):
+    def as_tiddler(self, tiddler, input_string=None):
+        """
+        turn a form input into a tiddler
+        nb: input_string is ignored. The form is read from
+        tiddlyweb.form in the environ, which must be set prior
+        to calling.
+        """
+        form = self.environ.get('tiddlyweb.form')
+        if form is None:
+            raise NoSerializationError('Form expected, but none found')
+        if self.environ.get('tiddlyweb.input_files'):
+            file_to_tiddler(self.environ, tiddler,
+                    self.environ['tiddlyweb.input_files'][0])
+            tags = form_tags(self.environ, form)
+            if tags is not None:
+                tiddler.tags = tags
+        else:
+            form_to_tiddler(self.environ, tiddler, form)
+
+        return tiddler
+
+    @staticmethod
+    def create_tag_list(input_string):
+        return parse_tags(input_string)
+
+def update_handler(selector, path, new_handler, server_prefix):
+    """
+    Update an existing path handler in the selector
+    map with new methods (in this case, POST).
+
+    Taken and modified from tiddlywebplugins
+    """
+    update_handlers(selector, {path: new_handler}, server_prefix)
+
+
+def update_handlers(selector, new_handlers, server_prefix):
+    """
+    Update several existing path handlers in the selector map with
+    new methods, in one pass over the mappings. new_handlers maps
+    each path to a dict of methods and handlers.
+    """
+    patterns = {}
+    for path, new_handler in new_handlers.items():
+        patterns[selector.parser(server_prefix + path)] = path
+        if server_prefix:
+            patterns[selector.parser(path)] = path
+
+    remaining = set(new_handlers)
+    for regex, handler in selector.mappings:
+        path = patterns.get(regex.pattern)
+        if path in remaining:
+            handler.update(new_handlers[path])
+            remaining.discard(path)
+            if not remaining:
+                return
+
+    for path in remaining:
+        LOGGER.debug('%s not found in URL mapping. Not replaced', path)
+
+
+def lazy_handler(module_name, function_name):
+    """
+    return a handler that imports function_name from module_name
+    when first called
+    """
+    def handler(environ, start_response):
+        module = __import__(module_name, {}, {}, [function_name])
+        return getattr(module, function_name)(environ, start_response)
+    return handler
+
+
+def init(config):
+    """
+    add POST handlers to the standard set of URLs.
+    nb - revisions not included as POST already exists
+
+    register the serializer for Content-Type: application/x-www-form-urlencoded 
+    and Content-Type: multipart/form-data
+
+    replace the core Query filter with one that leaves form bodies to
+    a filter after UserExtract, which spools uploaded files
+
+    without a selector (under twanager) register the twanager
+    commands instead
+
+    with form.idempotency set, POSTs with an idempotency key are
+    handled once
+    """
+    if not 'selector' in config:
+        from tiddlywebplugins.form import commands
+        return
+    selector = config['selector']
+
+    post = post_tiddler_to_container
+    if config.get('form.idempotency'):
+        from tiddlywebplugins.form.idempotency import idempotent
+        post = idempotent(post)
+    update_handlers(selector, {
+        '/recipes/{recipe_name:segment}/tiddlers[.{format}]':
+            dict(POST=post),
+        '/bags/{bag_name:segment}/tiddlers[.{format}]':
+            dict(POST=post),
+    }, config.get('server_prefix', ''))
+    selector.add('/form/blobs/{bag_name:segment}/{digest:segment}',
+        GET=lazy_handler('tiddlywebplugins.form.blobs', 'get_blob'))
+
+    uploads = 'tiddlywebplugins.form.uploads'
+    selector.add('/form/uploads/{upload_id:segment}',
+        GET=lazy_handler(uploads, 'get_upload'),
+        POST=lazy_handler(uploads, 'commit_upload'),
+        DELETE=lazy_handler(uploads, 'delete_upload'))
+    selector.add('/form/uploads/{upload_id:segment}/{part:digits}',
+        PUT=lazy_handler(uploads, 'put_part'))
+    selector.add('/form/writes/{write_id:segment}',
+        GET=lazy_handler('tiddlywebplugins.form.writebehind', 'get_write'))
+
+    from tiddlywebplugins.form import query
+    query.install(config)
+    TAG_PARSER.cache_size = int(config.get('form.tag_cache_size',
+        DEFAULT_TAG_CACHE_SIZE))
+
+    config['serializers']['application/x-www-form-urlencoded'] = \
+        ['tiddlywebplugins.form', 'application/x-www-form-urlencoded; charset=UTF-8']
+    config['serializers']['multipart/form-data'] = \
+        ['tiddlywebplugins.form', 'multipart/form-data; charset=UTF-8']
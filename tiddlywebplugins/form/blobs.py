@@ -0,0 +1,420 @@
+"""
+Content addressed storage of uploaded files.
+
+When form.dedup is set, uploaded files are not put in tiddler.text.
+They are written once to form.blob_dir, named by the SHA-256 of their
+content, and the tiddler holds a reference to the blob: the digest in
+the _form_blob field and a _canonical_uri pointing at the route that
+serves it. Uploading the same bytes again only adds another reference.
+
+Uploads larger than form.blob_threshold bytes are stored as blobs,
+whether or not form.dedup is set, and smaller ones are kept in
+tiddler.text. Without form.dedup, form.blob_threshold defaults to
+form.spool_size, so an upload too large to be spooled in memory goes
+from its spool file to the blob directory without being read into
+memory. This keeps large binaries out of the store, so reading and
+listing their tiddlers stays cheap.
+
+Blobs are served with their length, and a single byte range of them
+can be asked for with a Range header, through a bag with a tiddler
+that refers to them. Which tiddlers of a bag refer to a blob is kept
+beside it, in a file per bag in <digest>.refs, so that serving a blob
+costs one store.get, not a scan of the bag. The file may name
+tiddlers that have since changed or gone, so each is checked.
+
+Blobs are never removed when a tiddler is deleted, as other tiddlers
+may share them. The formblobs twanager command removes blobs that no
+tiddler refers to, rewrites their reference files from the store, and
+checks that blobs still match their names.
+"""
+import hashlib
+import os
+import re
+import shutil
+import time
+from tempfile import NamedTemporaryFile
+from urllib import unquote
+
+from httpexceptor import HTTP304, HTTP404
+
+from tiddlyweb.model.bag import Bag
+from tiddlyweb.model.tiddler import Tiddler
+from tiddlyweb.store import NoBagError, NoTiddlerError
+from tiddlyweb.web.util import (check_bag_constraint, encode_name,
+        get_route_value)
+
+from tiddlywebplugins.form.paths import config_path, ensure_dir
+from tiddlywebplugins.form.spool import DEFAULT_SPOOL_SIZE
+
+
+BLOB_FIELD = '_form_blob'
+CANONICAL_URI_FIELD = '_canonical_uri'
+CHUNK_SIZE = 64 * 1024
+REFS_SUFFIX = '.refs'
+DIGEST_PATTERN = re.compile(r'^[0-9a-f]{64}$')
+BYTE_RANGE_PATTERN = re.compile(r'^\s*bytes\s*=\s*(\d*)\s*-\s*(\d*)\s*$')
+
+new_hash = hashlib.sha256
+
+
+def hash_file(fileobj):
+    """
+    Read fileobj from the start in chunks and return the hex digest
+    and size of its content.
+    """
+    digest = new_hash()
+    size = 0
+    fileobj.seek(0)
+    while True:
+        chunk = fileobj.read(CHUNK_SIZE)
+        if not chunk:
+            break
+        digest.update(chunk)
+        size += len(chunk)
+    fileobj.seek(0)
+    return digest.hexdigest(), size
+
+
+def digest_file(fileobj):
+    """
+    As hash_file, but using the hash made as fileobj was spooled, if
+    there is one, rather than reading it.
+    """
+    name = getattr(new_hash(), 'name', None)
+    hashes = getattr(fileobj, 'hashes', {})
+    if name in hashes:
+        return hashes[name].hexdigest(), file_size(fileobj)
+    return hash_file(fileobj)
+
+
+def file_size(fileobj):
+    """
+    The size of the content of fileobj, without reading it.
+    """
+    fileobj.seek(0, 2)
+    size = fileobj.tell()
+    fileobj.seek(0)
+    return size
+
+
+def blob_wanted(config, fileobj):
+    """
+    Whether the upload in fileobj is to be stored as a blob: if
+    form.blob_threshold is set, when it is larger than that, otherwise
+    always when form.dedup is set, and when it is larger than
+    form.spool_size, having been spooled to disk, when it is not.
+    """
+    threshold = config.get('form.blob_threshold')
+    if threshold is None:
+        if config.get('form.dedup'):
+            return True
+        threshold = config.get('form.spool_size', DEFAULT_SPOOL_SIZE)
+    return file_size(fileobj) > int(threshold)
+
+
+def byte_range(header, size):
+    """
+    The (start, end) of the single byte range in a Range header,
+    with end inclusive, or None if there is no range that can be
+    served, in which case the whole blob is.
+    """
+    match = BYTE_RANGE_PATTERN.match(header or '')
+    if not match or not size:
+        return None
+    start, end = match.groups()
+    if start:
+        start = int(start)
+        end = min(int(end), size - 1) if end else size - 1
+    elif end:
+        start = max(size - int(end), 0)
+        end = size - 1
+    else:
+        return None
+    if start > end:
+        return None
+    return start, end
+
+
+def read_range(fileobj, length):
+    """
+    Yield length bytes of fileobj in chunks.
+    """
+    try:
+        while length > 0:
+            chunk = fileobj.read(min(CHUNK_SIZE, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
+    finally:
+        fileobj.close()
+
+
+def same_content(fileobj, path):
+    """
+    Compare the content of fileobj with the file at path.
+    """
+    fileobj.seek(0)
+    try:
+        with open(path, 'rb') as existing:
+            while True:
+                chunk = fileobj.read(CHUNK_SIZE)
+                if chunk != existing.read(CHUNK_SIZE):
+                    return False
+                if not chunk:
+                    return True
+    finally:
+        fileobj.seek(0)
+
+
+class BlobStore(object):
+    """
+    A directory of files named by the digest of their content, with
+    the content type of each kept alongside in a .type file and the
+    titles of the tiddlers referring to it, per bag, in .refs.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def path(self, digest):
+        return os.path.join(self.directory, digest[:2], digest)
+
+    def exists(self, digest):
+        return os.path.exists(self.path(digest))
+
+    def content_type(self, digest):
+        try:
+            with open(self.path(digest) + '.type') as type_file:
+                return type_file.read().strip()
+        except IOError:
+            return 'application/octet-stream'
+
+    def put(self, fileobj, digest, size, content_type):
+        """
+        Store the content of fileobj as digest. Return False if
+        a different file is already stored with that digest.
+        """
+        path = self.path(digest)
+        if os.path.exists(path):
+            return (os.path.getsize(path) == size
+                    and same_content(fileobj, path))
+
+        directory = os.path.dirname(path)
+        ensure_dir(directory)
+
+        with open(path + '.type', 'w') as type_file:
+            type_file.write(content_type or 'application/octet-stream')
+        # Write to a temporary name and rename, so a blob is either
+        # complete or absent.
+        temporary = NamedTemporaryFile(dir=directory, prefix='.tmp-',
+                delete=False)
+        temporary.close()
+        try:
+            if hasattr(fileobj, 'persist'):
+                os.unlink(temporary.name)
+                fileobj.persist(temporary.name)
+            else:
+                fileobj.seek(0)
+                with open(temporary.name, 'wb') as target:
+                    shutil.copyfileobj(fileobj, target, CHUNK_SIZE)
+            os.rename(temporary.name, path)
+        except:
+            if os.path.exists(temporary.name):
+                os.unlink(temporary.name)
+            raise
+        return True
+
+    def refs_path(self, digest, bag_name):
+        # bag names may be anything, so the file is named by a hash
+        return os.path.join(self.path(digest) + REFS_SUFFIX,
+                hashlib.sha1(bag_name.encode('utf-8')).hexdigest())
+
+    def references(self, digest, bag_name):
+        """
+        The titles of the tiddlers in bag_name said to refer to digest.
+        """
+        try:
+            with open(self.refs_path(digest, bag_name)) as refs:
+                return [unquote(line.strip()).decode('utf-8')
+                        for line in refs if line.strip()]
+        except IOError:
+            return []
+
+    def add_reference(self, digest, bag_name, title):
+        """
+        Note that the tiddler title in bag_name refers to digest.
+        """
+        if title in self.references(digest, bag_name):
+            return
+        path = self.refs_path(digest, bag_name)
+        ensure_dir(os.path.dirname(path))
+        with open(path, 'a') as refs:
+            refs.write(encode_name(title) + '\n')
+
+    def set_references(self, digest, references):
+        """
+        Replace the references to digest with references, a dict of
+        bag name to titles.
+        """
+        refs_dir = self.path(digest) + REFS_SUFFIX
+        if os.path.isdir(refs_dir):
+            shutil.rmtree(refs_dir)
+        for bag_name, titles in sorted(references.items()):
+            for title in sorted(titles):
+                self.add_reference(digest, bag_name, title)
+
+    def remove(self, digest):
+        for path in [self.path(digest), self.path(digest) + '.type']:
+            if os.path.exists(path):
+                os.unlink(path)
+        refs_dir = self.path(digest) + REFS_SUFFIX
+        if os.path.isdir(refs_dir):
+            shutil.rmtree(refs_dir)
+
+    def digests(self):
+        """
+        Yield the digest of every stored blob.
+        """
+        if not os.path.isdir(self.directory):
+            return
+        for prefix in sorted(os.listdir(self.directory)):
+            prefix_dir = os.path.join(self.directory, prefix)
+            if not os.path.isdir(prefix_dir):
+                continue
+            for name in sorted(os.listdir(prefix_dir)):
+                if DIGEST_PATTERN.match(name):
+                    yield name
+
+
+def blob_store(config):
+    """
+    Return the BlobStore configured by form.blob_dir, relative
+    to root_dir when not absolute.
+    """
+    return BlobStore(config_path(config, 'form.blob_dir', 'blobs'))
+
+
+def blob_uri(environ, bag_name, digest):
+    """
+    The URI, relative to the server, the blob of a tiddler in
+    bag_name is served from.
+    """
+    return '%s/form/blobs/%s/%s' % (
+            environ['tiddlyweb.config'].get('server_prefix', ''),
+            encode_name(bag_name), digest)
+
+
+def get_blob(environ, start_response):
+    """
+    Serve the blob named in the route, or the byte range of it asked
+    for, if the user may read the bag named in the route and a tiddler
+    in that bag refers to the blob. Blobs never change, so they may be
+    cached for as long as a client likes.
+    """
+    bag_name = get_route_value(environ, 'bag_name')
+    digest = get_route_value(environ, 'digest')
+    blobs = blob_store(environ['tiddlyweb.config'])
+    if not DIGEST_PATTERN.match(digest):
+        raise HTTP404('blob %s not found' % digest)
+    try:
+        check_bag_constraint(environ, Bag(bag_name), 'read')
+    except NoBagError as exc:
+        raise HTTP404('blob %s not found, %s' % (digest, exc))
+    if (not blobs.exists(digest) or not bag_refers_to(
+            environ['tiddlyweb.store'], blobs, bag_name, digest)):
+        raise HTTP404('blob %s not found in bag %s' % (digest, bag_name))
+
+    etag = '"%s"' % digest
+    if environ.get('HTTP_IF_NONE_MATCH') == etag:
+        raise HTTP304(etag)
+
+    path = blobs.path(digest)
+    size = os.path.getsize(path)
+    headers = [
+        ('Content-Type', blobs.content_type(digest)),
+        ('ETag', etag),
+        ('Accept-Ranges', 'bytes'),
+        ('Cache-Control', 'max-age=31536000'),
+        ('X-Content-Type-Options', 'nosniff')]
+    requested = None
+    if environ.get('HTTP_IF_RANGE', etag) == etag:
+        requested = byte_range(environ.get('HTTP_RANGE'), size)
+
+    blob = open(path, 'rb')
+    if requested:
+        start, end = requested
+        blob.seek(start)
+        start_response('206 Partial Content', headers + [
+            ('Content-Length', str(end - start + 1)),
+            ('Content-Range', 'bytes %s-%s/%s' % (start, end, size))])
+        return read_range(blob, end - start + 1)
+
+    start_response('200 OK', headers + [('Content-Length', str(size))])
+    if 'wsgi.file_wrapper' in environ:
+        return environ['wsgi.file_wrapper'](blob, CHUNK_SIZE)
+    return iter(lambda: blob.read(CHUNK_SIZE), '')
+
+
+def bag_refers_to(store, blobs, bag_name, digest):
+    """
+    Whether a tiddler in the bag named bag_name refers to the blob
+    with digest, looking only at the tiddlers its references name.
+    """
+    for title in blobs.references(digest, bag_name):
+        try:
+            tiddler = store.get(Tiddler(title, bag_name))
+        except NoTiddlerError:
+            continue
+        if tiddler.fields.get(BLOB_FIELD) == digest:
+            return True
+    return False
+
+
+def referenced_digests(store):
+    """
+    Return a dict of the blob digests referred to by tiddlers in
+    store to a dict of bag name to the titles referring to them.
+    """
+    digests = {}
+    for bag in store.list_bags():
+        for tiddler in store.list_bag_tiddlers(bag):
+            tiddler = store.get(tiddler)
+            if BLOB_FIELD in tiddler.fields:
+                digests.setdefault(tiddler.fields[BLOB_FIELD], {}).setdefault(
+                        tiddler.bag, set()).add(tiddler.title)
+    return digests
+
+
+def rebuild(store, blobs, min_age=3600):
+    """
+    Bring the blob directory into line with the store: remove blobs
+    that no current tiddler refers to, and rewrite the references of
+    the rest. Blobs younger than min_age
+    seconds are kept, as their tiddler may still be on its way into
+    the store. Return the lists of removed digests and of digests
+    that are referred to but missing.
+    """
+    referenced = referenced_digests(store)
+    stored = set(blobs.digests())
+    now = time.time()
+    removed = sorted(digest for digest in stored - set(referenced)
+            if now - os.path.getmtime(blobs.path(digest)) >= min_age)
+    for digest in removed:
+        blobs.remove(digest)
+    for digest in stored & set(referenced):
+        blobs.set_references(digest, referenced[digest])
+    return removed, sorted(set(referenced) - stored)
+
+
+def verify(blobs):
+    """
+    Rehash every blob and return the digests of those whose content
+    no longer matches their name.
+    """
+    corrupt = []
+    for digest in blobs.digests():
+        with open(blobs.path(digest), 'rb') as blob:
+            if hash_file(blob)[0] != digest:
+                corrupt.append(digest)
+    return corrupt
@@ -0,0 +1,54 @@
+"""
+twanager commands for tiddlywebplugins.form.
+
+To use them, add tiddlywebplugins.form to twanager_plugins in
+tiddlywebconfig.py.
+"""
+from tiddlyweb.manage import make_command
+from tiddlyweb.util import std_error_message
+
+from tiddlywebplugins.utils import get_store
+
+from tiddlywebplugins.form.blobs import blob_store, rebuild, verify
+
+
+@make_command()
+def formblobs(args):
+    """Check uploaded blobs: <verify|rebuild>"""
+    from tiddlyweb.config import config
+    action = args[0]
+    blobs = blob_store(config)
+    if action == 'verify':
+        corrupt = verify(blobs)
+        for digest in corrupt:
+            std_error_message('corrupt blob: %s' % digest)
+        std_error_message('%s corrupt blobs' % len(corrupt))
+    elif action == 'rebuild':
+        removed, missing = rebuild(get_store(config), blobs)
+        for digest in removed:
+            std_error_message('removed unreferenced blob: %s' % digest)
+        for digest in missing:
+            std_error_message('missing blob: %s' % digest)
+        std_error_message('%s blobs removed, %s missing'
+                % (len(removed), len(missing)))
+    else:
+        raise ValueError('unknown action %s' % action)
+
+
+@make_command()
+def formuploads(args):
+    """Remove upload sessions idle for longer than form.upload_ttl"""
+    from tiddlyweb.config import config
+    from tiddlywebplugins.form.uploads import upload_sessions
+    removed = upload_sessions(config).collect()
+    for upload_id in removed:
+        std_error_message('removed upload: %s' % upload_id)
+    std_error_message('%s uploads removed' % len(removed))
+
+
+@make_command()
+def formload(args):
+    """Load test the form POST routes: [--help] for options"""
+    from tiddlyweb.config import config
+    from tiddlywebplugins.form.loadgen import main
+    main(args, config)
@@ -0,0 +1,295 @@
+"""
+Digests of uploaded files.
+
+Uploaded files are hashed as they are spooled, so their digests cost
+no extra read. With form.digest set to a hash algorithm (default
+sha256) the digest of each uploaded file is kept in the _form_digest
+field of its tiddler as <algorithm>:<hex digest>, for tools that want
+to compare content without reading it. Set form.digest to '' to keep
+no digest.
+
+A client can have what it sent checked:
+
+    Content-MD5 or Digest headers of a multipart part - the file in
+        that part
+    _digest form field - the files in the form, one value per file in
+        order; a value is the hex digest in the form.digest algorithm,
+        or Digest header values such as sha-256=<base64>
+    Content-MD5 or Digest headers of the request - the whole body, as
+        sent, before any Content-Encoding is undone
+
+Digests in algorithms other than form.digest and those named in the
+headers of a part are checked by reading the file again. A mismatch
+gets 400, as does a _digest in an unknown algorithm. Unknown
+algorithms in Digest headers are ignored.
+"""
+import hashlib
+from binascii import Error as BinasciiError, hexlify, unhexlify
+
+from httpexceptor import HTTP400
+
+
+DEFAULT_ALGORITHM = 'sha256'
+DIGEST_FIELD = '_form_digest'
+DIGEST_KEY = '_digest'
+ALGORITHMS = ['md5', 'sha1', 'sha256', 'sha384', 'sha512']
+CHUNK_SIZE = 64 * 1024
+
+
+def algorithm_name(name):
+    """
+    The hashlib name of a Digest header algorithm, such as sha-256,
+    or None if it is not one of ALGORITHMS.
+    """
+    name = name.strip().lower().replace('-', '')
+    if name == 'sha':
+        name = 'sha1'
+    if name in ALGORITHMS:
+        return name
+    return None
+
+
+def digest_algorithm(config):
+    """
+    The algorithm uploads are hashed with, or None if form.digest
+    is turned off.
+    """
+    name = config.get('form.digest', DEFAULT_ALGORITHM)
+    if not name:
+        return None
+    algorithm = algorithm_name(name)
+    if algorithm is None:
+        raise ValueError('form.digest %s is not one of %s'
+                % (name, ', '.join(ALGORITHMS)))
+    return algorithm
+
+
+def new_hashes(algorithms):
+    return dict((name, hashlib.new(name)) for name in algorithms if name)
+
+
+def parse_digests(value, strict=False):
+    """
+    Turn the value of a Digest header into a dict of algorithm to
+    digest. With strict, unknown algorithms and bad values raise
+    ValueError rather than being skipped.
+    """
+    digests = {}
+    for item in value.split(','):
+        name, _, encoded = item.partition('=')
+        algorithm = algorithm_name(name)
+        if algorithm is None:
+            if strict:
+                raise ValueError('unknown digest algorithm %s'
+                        % name.strip())
+            continue
+        try:
+            digests[algorithm] = encoded.strip().strip(':').decode('base64')
+        except BinasciiError:
+            if strict:
+                raise ValueError('bad %s digest' % name.strip())
+    return digests
+
+
+def header_digests(get_header):
+    """
+    The digests in the Content-MD5 and Digest headers found with
+    get_header.
+    """
+    digests = parse_digests(get_header('Digest') or '')
+    content_md5 = get_header('Content-MD5')
+    if content_md5:
+        try:
+            digests['md5'] = content_md5.strip().decode('base64')
+        except BinasciiError:
+            pass
+    return digests
+
+
+def part_digests(part):
+    """
+    The digests in the headers of a multipart part.
+    """
+    headers = getattr(part, 'headers', None)
+    if not headers:
+        return {}
+    return header_digests(headers.get)
+
+
+def request_digests(environ):
+    """
+    The digests in the headers of the request.
+    """
+    return header_digests(lambda name: environ.get(
+        'HTTP_' + name.upper().replace('-', '_')))
+
+
+def field_digests(value, algorithm):
+    """
+    The digests in a _digest form value: a hex digest in algorithm,
+    or Digest header values.
+    """
+    algorithm = algorithm or DEFAULT_ALGORITHM
+    value = value.strip()
+    if not value:
+        return {}
+    if '=' not in value:
+        try:
+            return {algorithm: unhexlify(value)}
+        except (TypeError, BinasciiError):
+            raise HTTP400('unable to check %s: bad hex digest %s'
+                    % (DIGEST_KEY, value))
+    try:
+        return parse_digests(value, strict=True)
+    except ValueError as exc:
+        raise HTTP400('unable to check %s: %s' % (DIGEST_KEY, exc))
+
+
+def file_digests(fileobj, algorithms):
+    """
+    Return a dict of algorithm to the digest of the content of
+    fileobj, using the hashes made while it was spooled where there
+    are some, and reading it once for the rest.
+    """
+    hashes = getattr(fileobj, 'hashes', {})
+    digests = dict((name, hashes[name].digest()) for name in algorithms
+            if name in hashes)
+    missing = new_hashes(name for name in algorithms if name not in digests)
+    if missing:
+        fileobj.seek(0)
+        while True:
+            chunk = fileobj.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            for digest in missing.values():
+                digest.update(chunk)
+        fileobj.seek(0)
+        digests.update((name, digest.digest())
+                for name, digest in missing.items())
+    return digests
+
+
+def hex_digest(fileobj, algorithm):
+    return hexlify(file_digests(fileobj, [algorithm])[algorithm])
+
+
+def set_digest(config, tiddler, fileobj):
+    """
+    Put the digest of fileobj in the _form_digest field of tiddler,
+    or remove the field if form.digest is turned off.
+    """
+    algorithm = digest_algorithm(config)
+    if algorithm:
+        tiddler.fields[DIGEST_FIELD] = '%s:%s' % (algorithm,
+                hex_digest(fileobj, algorithm))
+    else:
+        tiddler.fields.pop(DIGEST_FIELD, None)
+
+
+def check(name, expected, fileobj):
+    """
+    Raise HTTP400 if the content of fileobj does not have the
+    expected digests.
+    """
+    if not expected:
+        return
+    actual = file_digests(fileobj, list(expected))
+    for algorithm, digest in sorted(expected.items()):
+        if actual[algorithm] != digest:
+            raise HTTP400('%s does not match its %s digest'
+                    % (name, algorithm))
+
+
+def check_uploads(environ):
+    """
+    Check the uploaded files of a form against the digests in their
+    part headers and in the _digest field, which is removed from
+    tiddlyweb.query.
+    """
+    algorithm = digest_algorithm(environ['tiddlyweb.config'])
+    files = environ['tiddlyweb.input_files']
+    values = environ['tiddlyweb.query'].pop(DIGEST_KEY, [])
+    if len(values) > len(files):
+        raise HTTP400('%s %s digests given for %s files'
+                % (len(values), DIGEST_KEY, len(files)))
+    for index, upload in enumerate(files):
+        expected = part_digests(upload)
+        if index < len(values):
+            expected.update(field_digests(values[index], algorithm))
+        check('file %s' % upload.filename, expected, upload.file)
+
+
+class DigestingInput(object):
+    """
+    Wrap wsgi.input, hashing the body as it is read.
+    """
+
+    def __init__(self, stream, algorithms, length=None):
+        self.stream = stream
+        self.hashes = new_hashes(algorithms)
+        self.length = length
+        self.count = 0
+
+    def _hashed(self, data):
+        self.count += len(data)
+        for digest in self.hashes.values():
+            digest.update(data)
+        return data
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            return self._hashed(self.stream.read())
+        return self._hashed(self.stream.read(size))
+
+    def readline(self, size=-1):
+        if size is None or size < 0:
+            return self._hashed(self.stream.readline())
+        return self._hashed(self.stream.readline(size))
+
+    def readlines(self, hint=-1):
+        return list(iter(self.readline, ''))
+
+    def __iter__(self):
+        return iter(self.readline, '')
+
+    def finish(self):
+        """
+        Read what the parser left of the body, such as the epilogue
+        of a multipart form, and return the digests of the body.
+        """
+        while self.length is None or self.count < self.length:
+            size = CHUNK_SIZE
+            if self.length is not None:
+                size = min(size, self.length - self.count)
+            if not self.read(size):
+                break
+        return dict((name, digest.digest())
+                for name, digest in self.hashes.items())
+
+
+def digest_body(environ):
+    """
+    If the request has Content-MD5 or Digest headers, wrap wsgi.input
+    to hash the body as it is read, and return the digests expected.
+    """
+    expected = request_digests(environ)
+    if expected:
+        try:
+            length = int(environ.get('CONTENT_LENGTH') or 0) or None
+        except ValueError:
+            length = None
+        environ['wsgi.input'] = DigestingInput(environ['wsgi.input'],
+                expected, length)
+    return expected
+
+
+def check_body(stream, expected):
+    """
+    Raise HTTP400 if the body read through stream does not have the
+    expected digests.
+    """
+    actual = stream.finish()
+    for algorithm, digest in sorted(expected.items()):
+        if actual[algorithm] != digest:
+            raise HTTP400('request body does not match its %s digest'
+                    % algorithm)
@@ -0,0 +1,185 @@
+"""
+Compressed form POSTs.
+
+A form POST with a Content-Encoding of gzip (or x-gzip) or deflate is
+decompressed as it is read, in front of the form parser. deflate bodies
+may be zlib wrapped, as the HTTP spec says, or raw, as some clients
+send them. Other encodings get 415.
+
+To stop a small body expanding into a huge one, reading fails with 413
+once the decompressed data is more than form.max_inflate_ratio
+(default 100) times the compressed data read so far. form.max_body
+applies both to the body as sent and to the decompressed body.
+
+No more than Content-Length bytes are read from the request, and none
+after the end of the compressed data, so that reading does not wait on
+a connection that is kept alive for the next request.
+"""
+import zlib
+from StringIO import StringIO
+
+from httpexceptor import HTTP400, HTTP415
+
+from tiddlywebplugins.form.exceptions import HTTP413
+from tiddlywebplugins.form.limits import LimitedInput
+
+
+DEFAULT_MAX_RATIO = 100
+CHUNK_SIZE = 64 * 1024
+
+WBITS = {
+    'gzip': 16 + zlib.MAX_WBITS,
+    'x-gzip': 16 + zlib.MAX_WBITS,
+    'deflate': zlib.MAX_WBITS,
+}
+
+
+class DecompressingInput(object):
+    """
+    Wrap a compressed stream, reading from it only as much as is
+    needed to give the decompressed data asked for, and no more than
+    length bytes, if given.
+    """
+
+    def __init__(self, stream, encoding, max_ratio=DEFAULT_MAX_RATIO,
+            length=None):
+        self.stream = stream
+        self.encoding = encoding
+        self.max_ratio = max_ratio
+        self.length = length
+        self.decompressor = zlib.decompressobj(WBITS[encoding])
+        self.buffer = ''
+        self.compressed = 0
+        self.decompressed = 0
+        self.finished = False
+
+    def _decompress(self, data):
+        try:
+            return self.decompressor.decompress(data, CHUNK_SIZE)
+        except zlib.error as exc:
+            if (self.encoding == 'deflate' and not self.decompressed
+                    and self.compressed == len(data)):
+                # Not zlib wrapped, so try again as raw deflate.
+                self.encoding = 'raw deflate'
+                self.decompressor = zlib.decompressobj(-zlib.MAX_WBITS)
+                return self._decompress(data)
+            raise HTTP400('unable to decompress %s body: %s'
+                    % (self.encoding, exc))
+
+    def _fill(self):
+        """
+        Add some more decompressed data to the buffer. Return False
+        when there is no more.
+        """
+        if self.finished:
+            return False
+        data = self.decompressor.unconsumed_tail
+        if not data and not self._ended():
+            size = CHUNK_SIZE
+            if self.length is not None:
+                size = min(size, self.length - self.compressed)
+            data = self.stream.read(size)
+            self.compressed += len(data)
+        if data:
+            output = self._decompress(data)
+        else:
+            output = self.decompressor.flush()
+            self.finished = True
+        self.decompressed += len(output)
+        if self.max_ratio and self.decompressed > self.max_ratio * max(
+                self.compressed, CHUNK_SIZE):
+            raise HTTP413('%s body expands more than %s times'
+                    % (self.encoding, self.max_ratio))
+        self.buffer += output
+        return True
+
+    def _ended(self):
+        """
+        Whether all of the compressed data has been read: length bytes
+        of it, or up to where zlib found the end of the stream.
+        """
+        if self.length is not None and self.compressed >= self.length:
+            return True
+        if getattr(self.decompressor, 'eof', False):
+            return True
+        if self.decompressor.unused_data:
+            return True
+        if self.length is not None or not self.compressed:
+            return False
+        # Without Content-Length, and without eof before Python 3.3,
+        # find out if the stream has ended by seeing whether a copy
+        # of the decompressor leaves another byte unused.
+        probe = self.decompressor.copy()
+        try:
+            probe.decompress('\0')
+        except zlib.error:
+            return False
+        return bool(probe.unused_data)
+
+    def _take(self, size):
+        data, self.buffer = self.buffer[:size], self.buffer[size:]
+        return data
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            while self._fill():
+                pass
+            return self._take(len(self.buffer))
+        while len(self.buffer) < size and self._fill():
+            pass
+        return self._take(size)
+
+    def readline(self, size=-1):
+        start = 0
+        while True:
+            index = self.buffer.find('\n', start)
+            if index >= 0:
+                end = index + 1
+                break
+            if size is not None and 0 <= size <= len(self.buffer):
+                end = size
+                break
+            start = len(self.buffer)
+            if not self._fill():
+                end = len(self.buffer)
+                break
+        if size is not None and size >= 0:
+            end = min(end, size)
+        return self._take(end)
+
+    def readlines(self, hint=-1):
+        return list(iter(self.readline, ''))
+
+    def __iter__(self):
+        return iter(self.readline, '')
+
+
+def decode_body(environ, limits):
+    """
+    If the request body is compressed, replace wsgi.input with a
+    stream of the decompressed body. A urlencoded body is read in
+    full, as the core parser reads CONTENT_LENGTH bytes of it.
+    """
+    encoding = environ.get('HTTP_CONTENT_ENCODING', '').strip().lower()
+    if not encoding or encoding == 'identity':
+        return
+    if encoding not in WBITS:
+        raise HTTP415('Content-Encoding %s is not supported' % encoding)
+
+    config = environ['tiddlyweb.config']
+    max_ratio = config.get('form.max_inflate_ratio', DEFAULT_MAX_RATIO)
+    try:
+        length = int(environ.get('CONTENT_LENGTH') or 0) or None
+    except ValueError:
+        length = None
+    stream = DecompressingInput(environ['wsgi.input'], encoding,
+            max_ratio and float(max_ratio), length)
+    if limits.max_body is not None:
+        stream = LimitedInput(stream, limits.max_body)
+
+    if environ.get('CONTENT_TYPE', '').startswith(
+            'application/x-www-form-urlencoded'):
+        body = stream.read()
+        environ['CONTENT_LENGTH'] = str(len(body))
+        stream = StringIO(body)
+    environ['wsgi.input'] = stream
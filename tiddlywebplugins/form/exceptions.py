@@ -0,0 +1,52 @@
+"""
+HTTP exceptions, in the style of httpexceptor, for statuses that
+httpexceptor does not provide.
+"""
+from httpexceptor import HTTPException
+
+
+class HTTP411(HTTPException):
+    """411 Length Required"""
+
+    status = __doc__
+
+
+class HTTP413(HTTPException):
+    """413 Request Entity Too Large"""
+
+    status = __doc__
+
+
+class HTTP422(HTTPException):
+    """422 Unprocessable Entity"""
+
+    status = __doc__
+
+
+class RetryAfterException(HTTPException):
+    """
+    An HTTPException that may say, in Retry-After, how many seconds
+    to wait before trying again.
+    """
+
+    def __init__(self, message, retry_after=None):
+        HTTPException.__init__(self, message)
+        self.retry_after = retry_after
+
+    def headers(self):
+        headers = HTTPException.headers(self)
+        if self.retry_after is not None:
+            headers.append(('Retry-After', '%s' % self.retry_after))
+        return headers
+
+
+class HTTP429(RetryAfterException):
+    """429 Too Many Requests"""
+
+    status = __doc__
+
+
+class HTTP503(RetryAfterException):
+    """503 Service Unavailable"""
+
+    status = __doc__
@@ -0,0 +1,307 @@
+"""
+Idempotency keys for form POSTs.
+
+With form.idempotency set to memory or file, a form POST may carry a
+key in an Idempotency-Key header or an _idempotency_key form field.
+The response to the first POST with a key is kept, and a POST by the
+same user to the same URL with the same key within form.idempotency_ttl
+seconds (default 3600) gets that response again, with an
+Idempotent-Replayed header, without anything being written. A repeat
+that arrives while the first is still being handled gets 409, and one
+whose form or files differ from the first gets 422.
+
+Only successful responses are kept, so a POST that failed can be
+retried with the same key.
+
+memory keeps up to form.idempotency_size (default 10000) responses in
+the process. file keeps them in form.idempotency_dir (default
+idempotency, relative to root_dir), where every process on the host
+sees them.
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from tempfile import NamedTemporaryFile
+
+from httpexceptor import HTTP400, HTTP409
+
+from tiddlywebplugins.form.exceptions import HTTP422
+from tiddlywebplugins.form.paths import config_path, ensure_dir
+
+
+KEY_FIELD = '_idempotency_key'
+MAX_KEY_LENGTH = 255
+DEFAULT_TTL = 3600
+DEFAULT_SIZE = 10000
+# a file backend reservation older than this was left by a dead process
+PENDING_TIMEOUT = 300
+PENDING = object()
+MISMATCH = object()
+
+
+class MemoryCache(object):
+    """
+    Responses kept in a dict in the process, oldest first.
+    """
+
+    def __init__(self, ttl=DEFAULT_TTL, size=DEFAULT_SIZE):
+        self.ttl = ttl
+        self.size = size
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def reserve(self, key, fingerprint=None):
+        """
+        Return the response kept for key, PENDING if the first
+        request with key is still running, or MISMATCH if the first
+        request had a different fingerprint. Otherwise reserve key for
+        this request and return None.
+        """
+        now = time.time()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[0] > now:
+                if entry[1] != fingerprint:
+                    return MISMATCH
+                return entry[2]
+            self.entries.pop(key, None)
+            self.entries[key] = (now + self.ttl, fingerprint, PENDING)
+            self._trim(now)
+        return None
+
+    def store(self, key, response, fingerprint=None):
+        with self.lock:
+            self.entries[key] = (time.time() + self.ttl, fingerprint,
+                    response)
+
+    def release(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+
+    def _trim(self, now):
+        while self.entries:
+            oldest_key, (expires, _, _) = next(iter(self.entries.items()))
+            if expires > now and len(self.entries) <= self.size:
+                break
+            del self.entries[oldest_key]
+
+
+class FileCache(object):
+    """
+    Responses kept as JSON files in a directory, one per key, so they
+    are shared between processes. A file without a status, holding
+    only the fingerprint of the request or nothing yet, is a
+    reservation. The status, headers and body are kept with each byte
+    as a character, and given back as byte strings.
+    """
+
+    def __init__(self, directory, ttl=DEFAULT_TTL, size=DEFAULT_SIZE):
+        self.directory = directory
+        self.ttl = ttl
+        self.size = size
+        self.stores = 0
+
+    def path(self, key):
+        return os.path.join(self.directory, key)
+
+    def reserve(self, key, fingerprint=None):
+        ensure_dir(self.directory)
+        path = self.path(key)
+        while True:
+            try:
+                handle = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY,
+                    0o600)
+            except OSError:
+                pass
+            else:
+                with os.fdopen(handle, 'w') as entry:
+                    json.dump({'fingerprint': fingerprint}, entry)
+                return None
+            try:
+                age = time.time() - os.path.getmtime(path)
+                with open(path) as entry:
+                    content = entry.read()
+            except (IOError, OSError):
+                continue
+            response = json.loads(content) if content else {}
+            if 'status' not in response:
+                if age < PENDING_TIMEOUT:
+                    if content and response['fingerprint'] != fingerprint:
+                        return MISMATCH
+                    return PENDING
+            elif age < self.ttl:
+                if response.get('fingerprint') != fingerprint:
+                    return MISMATCH
+                return (_bytes(response['status']),
+                        [(_bytes(name), _bytes(value))
+                            for name, value in response['headers']],
+                        _bytes(response['body']))
+            self.release(key)
+
+    def store(self, key, response, fingerprint=None):
+        status, headers, body = response
+        temporary = NamedTemporaryFile(dir=self.directory, prefix='.tmp-',
+                delete=False)
+        if isinstance(body, unicode):
+            body = body.encode('utf-8')
+        with temporary:
+            json.dump({'status': _text(status),
+                'headers': [(_text(name), _text(value))
+                    for name, value in headers],
+                'body': _text(body),
+                'fingerprint': fingerprint}, temporary)
+        os.rename(temporary.name, self.path(key))
+        self.stores += 1
+        if self.stores % 100 == 0:
+            self.sweep()
+
+    def release(self, key):
+        try:
+            os.unlink(self.path(key))
+        except OSError:
+            pass
+
+    def sweep(self):
+        """
+        Remove expired responses, and the oldest beyond size.
+        """
+        now = time.time()
+        entries = []
+        for name in os.listdir(self.directory):
+            if name.startswith('.'):
+                continue
+            try:
+                entries.append((os.path.getmtime(self.path(name)), name))
+            except OSError:
+                continue
+        entries.sort()
+        excess = len(entries) - self.size
+        for index, (modified, name) in enumerate(entries):
+            if index < excess or now - modified >= max(self.ttl,
+                    PENDING_TIMEOUT):
+                self.release(name)
+
+
+def _text(value):
+    """
+    A byte string as JSON can hold it, each byte a character.
+    """
+    if isinstance(value, unicode):
+        return value
+    return value.decode('latin-1')
+
+
+def _bytes(value):
+    """
+    A value stored by _text, as the byte string WSGI needs.
+    """
+    return value.encode('latin-1')
+
+
+_MEMORY_CACHE = None
+_MEMORY_LOCK = threading.Lock()
+
+
+def get_cache(config):
+    """
+    Return the cache chosen by form.idempotency.
+    """
+    global _MEMORY_CACHE
+    ttl = int(config.get('form.idempotency_ttl', DEFAULT_TTL))
+    size = int(config.get('form.idempotency_size', DEFAULT_SIZE))
+    if config.get('form.idempotency') == 'file':
+        return FileCache(config_path(config, 'form.idempotency_dir',
+            'idempotency'), ttl, size)
+    with _MEMORY_LOCK:
+        if _MEMORY_CACHE is None:
+            _MEMORY_CACHE = MemoryCache(ttl, size)
+        return _MEMORY_CACHE
+
+
+def request_key(environ):
+    """
+    The idempotency key of the request, scoped to the user and URL,
+    or None. The form field is removed from the form.
+    """
+    form = environ['tiddlyweb.query']
+    key = environ.get('HTTP_IDEMPOTENCY_KEY')
+    field = form.pop(KEY_FIELD, None)
+    if not key and field:
+        key = field[0]
+    if not key:
+        return None
+    if len(key) > MAX_KEY_LENGTH:
+        raise HTTP400('idempotency key longer than %s characters'
+                % MAX_KEY_LENGTH)
+    scoped = u'\0'.join([environ['tiddlyweb.usersign']['name'],
+        environ.get('SCRIPT_NAME', '') + environ.get('PATH_INFO', ''),
+        key.decode('utf-8') if isinstance(key, str) else key])
+    return hashlib.sha256(scoped.encode('utf-8')).hexdigest()
+
+
+def request_fingerprint(environ):
+    """
+    A digest of what was POSTed: the form, without the key, and the
+    field name, filename, type and content of each uploaded file.
+    Files are hashed as they are spooled, so are not read again.
+    """
+    from tiddlywebplugins.form.digests import hex_digest
+    digest = hashlib.sha256()
+    form = environ['tiddlyweb.query']
+    for key in sorted(form):
+        digest.update(json.dumps([key, form[key]]) + '\n')
+    for upload in environ.get('tiddlyweb.input_files', []):
+        digest.update(json.dumps([upload.name, upload.filename, upload.type,
+            hex_digest(upload.file, 'sha256')]) + '\n')
+    return digest.hexdigest()
+
+
+def idempotent(handler):
+    """
+    Wrap a POST handler so that repeats of a request with the same
+    idempotency key get the first response.
+    """
+    def idempotent_handler(environ, start_response):
+        key = request_key(environ)
+        if key is None:
+            return handler(environ, start_response)
+
+        fingerprint = request_fingerprint(environ)
+        cache = get_cache(environ['tiddlyweb.config'])
+        response = cache.reserve(key, fingerprint)
+        if response is MISMATCH:
+            raise HTTP422('this idempotency key was used with a different '
+                    'request')
+        if response is PENDING:
+            raise HTTP409('a request with this idempotency key is still '
+                    'being handled')
+        if response is not None:
+            status, headers, body = response
+            start_response(status, headers
+                    + [('Idempotent-Replayed', 'true')])
+            return [body]
+
+        captured = []
+
+        def capturing_start_response(status, headers, exc_info=None):
+            captured[:] = [status, headers]
+            if exc_info:
+                return start_response(status, headers, exc_info)
+            return start_response(status, headers)
+
+        try:
+            body = ''.join(handler(environ, capturing_start_response))
+        except:
+            cache.release(key)
+            raise
+        if captured and captured[0][0] in '23':
+            cache.store(key, (captured[0], list(captured[1]), body),
+                    fingerprint)
+        else:
+            cache.release(key)
+        return [body]
+
+    return idempotent_handler
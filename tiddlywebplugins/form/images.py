@@ -0,0 +1,241 @@
+"""
+Derived images made when an image is uploaded.
+
+With form.image_max_size set, uploaded images wider or taller than that
+many pixels are scaled down to fit before they are stored. With
+form.image_thumbnails set to a list of sizes, each uploaded image also
+gets a sibling tiddler per size, titled <title>.thumb-<size>, holding
+the image scaled to fit in a square of that many pixels. Thumbnails
+have a _form_original field naming the uploaded tiddler, which has a
+_form_thumbnails field listing the sizes made.
+
+Images are only scaled down, never up. The scaling is done in a pool
+of form.image_workers processes (default 2), so it does not hold the
+interpreter lock of the server process, and the images of one POST are
+scaled in parallel. It is not done in the background: the request
+waits for its images, for at most form.image_timeout seconds (default
+30) in all, before anything is stored. An image not scaled by then, or
+that can not be read, is stored as it was sent.
+
+The pool is started by the first request with images to scale, not
+when the plugin is loaded, as a CGI process loads the app for every
+request and most of those have no images. A process forked from the
+one that started the pool, such as a worker of a pre-forking server,
+starts a pool of its own. Its workers only scale images, so none of
+the locks they inherit from the server's threads are ever taken. A
+request in a process that serves only the one (wsgi.run_once, as
+under CGI) scales its images itself, without forking a pool for them,
+and so without the timeout.
+
+This needs PIL (or Pillow). Without it uploads are stored unchanged.
+"""
+import atexit
+import logging
+import multiprocessing
+import os
+import threading
+import time
+from StringIO import StringIO
+
+from tiddlyweb.model.tiddler import Tiddler
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+
+LOGGER = logging.getLogger(__name__)
+
+ORIGINAL_FIELD = '_form_original'
+THUMBNAILS_FIELD = '_form_thumbnails'
+THUMBNAIL_TITLE = '%s.thumb-%s'
+DEFAULT_WORKERS = 2
+DEFAULT_TIMEOUT = 30
+# image types PIL can both read and write
+IMAGE_TYPES = ['image/jpeg', 'image/png', 'image/gif', 'image/bmp',
+        'image/x-ms-bmp', 'image/tiff', 'image/webp']
+
+
+def scale(data, max_size, sizes):
+    """
+    Scale the image in data. Return the image scaled to fit max_size,
+    or None if it already fits or max_size is None, and a list of
+    (size, data) for each of sizes smaller than the image.
+
+    This runs in the worker processes.
+    """
+    image = Image.open(StringIO(data))
+    image.load()
+    image_format = image.format
+    largest = max(image.size)
+    original = None
+    if max_size and largest > max_size:
+        original = _encode(_fit(image, max_size), image_format)
+    thumbnails = [(size, _encode(_fit(image, size), image_format))
+            for size in sizes if size < largest]
+    return original, thumbnails
+
+
+def _fit(image, size):
+    scaled = image.copy()
+    scaled.thumbnail((size, size), getattr(Image, 'LANCZOS',
+        getattr(Image, 'ANTIALIAS', None)))
+    return scaled
+
+
+def _encode(image, image_format):
+    if image_format == 'JPEG' and image.mode not in ('RGB', 'L'):
+        image = image.convert('RGB')
+    output = StringIO()
+    image.save(output, image_format)
+    return output.getvalue()
+
+
+_POOL = None
+_POOL_PID = None
+_POOL_LOCK = threading.Lock()
+
+
+def get_pool(config):
+    """
+    Return the process pool of this process, starting it if this is
+    its first use, or if this process was forked after it started.
+    """
+    global _POOL, _POOL_PID
+    with _POOL_LOCK:
+        if _POOL is None or _POOL_PID != os.getpid():
+            if _POOL is not None:
+                LOGGER.debug('starting image pool in forked process %s',
+                        os.getpid())
+            _POOL = multiprocessing.Pool(int(config.get('form.image_workers',
+                DEFAULT_WORKERS)))
+            _POOL_PID = os.getpid()
+        return _POOL
+
+
+class Scaled(object):
+    """
+    An image scaled in this process, with the get of the AsyncResult
+    of one scaled in the pool.
+    """
+
+    def __init__(self, *args):
+        self.error = self.value = None
+        try:
+            self.value = scale(*args)
+        except Exception as exc:
+            self.error = exc
+
+    def get(self, timeout=None):
+        if self.error is not None:
+            raise self.error
+        return self.value
+
+
+@atexit.register
+def shutdown():
+    """
+    Stop the process pool, if started.
+    """
+    global _POOL
+    with _POOL_LOCK:
+        pool, _POOL = _POOL, None
+    if pool is not None and _POOL_PID == os.getpid():
+        pool.terminate()
+        pool.join()
+
+
+def derive_images(environ, tiddlers):
+    """
+    Scale the images among tiddlers and return their thumbnails as
+    new tiddlers, in the same bags. The images are scaled in parallel,
+    waiting up to form.image_timeout for all of them.
+    """
+    config = environ['tiddlyweb.config']
+    if Image is None:
+        LOGGER.warning('PIL is not installed, images are not scaled')
+        return []
+    max_size = config.get('form.image_max_size')
+    max_size = max_size and int(max_size)
+    sizes = sorted(int(size) for size in config.get('form.image_thumbnails',
+        []))
+    images = [tiddler for tiddler in tiddlers if tiddler.type in IMAGE_TYPES]
+    if not images:
+        return []
+    deadline = time.time() + float(config.get('form.image_timeout',
+        DEFAULT_TIMEOUT))
+
+    if environ.get('wsgi.run_once'):
+        jobs = [(tiddler, Scaled(get_content(environ, tiddler), max_size,
+            sizes)) for tiddler in images]
+    else:
+        pool = get_pool(config)
+        jobs = [(tiddler, pool.apply_async(scale,
+            (get_content(environ, tiddler), max_size, sizes)))
+            for tiddler in images]
+
+    thumbnails = []
+    for tiddler, job in jobs:
+        try:
+            original, scaled = job.get(max(0, deadline - time.time()))
+        except multiprocessing.TimeoutError:
+            LOGGER.warning('timed out scaling image %s:%s', tiddler.bag,
+                    tiddler.title)
+            continue
+        except Exception as exc:
+            LOGGER.warning('unable to scale image %s:%s: %s', tiddler.bag,
+                    tiddler.title, exc)
+            continue
+        if original is not None:
+            set_content(environ, tiddler, original)
+        if scaled:
+            tiddler.fields[THUMBNAILS_FIELD] = ' '.join(str(size)
+                    for size, _ in scaled)
+        for size, data in scaled:
+            thumbnail = Tiddler(THUMBNAIL_TITLE % (tiddler.title, size),
+                    tiddler.bag)
+            thumbnail.recipe = tiddler.recipe
+            thumbnail.type = tiddler.type
+            thumbnail.tags = list(tiddler.tags)
+            thumbnail.fields[ORIGINAL_FIELD] = tiddler.title
+            set_content(environ, thumbnail, data)
+            thumbnails.append(thumbnail)
+    return thumbnails
+
+
+def get_content(environ, tiddler):
+    """
+    The bytes of an uploaded tiddler, from its text or its pending blob.
+    """
+    from tiddlywebplugins.form.blobs import BLOB_FIELD
+    if BLOB_FIELD in tiddler.fields:
+        fileobj = environ['tiddlyweb.form.blobs'][
+                tiddler.fields[BLOB_FIELD]][0]
+        fileobj.seek(0)
+        data = fileobj.read()
+        fileobj.seek(0)
+        return data
+    return tiddler.text
+
+
+def set_content(environ, tiddler, data):
+    """
+    Set the bytes of an uploaded tiddler, and their digest, as a
+    pending blob with form.dedup set or when they are over
+    form.blob_threshold.
+    """
+    from tiddlywebplugins.form.blobs import BLOB_FIELD, blob_wanted, hash_file
+    from tiddlywebplugins.form.digests import set_digest
+    config = environ['tiddlyweb.config']
+    fileobj = StringIO(data)
+    set_digest(config, tiddler, fileobj)
+    if blob_wanted(config, fileobj):
+        digest, size = hash_file(fileobj)
+        tiddler.text = ''
+        tiddler.fields[BLOB_FIELD] = digest
+        environ.setdefault('tiddlyweb.form.blobs', {})[digest] = (
+                fileobj, size)
+    else:
+        tiddler.fields.pop(BLOB_FIELD, None)
+        tiddler.text = data
@@ -0,0 +1,118 @@
+"""
+Limits on the size of POSTed forms.
+
+    form.max_body - bytes in the whole request body
+    form.max_file - bytes in any one uploaded file
+    form.max_field - bytes in any one text field
+    form.max_fields - number of fields and files
+
+None of them are set by default. A request whose Content-Length is
+over form.max_body is refused before any of its body is read. Bodies
+without a Content-Length, or with a false one, are cut off as soon
+as they go over a limit while being read. Either way the response
+is 413.
+"""
+from tiddlywebplugins.form.exceptions import HTTP413
+
+
+class Limits(object):
+    """
+    The limits configured in config, None where there is no limit.
+    """
+
+    def __init__(self, config):
+        self.max_body = _setting(config, 'form.max_body')
+        self.max_file = _setting(config, 'form.max_file')
+        self.max_field = _setting(config, 'form.max_field')
+        self.max_fields = _setting(config, 'form.max_fields')
+
+    def __nonzero__(self):
+        return any(limit is not None for limit in [self.max_body,
+            self.max_file, self.max_field, self.max_fields])
+
+    __bool__ = __nonzero__
+
+    def check_request(self, environ):
+        """
+        Refuse a request that declares too large a body and make sure
+        the body read can not go past max_body.
+        """
+        if self.max_body is None:
+            return
+        try:
+            length = int(environ.get('CONTENT_LENGTH') or 0)
+        except ValueError:
+            length = 0
+        if length > self.max_body:
+            raise HTTP413('request body of %s bytes is over the limit of %s'
+                    % (length, self.max_body))
+        environ['wsgi.input'] = LimitedInput(environ['wsgi.input'],
+                self.max_body)
+
+    def check_form(self, form, files=()):
+        """
+        Check the number of fields and files in the parsed form, and
+        the size of each. Small parts are held in memory by the parser
+        without being counted as they are read, so this catches those.
+        """
+        if self.max_fields is not None:
+            count = sum(len(values) for values in form.values()) + len(files)
+            if count > self.max_fields:
+                raise HTTP413('%s form fields is over the limit of %s'
+                        % (count, self.max_fields))
+        if self.max_field is not None:
+            for key, values in form.items():
+                for value in values:
+                    if len(value) > self.max_field:
+                        raise HTTP413('field %s is over the limit of %s '
+                                'bytes' % (key, self.max_field))
+        if self.max_file is not None:
+            for upload in files:
+                upload.file.seek(0, 2)
+                size = upload.file.tell()
+                upload.file.seek(0)
+                if size > self.max_file:
+                    raise HTTP413('file %s is over the limit of %s bytes'
+                            % (upload.filename, self.max_file))
+
+
+class LimitedInput(object):
+    """
+    Wrap wsgi.input so that reading more than limit bytes from it
+    raises HTTP413.
+    """
+
+    def __init__(self, stream, limit):
+        self.stream = stream
+        self.limit = limit
+        self.count = 0
+
+    def _counted(self, data):
+        self.count += len(data)
+        if self.count > self.limit:
+            raise HTTP413('request body is over the limit of %s bytes'
+                    % self.limit)
+        return data
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            return self._counted(self.stream.read())
+        return self._counted(self.stream.read(size))
+
+    def readline(self, size=-1):
+        if size is None or size < 0:
+            return self._counted(self.stream.readline())
+        return self._counted(self.stream.readline(size))
+
+    def readlines(self, hint=-1):
+        return list(iter(self.readline, ''))
+
+    def __iter__(self):
+        return iter(self.readline, '')
+
+
+def _setting(config, key):
+    value = config.get(key)
+    if value is None:
+        return None
+    return int(value)
@@ -0,0 +1,391 @@
+"""
+Load generator for the form POST routes, run by the formload twanager
+command.
+
+A mix of form POSTs is sent to the bags (or, with --recipes, the
+recipes) tiddlers routes by a pool of
+threads, or of processes, either to the TiddlyWeb app loaded in the
+same process, using the configured store, or to a server at a URL.
+Throughput, latency percentiles, the statuses returned and symptoms of
+lock contention (conflicts, refusals under load and the spread of
+latencies) are reported.
+
+The kinds of POST are:
+
+    urlencoded - a small urlencoded tiddler
+    multipart - a tiddler with a file of --size bytes
+    redirect - a urlencoded tiddler with a redirect, which is not
+               followed
+
+POSTs go to bags named formload0 to formload<N-1>, spread evenly over
+--bags of them. With --recipes they go through recipes of the same
+names, each holding just its bag, so recipe handling is included in
+what is measured. In the same process the bags and recipes are created
+in the store. A server at a URL is asked to create them with PUTs,
+which must be allowed to the guest user, or they must already exist.
+"""
+import argparse
+import json
+import multiprocessing
+import random
+import sys
+import time
+from multiprocessing.pool import ThreadPool
+from StringIO import StringIO
+from urlparse import urlparse
+
+from tiddlyweb.model.bag import Bag
+from tiddlyweb.model.recipe import Recipe
+from tiddlyweb.store import NoBagError
+
+
+BOUNDARY = '---------------------------formload'
+MULTIPART_TYPE = 'multipart/form-data; boundary=%s' % BOUNDARY
+URLENCODED_TYPE = 'application/x-www-form-urlencoded'
+KINDS = ['urlencoded', 'multipart', 'redirect']
+DEFAULT_MIX = 'urlencoded=6,multipart=3,redirect=1'
+BAG_PREFIX = 'formload'
+# statuses that suggest requests are fighting over the store
+CONFLICT_STATUSES = ['409', '412']
+THROTTLE_STATUSES = ['429', '503']
+
+_TARGET = None
+
+
+class AppTarget(object):
+    """
+    Send requests to a WSGI app in this process.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    def request(self, method, path, body, content_type):
+        environ = {
+            'REQUEST_METHOD': method,
+            'SCRIPT_NAME': '',
+            'PATH_INFO': path,
+            'QUERY_STRING': '',
+            'SERVER_NAME': 'localhost',
+            'SERVER_PORT': '8080',
+            'SERVER_PROTOCOL': 'HTTP/1.1',
+            'REMOTE_ADDR': '127.0.0.1',
+            'CONTENT_TYPE': content_type,
+            'CONTENT_LENGTH': str(len(body)),
+            'wsgi.input': StringIO(body),
+            'wsgi.errors': sys.stderr,
+            'wsgi.url_scheme': 'http',
+            'wsgi.multithread': True,
+            'wsgi.multiprocess': True,
+        }
+        status = []
+
+        def start_response(response_status, headers, exc_info=None):
+            status.append(response_status)
+
+        for _ in self.app(environ, start_response):
+            pass
+        return status[0].split(' ', 1)[0]
+
+
+class URLTarget(object):
+    """
+    Send requests to a server, on a new connection for each.
+    """
+
+    def __init__(self, url):
+        parts = urlparse(url)
+        self.scheme = parts.scheme
+        self.netloc = parts.netloc
+        self.prefix = parts.path.rstrip('/')
+
+    def request(self, method, path, body, content_type):
+        import httplib
+        if self.scheme == 'https':
+            connection = httplib.HTTPSConnection(self.netloc)
+        else:
+            connection = httplib.HTTPConnection(self.netloc)
+        try:
+            connection.request(method, self.prefix + path, body,
+                    {'Content-Type': content_type})
+            response = connection.getresponse()
+            response.read()
+            return str(response.status)
+        finally:
+            connection.close()
+
+
+def make_target(config, url=None):
+    """
+    The target requests are sent to: the server at url or, without
+    one, the app loaded with config.
+    """
+    if url:
+        return URLTarget(url)
+    from tiddlyweb.web import serve
+    return AppTarget(serve.load_app())
+
+
+def _set_target(config, url):
+    global _TARGET
+    _TARGET = make_target(config, url)
+
+
+def create_containers(config, target, count, url=None, recipes=False):
+    """
+    Make sure the bags POSTs are sent to exist, and with recipes, a
+    recipe for each of them. Return the paths of the containers.
+    """
+    names = ['%s%s' % (BAG_PREFIX, index) for index in range(count)]
+    if url:
+        for name in names:
+            target.request('PUT', '/bags/%s' % name, json.dumps({
+                'desc': 'formload', 'policy': {}}), 'application/json')
+            if recipes:
+                target.request('PUT', '/recipes/%s' % name, json.dumps({
+                    'desc': 'formload', 'policy': {},
+                    'recipe': [[name, '']]}), 'application/json')
+    else:
+        from tiddlywebplugins.utils import get_store
+        store = get_store(config)
+        for name in names:
+            try:
+                store.get(Bag(name))
+            except NoBagError:
+                store.put(Bag(name))
+            if recipes:
+                recipe = Recipe(name)
+                recipe.set_recipe([(name, '')])
+                store.put(recipe)
+    container = 'recipes' if recipes else 'bags'
+    return ['/%s/%s' % (container, name) for name in names]
+
+
+def parse_mix(mix):
+    """
+    Turn kind=weight,... into a list of (kind, weight).
+    """
+    weights = []
+    for item in mix.split(','):
+        kind, _, weight = item.partition('=')
+        kind = kind.strip()
+        if kind not in KINDS:
+            raise ValueError('unknown kind of POST %s, not one of %s'
+                    % (kind, ', '.join(KINDS)))
+        weights.append((kind, float(weight or 1)))
+    return weights
+
+
+def make_jobs(count, mix, containers, size, seed=None):
+    """
+    Build the requests to send, as (kind, path, body, content type).
+    Titles are unique to the run, so runs do not overwrite each other.
+    """
+    chooser = random.Random(seed)
+    run_id = '%x' % int(time.time() * 1000)
+    kinds = [kind for kind, _ in mix]
+    total = sum(weight for _, weight in mix)
+    content = ('formload ' * (size // 9 + 1))[:size]
+    jobs = []
+    for index in range(count):
+        point = chooser.random() * total
+        for kind, weight in mix:
+            point -= weight
+            if point < 0:
+                break
+        else:
+            kind = kinds[-1]
+        title = 'formload-%s-%s' % (run_id, index)
+        path = '%s/tiddlers' % containers[index % len(containers)]
+        if kind == 'multipart':
+            body = '\r\n'.join([
+                '--' + BOUNDARY,
+                'Content-Disposition: form-data; name="title"',
+                '',
+                title,
+                '--' + BOUNDARY,
+                'Content-Disposition: form-data; name="file"; '
+                    'filename="%s.txt"' % title,
+                'Content-Type: text/plain',
+                '',
+                content,
+                '--' + BOUNDARY + '--',
+                ''])
+            jobs.append((kind, path, body, MULTIPART_TYPE))
+        else:
+            body = 'title=%s&text=formload%%20text&tags=formload' % title
+            if kind == 'redirect':
+                body += '&redirect=%s' % path
+            jobs.append((kind, path, body, URLENCODED_TYPE))
+    return jobs
+
+
+def send(job):
+    """
+    Send one request, returning its kind, status and latency.
+    Exceptions are reported as a status naming them.
+    """
+    kind, path, body, content_type = job
+    start = time.time()
+    try:
+        status = _TARGET.request('POST', path, body, content_type)
+    except Exception as exc:
+        status = 'error:%s' % exc.__class__.__name__
+    return kind, status, time.time() - start
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0
+    index = min(len(sorted_values) - 1,
+            int(round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def latencies_ms(latencies):
+    latencies = sorted(latencies)
+    return dict([(name, percentile(latencies, fraction) * 1000)
+        for name, fraction in [('p50', 0.5), ('p90', 0.9), ('p99', 0.99)]]
+        + [('max', (latencies[-1] if latencies else 0) * 1000)])
+
+
+def summarise(results, elapsed):
+    """
+    Reduce the (kind, status, latency) of each request to the figures
+    reported.
+    """
+    statuses = {}
+    kinds = {}
+    for kind, status, latency in results:
+        statuses[status] = statuses.get(status, 0) + 1
+        kind_results = kinds.setdefault(kind, {'latencies': [],
+            'errors': 0})
+        kind_results['latencies'].append(latency)
+        if not status[0] in '23':
+            kind_results['errors'] += 1
+    errors = sum(count for status, count in statuses.items()
+            if status[0] not in '23')
+    latency = latencies_ms([latency for _, _, latency in results])
+    return {
+        'requests': len(results),
+        'seconds': elapsed,
+        'requests_per_second': len(results) / elapsed if elapsed else 0,
+        'latency_ms': latency,
+        'statuses': statuses,
+        'errors': errors,
+        'error_rate': float(errors) / len(results) if results else 0,
+        'kinds': dict((kind, {
+            'requests': len(kind_results['latencies']),
+            'errors': kind_results['errors'],
+            'latency_ms': latencies_ms(kind_results['latencies'])})
+            for kind, kind_results in kinds.items()),
+        'contention': {
+            'conflicts': sum(statuses.get(status, 0)
+                for status in CONFLICT_STATUSES),
+            'throttled': sum(statuses.get(status, 0)
+                for status in THROTTLE_STATUSES),
+            'p99_p50_ratio': (latency['p99'] / latency['p50']
+                if latency['p50'] else 0),
+        },
+    }
+
+
+def run(config, requests=1000, concurrency=10, processes=False,
+        mix=DEFAULT_MIX, bags=1, size=1024, url=None, seed=None,
+        recipes=False):
+    """
+    Send requests POSTs, concurrency at a time, and return the summary
+    of the results.
+    """
+    target = make_target(config, url)
+    containers = create_containers(config, target, bags, url, recipes)
+    jobs = make_jobs(requests, parse_mix(mix), containers, size, seed)
+    if processes:
+        pool = multiprocessing.Pool(concurrency, initializer=_set_target,
+                initargs=(config, url))
+    else:
+        global _TARGET
+        _TARGET = target
+        pool = ThreadPool(concurrency)
+    try:
+        start = time.time()
+        results = pool.map(send, jobs, chunksize=1)
+        elapsed = time.time() - start
+    finally:
+        pool.close()
+        pool.join()
+    summary = summarise(results, elapsed)
+    summary.update({
+        'target': url or 'in-process',
+        'workers': 'processes' if processes else 'threads',
+        'concurrency': concurrency,
+        'bags': bags,
+        'route': 'recipes' if recipes else 'bags',
+        'mix': mix,
+    })
+    return summary
+
+
+def report(summary):
+    """
+    The summary as lines of text.
+    """
+    latency = summary['latency_ms']
+    contention = summary['contention']
+    lines = [
+        'target %s, %s %s, %s %s, mix %s' % (summary['target'],
+            summary['concurrency'], summary['workers'], summary['bags'],
+            summary['route'], summary['mix']),
+        '%s requests in %.2f s, %.1f requests/s' % (summary['requests'],
+            summary['seconds'], summary['requests_per_second']),
+        'latency ms p50 %.2f p90 %.2f p99 %.2f max %.2f' % (latency['p50'],
+            latency['p90'], latency['p99'], latency['max']),
+        'errors %s (%.2f%%)' % (summary['errors'],
+            summary['error_rate'] * 100),
+        'statuses %s' % ' '.join('%s=%s' % item
+            for item in sorted(summary['statuses'].items())),
+    ]
+    for kind, figures in sorted(summary['kinds'].items()):
+        lines.append('  %-10s %6s requests %6s errors p50 %.2f ms p99 %.2f ms'
+                % (kind, figures['requests'], figures['errors'],
+                    figures['latency_ms']['p50'],
+                    figures['latency_ms']['p99']))
+    lines.append('contention: %s conflicts (409/412), %s refused under load '
+            '(429/503), p99/p50 latency %.1f' % (contention['conflicts'],
+                contention['throttled'], contention['p99_p50_ratio']))
+    return lines
+
+
+def main(args, config):
+    parser = argparse.ArgumentParser(prog='twanager formload',
+            description='send concurrent form POSTs and report how they '
+            'were handled')
+    parser.add_argument('--url', help='base URL of a server to load, '
+            'instead of the app in this process')
+    parser.add_argument('--requests', type=int, default=1000)
+    parser.add_argument('--concurrency', type=int, default=10)
+    parser.add_argument('--processes', action='store_true',
+            help='use a pool of processes rather than threads')
+    parser.add_argument('--mix', default=DEFAULT_MIX,
+            help='weights of the kinds of POST (default %s)' % DEFAULT_MIX)
+    parser.add_argument('--bags', type=int, default=1,
+            help='how many bags to spread POSTs over')
+    parser.add_argument('--recipes', action='store_true',
+            help='POST through recipes rather than straight to bags')
+    parser.add_argument('--size', type=int, default=1024,
+            help='bytes in each multipart file')
+    parser.add_argument('--seed', type=int, help='seed for the mix')
+    parser.add_argument('--output', help='also write the results as '
+            'JSON to this file')
+    options = parser.parse_args(args)
+
+    summary = run(config, requests=options.requests,
+            concurrency=options.concurrency, processes=options.processes,
+            mix=options.mix, bags=options.bags, size=options.size,
+            url=options.url, seed=options.seed, recipes=options.recipes)
+    for line in report(summary):
+        print(line)
+    if options.output:
+        with open(options.output, 'w') as output:
+            json.dump(summary, output, indent=2, sort_keys=True)
+    return summary
@@ -0,0 +1,190 @@
+"""
+Peak memory profiling of form POSTs.
+
+When form.memory_profile is set, the memory each form POST uses from
+the start of parsing its body to the end of the handler is measured.
+The peak, its ratio to the size of the request body, and, with
+tracemalloc, the form.memory_top (default 10) source lines holding the
+most memory at the end of the handler are logged as one line, and, if
+form.memory_report is set to a file name, appended to that file as a
+line of JSON.
+
+With tracemalloc, in the standard library from Python 3.4 and available
+for Python 2 as pytracemalloc, the peak is of memory allocated by
+Python. Without it the peak is of the resident set size of the process
+above what it was when the request started: on Linux the high-water
+mark in /proc/self/status is reset for each request, elsewhere the
+growth of ru_maxrss from getrusage, which only counts a request that
+takes the process above its earlier peak. The report names the backend
+used, tracemalloc or rss.
+
+Both measure the whole process, so only one request is profiled at a
+time. A form POST made while another is being profiled is handled as
+usual, without being profiled, rather than waiting. Profiling is meant
+for finding out how many copies of an upload are made, not for
+production.
+"""
+import json
+import logging
+import re
+import sys
+import threading
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+
+LOGGER = logging.getLogger(__name__)
+
+MEMORY_KEY = 'tiddlyweb.form.memory'
+DEFAULT_TOP = 10
+STATUS_FILE = '/proc/self/status'
+CLEAR_REFS_FILE = '/proc/self/clear_refs'
+# writing this to clear_refs resets the peak resident set size
+RESET_PEAK = '5'
+
+_LOCK = threading.Lock()
+
+
+def profile(application, environ, start_response):
+    """
+    Call application, measuring the memory it uses, unless another
+    request is being profiled.
+    """
+    if tracemalloc is not None:
+        profiler = _profile_tracemalloc
+    elif resource is not None or status_size('VmHWM') is not None:
+        profiler = _profile_rss
+    else:
+        LOGGER.warning('neither tracemalloc nor the resident set size is '
+                'available, form POSTs are not profiled')
+        return application(environ, start_response)
+
+    if not _LOCK.acquire(False):
+        LOGGER.debug('form POST to %s not profiled, as another is',
+                environ.get('PATH_INFO'))
+        return application(environ, start_response)
+    try:
+        return profiler(application, environ, start_response)
+    finally:
+        _LOCK.release()
+
+
+def _profile_tracemalloc(application, environ, start_response):
+    """
+    Call application with tracemalloc on, then report the peak and
+    the top allocation sites.
+    """
+    config = environ['tiddlyweb.config']
+    top = int(config.get('form.memory_top', DEFAULT_TOP))
+    started = not tracemalloc.is_tracing()
+    if started:
+        tracemalloc.start()
+    tracemalloc.clear_traces()
+    try:
+        return application(environ, start_response)
+    finally:
+        peak = tracemalloc.get_traced_memory()[1]
+        snapshot = tracemalloc.take_snapshot().filter_traces(
+                [tracemalloc.Filter(False, tracemalloc.__file__),
+                    tracemalloc.Filter(False, __file__)])
+        if started:
+            tracemalloc.stop()
+        report(environ, 'tracemalloc', peak, [('%s:%s'
+            % (stat.traceback[0].filename, stat.traceback[0].lineno),
+            stat.size) for stat in snapshot.statistics('lineno')[:top]])
+
+
+def _profile_rss(application, environ, start_response):
+    """
+    Call application, then report how far the resident set size of
+    the process went above where it started.
+    """
+    if reset_peak():
+        start = status_size('VmRSS')
+    else:
+        start = peak_rss()
+    try:
+        return application(environ, start_response)
+    finally:
+        report(environ, 'rss', max(0, peak_rss() - start), [])
+
+
+def status_size(name):
+    """
+    The size in bytes of the named line of /proc/self/status, or None
+    if there is no such file or line.
+    """
+    try:
+        with open(STATUS_FILE) as status:
+            match = re.search(r'^%s:\s+(\d+) kB' % name, status.read(),
+                    re.MULTILINE)
+    except (IOError, OSError):
+        return None
+    return match and int(match.group(1)) * 1024
+
+
+def reset_peak():
+    """
+    Reset the peak resident set size of the process, returning False
+    if it can not be.
+    """
+    if status_size('VmHWM') is None:
+        return False
+    try:
+        with open(CLEAR_REFS_FILE, 'w') as clear_refs:
+            clear_refs.write(RESET_PEAK)
+    except (IOError, OSError):
+        return False
+    return True
+
+
+def peak_rss():
+    """
+    The peak resident set size of the process in bytes.
+    """
+    peak = status_size('VmHWM')
+    if peak is None:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # ru_maxrss is in bytes on Mac OS X, elsewhere in kilobytes
+        if sys.platform != 'darwin':
+            peak *= 1024
+    return peak
+
+
+def report(environ, backend, peak, sites):
+    """
+    Log the memory used by a request, keep it in the environ and
+    append it to form.memory_report. Called with the profiling lock
+    held, so reports are not interleaved.
+    """
+    try:
+        upload_bytes = int(environ.get('CONTENT_LENGTH') or 0)
+    except ValueError:
+        upload_bytes = 0
+    result = {
+        'backend': backend,
+        'method': environ.get('REQUEST_METHOD'),
+        'path': environ.get('PATH_INFO'),
+        'bytes': upload_bytes,
+        'peak': peak,
+        'ratio': float(peak) / upload_bytes if upload_bytes else None,
+        'top': sites,
+    }
+    environ[MEMORY_KEY] = result
+    LOGGER.info('form memory backend=%s method=%s path=%s bytes=%s peak=%s '
+            'ratio=%s top=%s', backend, result['method'], result['path'],
+            upload_bytes, peak,
+            '%.2f' % result['ratio'] if upload_bytes else '-',
+            ','.join('%s=%s' % site for site in sites))
+    report_file = environ['tiddlyweb.config'].get('form.memory_report')
+    if report_file:
+        with open(report_file, 'a') as output:
+            output.write(json.dumps(result) + '\n')
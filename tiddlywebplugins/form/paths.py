@@ -0,0 +1,29 @@
+"""
+Where the plugin keeps the files it makes: blobs, upload sessions,
+redirect counters, idempotency records and rate limit buckets.
+"""
+import os
+
+
+def config_path(config, key, default):
+    """
+    The path set by key in config, or default, relative to root_dir
+    when not absolute.
+    """
+    path = config.get(key, default)
+    if not os.path.isabs(path):
+        path = os.path.join(config.get('root_dir', ''), path)
+    return path
+
+
+def ensure_dir(directory):
+    """
+    Make directory, and its parents, if it does not exist, allowing
+    for another process making it at the same time.
+    """
+    if not os.path.isdir(directory):
+        try:
+            os.makedirs(directory)
+        except OSError:
+            if not os.path.isdir(directory):
+                raise
@@ -0,0 +1,226 @@
+"""
+A replacement for tiddlyweb.web.query.Query that leaves the body of
+form POSTs to bags and recipes tiddlers URLs to a FormBody filter
+after UserExtract, which parses multipart/form-data with a
+SpoolingFieldStorage.
+
+Everything else, including form POSTs to other URLs, is handed to the
+core Query.
+This is also where timing of form POSTs starts, when form.timing is set,
+where rate limits and the size limits in tiddlywebplugins.form.limits
+are applied, where compressed bodies are decompressed and where memory
+profiling starts, when form.memory_profile is set.
+"""
+import re
+from functools import partial
+from urllib import unquote
+
+from httpexceptor import HTTP400
+
+from tiddlyweb.filters import parse_for_filters
+from tiddlyweb.web.extractor import UserExtract
+from tiddlyweb.web.query import (Query, parse_qs, ENCODED_QUERY,
+        _cgi_post, _process_post, _update_tiddlyweb_query)
+
+from tiddlywebplugins.form import phase
+from tiddlywebplugins.form.encoding import decode_body
+from tiddlywebplugins.form.limits import Limits
+from tiddlywebplugins.form.spool import field_storage_class
+
+
+ROUTE_KEY = 'tiddlyweb.form.route'
+TIDDLERS_PATH = re.compile(r'/(?:bags|recipes)/[^/]+/tiddlers(?:\.[^/]+)?$')
+RATE_SETTINGS = ['form.rate_user', 'form.rate_address', 'form.rate_bag']
+
+
+class FormQuery(Query):
+    """
+    Extract CGI parameter data from QUERY_STRING. The body of a form
+    POST is left for FormBody, after the user is known.
+    """
+
+    def __call__(self, environ, start_response):
+        if (environ['tiddlyweb.config'].get('form.timing')
+                and form_post(environ)):
+            from tiddlywebplugins.form import timing
+            return timing.instrument(partial(Query.__call__, self),
+                    environ, start_response)
+        return Query.__call__(self, environ, start_response)
+
+    def extract_query(self, environ):
+        if not form_post(environ):
+            return Query.extract_query(self, environ)
+        environ['tiddlyweb.query'] = {}
+        environ['tiddlyweb.input_files'] = []
+        _extract_query_string(environ)
+
+
+class FormBody(object):
+    """
+    Extract form data POSTed to a bags or recipes tiddlers URL,
+    spooling uploaded files according to form.spool_size and
+    form.spool_dir. This runs after UserExtract, so that rate limits
+    and bag policies can be applied before the body is read.
+    """
+
+    def __init__(self, application):
+        self.application = application
+
+    def __call__(self, environ, start_response):
+        if not form_post(environ):
+            return self.application(environ, start_response)
+        config = environ['tiddlyweb.config']
+        if any(config.get(setting) for setting in RATE_SETTINGS):
+            from tiddlywebplugins.form import ratelimit
+            ratelimit.check_request(environ, route_args(environ))
+        self.check_policy(environ)
+        if config.get('form.memory_profile'):
+            from tiddlywebplugins.form import memprofile
+            return memprofile.profile(self._form_call, environ,
+                    start_response)
+        return self._form_call(environ, start_response)
+
+    def check_policy(self, environ):
+        """
+        Refuse a form POST to a bags or recipes tiddlers route that
+        the user could not put a tiddler through, before its body is
+        read.
+        """
+        args = route_args(environ)
+        if 'bag_name' in args or 'recipe_name' in args:
+            from tiddlywebplugins.form import check_container
+            with phase(environ, 'policy'):
+                check_container(environ, args.get('bag_name'),
+                        args.get('recipe_name'))
+
+    def _form_call(self, environ, start_response):
+        with phase(environ, 'parse'):
+            self.extract_body(environ, environ.get('CONTENT_TYPE', ''))
+        return self.application(environ, start_response)
+
+    def extract_body(self, environ, content_type):
+        """
+        Add the form data to tiddlyweb.query, under what FormQuery
+        found in QUERY_STRING, and check the body and uploaded files
+        against any digests sent with them.
+        """
+        from tiddlywebplugins.form.digests import (check_body,
+                check_uploads, digest_body)
+        limits = Limits(environ['tiddlyweb.config'])
+        if limits:
+            limits.check_request(environ)
+        body_digests = digest_body(environ)
+        stream = environ['wsgi.input']
+        decode_body(environ, limits)
+        query_data = environ['tiddlyweb.query']
+        environ['tiddlyweb.query'] = {}
+        if content_type.startswith('multipart/form-data'):
+            self._extract_multipart(environ)
+        else:
+            _process_post(environ, content_type)
+        if body_digests:
+            check_body(stream, body_digests)
+        environ['tiddlyweb.query'].update(query_data)
+        if limits:
+            limits.check_form(environ['tiddlyweb.query'],
+                    environ['tiddlyweb.input_files'])
+        check_uploads(environ)
+
+    def _extract_multipart(self, environ):
+        """
+        As the core _process_post, for multipart/form-data POSTs.
+        """
+        try:
+            posted_data = _process_multipartform(environ)
+            _update_tiddlyweb_query(environ, posted_data,
+                    encoded=ENCODED_QUERY)
+        except UnicodeDecodeError as exc:
+            raise HTTP400(
+                    'Invalid encoding in query data, utf-8 required: %s' %
+                    exc)
+
+
+def _extract_query_string(environ):
+    """
+    Add the parameters in QUERY_STRING to tiddlyweb.query and set
+    tiddlyweb.filters.
+    """
+    filters, leftovers = parse_for_filters(
+            environ.get('QUERY_STRING', ''), environ)
+    query_data = parse_qs(leftovers, keep_blank_values=True)
+    try:
+        _update_tiddlyweb_query(environ, query_data,
+                encoded=ENCODED_QUERY)
+    except UnicodeDecodeError as exc:
+        raise HTTP400(
+                'Invalid encoding in query string, utf-8 required: %s' %
+                exc)
+    environ['tiddlyweb.filters'] = filters
+
+
+def form_post(environ):
+    """
+    Whether the request is a form POST to a bags or recipes tiddlers
+    URL, the only ones whose body FormBody reads.
+    """
+    return bool(_cgi_post(environ, environ.get('CONTENT_TYPE', ''))
+            and TIDDLERS_PATH.search(environ.get('PATH_INFO', '')))
+
+
+def route_args(environ):
+    """
+    The decoded arguments of the route a request is for, as the
+    selector will find them, before it has run.
+    """
+    if ROUTE_KEY not in environ:
+        selector = environ['tiddlyweb.config']['selector']
+        args = selector.select(environ.get('PATH_INFO', ''),
+                environ['REQUEST_METHOD'])[1]
+        environ[ROUTE_KEY] = dict((key, unquote(value).decode('utf-8'))
+                for key, value in args.items() if value is not None)
+    return environ[ROUTE_KEY]
+
+
+def _process_multipartform(environ):
+    """
+    Read multipart/form-data, return a dictionary of form data
+    and set tiddlyweb.input_files to a list of uploaded files.
+    Several files may share the same field name.
+    """
+    storage_class = field_storage_class(environ['tiddlyweb.config'])
+    posted_data = {}
+    try:
+        field_storage = storage_class(fp=environ['wsgi.input'],
+                environ=environ, keep_blank_values=True)
+    except ValueError as exc:
+        raise HTTP400('Invalid post, bad form: %s' % exc)
+    for key in field_storage.keys():
+        fields = field_storage[key]
+        if not isinstance(fields, list):
+            fields = [fields]
+        values = []
+        for field in fields:
+            if getattr(field, 'filename', None):
+                environ['tiddlyweb.input_files'].append(field)
+            else:
+                values.append(field.value)
+        if values:
+            posted_data[key] = values
+    return posted_data
+
+
+def install(config):
+    """
+    Swap the core Query for FormQuery in server_request_filters and
+    add FormBody after UserExtract. Safe to call more than once.
+    """
+    filters = config['server_request_filters']
+    try:
+        filters[filters.index(Query)] = FormQuery
+    except ValueError:
+        pass
+    if FormBody not in filters:
+        try:
+            filters.insert(filters.index(UserExtract) + 1, FormBody)
+        except ValueError:
+            filters.append(FormBody)
@@ -0,0 +1,269 @@
+"""
+Rate limits on form POSTs to bags and recipes.
+
+Each of these, set to a pair of (requests, seconds), limits form POSTs
+with a token bucket that holds up to requests tokens and refills at
+requests per seconds, so bursts of up to requests POSTs are allowed:
+
+    form.rate_user - POSTs by each user other than GUEST
+    form.rate_address - POSTs from each client address
+    form.rate_bag - POSTs to each bag, or for a recipe URL each recipe
+
+A POST takes a token from each bucket it is counted against, and only
+when all of them have one. Otherwise it gets 429, with a Retry-After
+of the seconds until it would be let through, before its body is read.
+
+form.rate_backend says where the buckets are kept:
+
+    memory - in the process (the default)
+    file - in a directory of files, one per bucket, locked while in use
+    sqlite - in a SQLite database
+
+file and sqlite let the processes on one host share the limits. They
+are kept in form.rate_path, relative to root_dir if not absolute
+(default ratelimits, or ratelimits.db for sqlite).
+"""
+import hashlib
+import json
+import math
+import os
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+from tiddlywebplugins.form.exceptions import HTTP429
+from tiddlywebplugins.form.paths import config_path, ensure_dir
+
+
+LIMITS = ['user', 'address', 'bag']
+# how often, in seconds, buckets that have refilled are removed
+SWEEP_INTERVAL = 60
+SQLITE_TIMEOUT = 10
+
+
+def admit(states, buckets, now):
+    """
+    Given the stored (tokens, updated) of the buckets, by key, return
+    the seconds to wait before a request could take a token from each
+    of buckets, and if that is 0 the new states, with expires times
+    after which they are full again and need not be kept.
+    """
+    wait = 0
+    new_states = {}
+    for key, requests, seconds in buckets:
+        tokens, updated = states.get(key, (requests, now))[:2]
+        tokens = min(requests, tokens + (now - updated) * requests / seconds)
+        if tokens < 1:
+            wait = max(wait, (1 - tokens) * seconds / requests)
+        new_states[key] = (tokens - 1, now, now + seconds)
+    if wait:
+        return wait, None
+    return 0, new_states
+
+
+class MemoryBuckets(object):
+    """
+    Buckets kept in a dict in the process.
+    """
+
+    def __init__(self):
+        self.states = {}
+        self.lock = threading.Lock()
+        self.swept = 0
+
+    def take(self, buckets, now):
+        with self.lock:
+            wait, new_states = admit(self.states, buckets, now)
+            if new_states:
+                self.states.update(new_states)
+            if now - self.swept > SWEEP_INTERVAL:
+                self.swept = now
+                for key, state in list(self.states.items()):
+                    if state[2] <= now:
+                        del self.states[key]
+        return wait
+
+
+class FileBuckets(object):
+    """
+    Buckets kept in a directory, one JSON file per bucket, each
+    locked while a request takes from it.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.swept = 0
+
+    def path(self, key):
+        return os.path.join(self.directory,
+                hashlib.sha1(key.encode('utf-8')).hexdigest())
+
+    def take(self, buckets, now):
+        ensure_dir(self.directory)
+        files = {}
+        try:
+            # lock in a fixed order so two requests can not deadlock
+            for key in sorted(set(bucket[0] for bucket in buckets)):
+                files[key] = self._open(self.path(key))
+            states = {}
+            for key, bucket_file in files.items():
+                content = bucket_file.read()
+                if content:
+                    states[key] = json.loads(content)
+            wait, new_states = admit(states, buckets, now)
+            for key, state in (new_states or {}).items():
+                files[key].seek(0)
+                files[key].truncate()
+                json.dump(state, files[key])
+        finally:
+            for bucket_file in files.values():
+                bucket_file.close()
+        if now - self.swept > SWEEP_INTERVAL:
+            self.swept = now
+            self.sweep(now)
+        return wait
+
+    def _open(self, path):
+        bucket_file = os.fdopen(os.open(path, os.O_RDWR | os.O_CREAT,
+            0o644), 'r+')
+        if fcntl is not None:
+            fcntl.flock(bucket_file, fcntl.LOCK_EX)
+        return bucket_file
+
+    def sweep(self, now):
+        """
+        Remove the files of buckets that have refilled.
+        """
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            try:
+                bucket_file = self._open(path)
+            except (IOError, OSError):
+                continue
+            with bucket_file:
+                content = bucket_file.read()
+                if not content or json.loads(content)[2] <= now:
+                    os.unlink(path)
+
+
+class SQLiteBuckets(object):
+    """
+    Buckets kept in a SQLite database, read and updated in one
+    transaction per request.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.swept = 0
+        connection = self._connect()
+        try:
+            connection.execute('CREATE TABLE IF NOT EXISTS buckets ('
+                    'key TEXT PRIMARY KEY, tokens REAL, updated REAL, '
+                    'expires REAL)')
+        finally:
+            connection.close()
+
+    def _connect(self):
+        import sqlite3
+        return sqlite3.connect(self.path, timeout=SQLITE_TIMEOUT,
+                isolation_level=None)
+
+    def take(self, buckets, now):
+        keys = sorted(set(bucket[0] for bucket in buckets))
+        connection = self._connect()
+        try:
+            connection.execute('BEGIN IMMEDIATE')
+            try:
+                rows = connection.execute('SELECT key, tokens, updated '
+                        'FROM buckets WHERE key IN (%s)'
+                        % ', '.join('?' * len(keys)), keys)
+                states = dict((key, (tokens, updated))
+                        for key, tokens, updated in rows)
+                wait, new_states = admit(states, buckets, now)
+                if new_states:
+                    connection.executemany('INSERT OR REPLACE INTO buckets '
+                            'VALUES (?, ?, ?, ?)', [(key,) + state
+                                for key, state in new_states.items()])
+                if now - self.swept > SWEEP_INTERVAL:
+                    self.swept = now
+                    connection.execute('DELETE FROM buckets '
+                            'WHERE expires <= ?', (now,))
+                connection.execute('COMMIT')
+            except:
+                connection.execute('ROLLBACK')
+                raise
+        finally:
+            connection.close()
+        return wait
+
+
+_BUCKETS = {}
+_BUCKETS_LOCK = threading.Lock()
+
+
+def get_buckets(config):
+    """
+    Return the buckets configured by form.rate_backend and
+    form.rate_path, made on first use.
+    """
+    backend = config.get('form.rate_backend', 'memory')
+    path = None
+    if backend != 'memory':
+        path = config_path(config, 'form.rate_path',
+                'ratelimits.db' if backend == 'sqlite' else 'ratelimits')
+    with _BUCKETS_LOCK:
+        if (backend, path) not in _BUCKETS:
+            if backend == 'file':
+                buckets = FileBuckets(path)
+            elif backend == 'sqlite':
+                buckets = SQLiteBuckets(path)
+            else:
+                buckets = MemoryBuckets()
+            _BUCKETS[(backend, path)] = buckets
+        return _BUCKETS[(backend, path)]
+
+
+def request_buckets(environ, route_args):
+    """
+    The (key, requests, seconds) of each bucket a form POST to the
+    route with route_args is counted against.
+    """
+    config = environ['tiddlyweb.config']
+    if 'bag_name' in route_args:
+        target = u'bags/%s' % route_args['bag_name']
+    elif 'recipe_name' in route_args:
+        target = u'recipes/%s' % route_args['recipe_name']
+    else:
+        return []
+    user = environ['tiddlyweb.usersign']['name']
+    names = {
+        'user': user if user != u'GUEST' else None,
+        'address': environ.get('REMOTE_ADDR'),
+        'bag': target,
+    }
+    buckets = []
+    for kind in LIMITS:
+        setting = config.get('form.rate_%s' % kind)
+        if setting and names[kind]:
+            requests, seconds = setting
+            buckets.append((u'%s:%s' % (kind, names[kind]), float(requests),
+                float(seconds)))
+    return buckets
+
+
+def check_request(environ, route_args):
+    """
+    Take a token from each bucket a form POST is counted against,
+    or raise 429 if one is empty.
+    """
+    buckets = request_buckets(environ, route_args)
+    if not buckets:
+        return
+    wait = get_buckets(environ['tiddlyweb.config']).take(buckets, time.time())
+    if wait:
+        raise HTTP429('too many form POSTs, try again in %.1f seconds'
+                % wait, int(math.ceil(wait)))
@@ -0,0 +1,101 @@
+"""
+Cache busting of the redirects that follow a form POST.
+
+A redirect gets a .no-cache query parameter so that the page it leads
+to is not served stale from a cache. form.redirect_cache chooses what
+its value is:
+
+    uuid - a new random value every time (the default), so the page
+           is never served from a cache
+    revision - a digest of the bag, title and revision the store
+           gave each tiddler put, so the URL changes with every write
+           and names the revision it leads to; when form.write_behind
+           queues the writes, and so there is no revision yet, the
+           counter value is used instead
+    counter - the bag name and a count of the form POSTs with a
+           redirect into the bag, kept in form.counter_dir
+
+With revision or counter, repeat views of the page can be served from
+a cache. The count is only kept for POSTs that ask for a redirect and
+need it, so other POSTs take no lock and do no file I/O.
+"""
+import hashlib
+import os
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+from tiddlyweb.web.util import encode_name
+
+from tiddlywebplugins.form.paths import config_path, ensure_dir
+
+
+COUNTERS_KEY = 'tiddlyweb.form.counters'
+
+
+class BagCounters(object):
+    """
+    A directory of files, one per bag, each holding a count that is
+    incremented under a file lock, so several processes can share it.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def path(self, bag_name):
+        return os.path.join(self.directory, encode_name(bag_name))
+
+    def increment(self, bag_name):
+        """
+        Add one to the count for bag_name and return the new count.
+        """
+        ensure_dir(self.directory)
+        descriptor = os.open(self.path(bag_name), os.O_RDWR | os.O_CREAT,
+                0o644)
+        with os.fdopen(descriptor, 'r+') as counter_file:
+            if fcntl is not None:
+                fcntl.flock(counter_file, fcntl.LOCK_EX)
+            count = int(counter_file.read() or 0) + 1
+            counter_file.seek(0)
+            counter_file.truncate()
+            counter_file.write('%s' % count)
+        return count
+
+
+def bag_counters(config):
+    """
+    Return the BagCounters configured by form.counter_dir, relative
+    to root_dir when not absolute.
+    """
+    return BagCounters(config_path(config, 'form.counter_dir', 'counters'))
+
+
+def count_writes(environ, tiddlers):
+    """
+    Increment the counter of each bag tiddlers are put in, keeping
+    the new counts in the environ.
+    """
+    config = environ['tiddlyweb.config']
+    counters = bag_counters(config)
+    environ[COUNTERS_KEY] = dict((bag_name, counters.increment(bag_name))
+            for bag_name in set(tiddler.bag for tiddler in tiddlers))
+
+
+def cache_buster(environ, tiddlers):
+    """
+    The value of .no-cache for the redirect after tiddlers are put.
+    """
+    mode = environ['tiddlyweb.config'].get('form.redirect_cache', 'uuid')
+    if mode in ('counter', 'revision') and COUNTERS_KEY in environ:
+        return ','.join('%s:%s' % (bag_name, count) for bag_name, count
+                in sorted(environ[COUNTERS_KEY].items()))
+    if mode == 'revision':
+        digest = hashlib.sha1()
+        for tiddler in tiddlers:
+            digest.update(('%s/%s/%s\n' % (tiddler.bag, tiddler.title,
+                tiddler.revision)).encode('utf-8'))
+        return digest.hexdigest()[:16]
+    from uuid import uuid4
+    return '%s' % uuid4()
@@ -0,0 +1,148 @@
+"""
+Spooling of uploaded files.
+
+cgi.FieldStorage keeps the first 1000 bytes of each file part in
+memory and then moves it to an anonymous TemporaryFile. Here uploads
+are kept in memory up to a configurable size (form.spool_size) and then
+spill to a named temporary file in form.spool_dir. Because the spool
+file has a name, a store can hard link it into place with persist()
+rather than reading and writing the bytes again.
+
+Each file is hashed as it is spooled (see
+tiddlywebplugins.form.digests), so its digest needs no further read.
+
+The field storage also enforces form.max_file, form.max_field and
+form.max_fields (see tiddlywebplugins.form.limits) while the body is
+being read, so an oversized part is refused without being read in full.
+"""
+import os
+import shutil
+from cgi import FieldStorage
+from tempfile import SpooledTemporaryFile, NamedTemporaryFile
+
+from tiddlywebplugins.form.exceptions import HTTP413
+from tiddlywebplugins.form.limits import Limits
+
+
+DEFAULT_SPOOL_SIZE = 64 * 1024
+CHUNK_SIZE = 64 * 1024
+
+
+class SpoolFile(SpooledTemporaryFile):
+    """
+    A SpooledTemporaryFile that rolls over to a named file, so the
+    spooled data can be linked elsewhere without being copied.
+    Writing more than limit bytes, if given, raises HTTP413. What is
+    written is hashed with each of algorithms, into hashes.
+    """
+
+    def __init__(self, max_size=DEFAULT_SPOOL_SIZE, dir=None, limit=None,
+            algorithms=()):
+        SpooledTemporaryFile.__init__(self, max_size=max_size, mode='w+b',
+                dir=dir)
+        self.spool_dir = dir
+        self.limit = limit
+        self.written = 0
+        from tiddlywebplugins.form.digests import new_hashes
+        self.hashes = new_hashes(algorithms)
+
+    def write(self, data):
+        self.written += len(data)
+        if self.limit is not None and self.written > self.limit:
+            raise HTTP413('form part is over the limit of %s bytes'
+                    % self.limit)
+        for digest in self.hashes.values():
+            digest.update(data)
+        return SpooledTemporaryFile.write(self, data)
+
+    def rollover(self):
+        if self._rolled:
+            return
+        memory_file = self._file
+        named_file = NamedTemporaryFile(mode='w+b', prefix='form-upload-',
+                dir=self.spool_dir)
+        named_file.write(memory_file.getvalue())
+        named_file.seek(memory_file.tell(), 0)
+        self._file = named_file
+        self._rolled = True
+
+    @property
+    def rolled(self):
+        return self._rolled
+
+    def persist(self, path):
+        """
+        Make the spooled data available at path. If the data is on disk
+        and on the same filesystem it is hard linked, otherwise it is
+        copied in chunks.
+        """
+        self.flush()
+        if self._rolled:
+            try:
+                os.link(self._file.name, path)
+                return
+            except (OSError, AttributeError):
+                pass
+        position = self.tell()
+        self.seek(0)
+        with open(path, 'wb') as target:
+            shutil.copyfileobj(self, target, CHUNK_SIZE)
+        self.seek(position)
+
+
+class SpoolingFieldStorage(FieldStorage):
+    """
+    FieldStorage whose file parts are written to a SpoolFile.
+
+    FieldStorage creates the storage for each part by calling its
+    own class, so spool settings, limits and the count of parts read
+    live on the class. Use field_storage_class to get a class with the
+    required settings for each request.
+    """
+
+    spool_size = DEFAULT_SPOOL_SIZE
+    spool_dir = None
+    max_file = None
+    max_field = None
+    max_fields = None
+    digest = None
+    parts = 0
+
+    def __init__(self, *args, **kwargs):
+        cls = self.__class__
+        # The first instance is the whole form and the second the
+        # preamble before the first boundary; the rest are its parts.
+        if cls.max_fields is not None and cls.parts > cls.max_fields + 1:
+            raise HTTP413('form has more than %s fields' % cls.max_fields)
+        cls.parts += 1
+        FieldStorage.__init__(self, *args, **kwargs)
+
+    def make_file(self, binary=None):
+        if self.filename:
+            limit = self.max_file
+        else:
+            limit = self.max_field
+        from tiddlywebplugins.form.digests import part_digests
+        algorithms = set(part_digests(self))
+        algorithms.add(self.digest)
+        return SpoolFile(max_size=self.spool_size, dir=self.spool_dir,
+                limit=limit, algorithms=algorithms)
+
+
+def field_storage_class(config):
+    """
+    Return a SpoolingFieldStorage class configured from config.
+    Call it for each request, as the class counts the parts it reads.
+    """
+    from tiddlywebplugins.form.digests import digest_algorithm
+    limits = Limits(config)
+
+    class ConfiguredFieldStorage(SpoolingFieldStorage):
+        spool_size = int(config.get('form.spool_size', DEFAULT_SPOOL_SIZE))
+        spool_dir = config.get('form.spool_dir')
+        max_file = limits.max_file
+        max_field = limits.max_field
+        max_fields = limits.max_fields
+        digest = digest_algorithm(config)
+
+    return ConfiguredFieldStorage
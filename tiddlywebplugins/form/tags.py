@@ -0,0 +1,90 @@
+"""
+Parse TiddlyWiki style tag strings, eg "one two [[tag three]]".
+
+Forms send the same few tag strings over and over (checkbox groups,
+templates), so parsed results are kept in a bounded, roughly LRU cache keyed on
+the raw string, and the tags produced are interned so that repeated
+tags share a single string object.
+"""
+import re
+import threading
+
+
+DEFAULT_CACHE_SIZE = 1024
+
+TAG_PATTERN = re.compile(r'\[\[([^\]\]]+)\]\]|(\S+)')
+
+
+class TagParser(object):
+    """
+    Turn tag strings into lists of tags, in the order they first
+    appear, without duplicates.
+
+    The cache is an approximate LRU in two generations, so that a hit
+    is a plain dict lookup. New results go in the current generation.
+    When that holds cache_size entries it becomes the old generation
+    and the previous old generation is dropped. A hit in the old
+    generation moves the entry back into the current one, so strings
+    in use survive and at most 2 * cache_size entries are held.
+    """
+
+    def __init__(self, cache_size=DEFAULT_CACHE_SIZE):
+        self.cache_size = cache_size
+        self._current = {}
+        self._old = {}
+        self._interned = {}
+        self._lock = threading.Lock()
+
+    def parse(self, tag_string):
+        """
+        Return a new list of the tags in tag_string.
+        """
+        try:
+            return list(self._current[tag_string])
+        except KeyError:
+            pass
+        with self._lock:
+            tags = self._old.get(tag_string)
+            if tags is None:
+                tags = self._tokenize(tag_string)
+            if len(self._current) >= self.cache_size:
+                self._old = self._current
+                self._current = {}
+            self._current[tag_string] = tags
+        return list(tags)
+
+    def clear(self):
+        """
+        Empty the cache and the table of interned tags.
+        """
+        with self._lock:
+            self._current = {}
+            self._old = {}
+            self._interned.clear()
+
+    def _tokenize(self, tag_string):
+        tags = []
+        seen = set()
+        for bracketed, unbracketed in TAG_PATTERN.findall(tag_string):
+            tag = bracketed or unbracketed
+            if tag not in seen:
+                seen.add(tag)
+                tags.append(self._intern(tag))
+        return tuple(tags)
+
+    def _intern(self, tag):
+        # The builtin intern() does not take unicode on Python 2, so
+        # keep our own table, bounded so it cannot grow forever.
+        if len(self._interned) > self.cache_size * 8:
+            self._interned.clear()
+        return self._interned.setdefault(tag, tag)
+
+
+PARSER = TagParser()
+
+
+def parse_tags(tag_string):
+    """
+    Parse tag_string with the shared TagParser.
+    """
+    return PARSER.parse(tag_string)
@@ -0,0 +1,171 @@
+"""
+Timing of the phases of a form POST.
+
+When form.timing is set, each POST of form data gets a dict in
+tiddlyweb.form.timings in the environ, mapping phase names to seconds:
+
+    parse - reading and parsing the request body
+    build - turning the form into tiddlers
+    tags - parsing tag strings (part of build)
+    policy - checking bag policies
+    images - scaling uploaded images
+    store - writing to the store
+    redirect - building the redirect
+    total - the whole request, from the start of parsing
+
+At the end of the request the timings are logged as one line of
+key=value pairs and, if form.timing_collector is set to an object with
+a collect method (such as a Collector), passed to it.
+
+When form.timing is not set, phase() returns a shared context manager
+that does nothing. The plugin uses tiddlywebplugins.form.phase, which
+returns the same without importing this module.
+"""
+import logging
+import threading
+import time
+
+from httpexceptor import HTTPException
+
+from tiddlyweb.model.policy import PermissionsError, UserRequiredError
+
+from tiddlywebplugins.form import NULL_PHASE, TIMINGS_KEY
+
+
+LOGGER = logging.getLogger(__name__)
+
+# upper bounds, in milliseconds, of the latency histogram buckets
+BUCKETS = [1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000,
+        float('inf')]
+
+
+class _Phase(object):
+
+    def __init__(self, timings, name):
+        self.timings = timings
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.time()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.timings[self.name] = (self.timings.get(self.name, 0)
+                + time.time() - self.start)
+        return False
+
+
+def phase(environ, name):
+    """
+    Return a context manager that adds the time spent in it to the
+    named phase of the current request, if it is being timed.
+    """
+    timings = environ.get(TIMINGS_KEY)
+    if timings is None:
+        return NULL_PHASE
+    return _Phase(timings, name)
+
+
+def exception_status(exc):
+    """
+    The status the response filters will turn exc into.
+    """
+    if isinstance(exc, HTTPException):
+        return exc.status
+    if isinstance(exc, UserRequiredError):
+        return '401 Unauthorized'
+    if isinstance(exc, PermissionsError):
+        return '403 Forbidden'
+    return '500 Internal Server Error'
+
+
+def instrument(application, environ, start_response):
+    """
+    Call application with timing turned on for this request, then
+    report the timings.
+    """
+    timings = environ[TIMINGS_KEY] = {}
+    status = []
+
+    def timing_start_response(response_status, headers, exc_info=None):
+        status.append(response_status)
+        if exc_info:
+            return start_response(response_status, headers, exc_info)
+        return start_response(response_status, headers)
+
+    start = time.time()
+    try:
+        return application(environ, timing_start_response)
+    except Exception as exc:
+        status.append(exception_status(exc))
+        raise
+    finally:
+        timings['total'] = time.time() - start
+        report(environ, status[-1] if status else '500', timings)
+
+
+def report(environ, status, timings):
+    """
+    Log timings and pass them to the configured collector.
+    """
+    try:
+        upload_bytes = int(environ.get('CONTENT_LENGTH') or 0)
+    except ValueError:
+        upload_bytes = 0
+    status_code = status.split(' ', 1)[0]
+    LOGGER.info('form timing method=%s path=%s status=%s bytes=%s %s',
+            environ.get('REQUEST_METHOD'), environ.get('PATH_INFO'),
+            status_code, upload_bytes, ' '.join('%s_ms=%.3f'
+                % (name, seconds * 1000)
+                for name, seconds in sorted(timings.items())))
+    collector = environ['tiddlyweb.config'].get('form.timing_collector')
+    if collector is not None:
+        collector.collect(status_code, upload_bytes, timings)
+
+
+class Collector(object):
+    """
+    Aggregate timings across requests: counts of requests, uploaded
+    bytes and error responses by status, and a latency histogram for
+    each phase.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.requests = 0
+            self.bytes_uploaded = 0
+            self.errors = {}
+            self.histograms = {}
+
+    def collect(self, status_code, upload_bytes, timings):
+        with self._lock:
+            self.requests += 1
+            self.bytes_uploaded += upload_bytes
+            if not status_code.startswith(('1', '2', '3')):
+                self.errors[status_code] = self.errors.get(status_code, 0) + 1
+            for name, seconds in timings.items():
+                histogram = self.histograms.setdefault(name,
+                        [0] * len(BUCKETS))
+                milliseconds = seconds * 1000
+                for index, bound in enumerate(BUCKETS):
+                    if milliseconds <= bound:
+                        histogram[index] += 1
+                        break
+
+    def snapshot(self):
+        """
+        Return a copy of the collected figures.
+        """
+        with self._lock:
+            return {
+                'requests': self.requests,
+                'bytes_uploaded': self.bytes_uploaded,
+                'errors': dict(self.errors),
+                'buckets_ms': BUCKETS,
+                'histograms': dict((name, list(histogram))
+                    for name, histogram in self.histograms.items()),
+            }
@@ -0,0 +1,465 @@
+"""
+Resumable uploads of large files in numbered parts.
+
+A client opens an upload session by POSTing a form to a bags or
+recipes tiddlers URL as usual, with no file and with _upload=start.
+The other keys in the form (title, tags, fields, redirect) are kept
+for the tiddler that will be made, and type, if given, becomes its
+content type. Permission to create or write the tiddler is checked
+straight away. The response is 201 with the session URL in Location.
+
+    PUT /form/uploads/{upload_id}/{part}    store one part (from 1)
+    GET /form/uploads/{upload_id}           list the parts received
+    POST /form/uploads/{upload_id}          commit
+    DELETE /form/uploads/{upload_id}        abandon the session
+
+A part may be sent again, in which case it replaces the earlier copy,
+and parts may arrive in any order. Committing puts the tiddler from
+parts 1 to n, which must all be present, responding as a POST of the
+whole file would have. The parts are read in place as one file, not
+copied into another: an upload stored as a blob is written from them
+straight to its path in the blob store, or linked there if it has just
+one part.
+
+Parts are numbered from 1 to form.upload_max_parts (default 10000).
+Sessions live in form.upload_dir. Those untouched for form.upload_ttl
+seconds are removed whenever a session is opened, and by the
+formuploads twanager command.
+"""
+import json
+import os
+import re
+import shutil
+import time
+from bisect import bisect_right
+from tempfile import NamedTemporaryFile
+from uuid import uuid4
+
+from httpexceptor import HTTP400, HTTP404, HTTP409
+
+from tiddlyweb.model.tiddler import Tiddler
+from tiddlyweb.store import NoBagError
+from tiddlyweb.web.util import get_route_value, server_base_url
+
+from tiddlywebplugins.form import (check_tiddlers, file_to_tiddler,
+        form_to_tiddler, get_redirect, place_tiddlers, put_tiddlers,
+        respond_put)
+from tiddlywebplugins.form.blobs import new_hash
+from tiddlywebplugins.form.digests import digest_algorithm, new_hashes
+from tiddlywebplugins.form.exceptions import HTTP411, HTTP413
+from tiddlywebplugins.form.limits import Limits
+from tiddlywebplugins.form.paths import config_path
+
+
+UPLOAD_KEY = '_upload'
+DEFAULT_TTL = 24 * 60 * 60
+DEFAULT_MAX_PARTS = 10000
+# part file names have eight digits
+LAST_PART = 99999999
+CHUNK_SIZE = 64 * 1024
+SESSION_PATTERN = re.compile(r'^[0-9a-f]{32}$')
+PART_PATTERN = re.compile(r'^part-(\d{8})$')
+
+
+class UploadedFile(object):
+    """
+    The joined parts of an upload, in the shape file_to_tiddler
+    expects of an uploaded file.
+    """
+
+    def __init__(self, fileobj, content_type):
+        self.file = fileobj
+        self.type = content_type
+
+
+class JoinedParts(object):
+    """
+    The part files at paths, read as one file without being copied.
+    Their content is hashed with each of algorithms, into hashes, as
+    they are joined, and persist() writes them to another path.
+    """
+
+    def __init__(self, paths, algorithms=()):
+        self.paths = paths
+        self.sizes = [os.path.getsize(path) for path in paths]
+        self.starts = []
+        self.size = 0
+        for size in self.sizes:
+            self.starts.append(self.size)
+            self.size += size
+        self.position = 0
+        self.current = None
+        self.hashes = new_hashes(algorithms)
+        if self.hashes:
+            while True:
+                chunk = self.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                for digest in self.hashes.values():
+                    digest.update(chunk)
+            self.seek(0)
+
+    def seek(self, offset, whence=0):
+        if whence == 1:
+            offset += self.position
+        elif whence == 2:
+            offset += self.size
+        self.position = max(offset, 0)
+
+    def tell(self):
+        return self.position
+
+    def read(self, size=-1):
+        chunks = []
+        while size != 0 and self.position < self.size:
+            index = bisect_right(self.starts, self.position) - 1
+            part = self._open(index)
+            part.seek(self.position - self.starts[index])
+            wanted = self.starts[index] + self.sizes[index] - self.position
+            if size > 0:
+                wanted = min(wanted, size)
+                size -= wanted
+            chunk = part.read(wanted)
+            if not chunk:
+                break
+            chunks.append(chunk)
+            self.position += len(chunk)
+        return ''.join(chunks)
+
+    def persist(self, path):
+        """
+        Write the joined parts to path, linking the part there if
+        there is only one.
+        """
+        if len(self.paths) == 1:
+            try:
+                os.link(self.paths[0], path)
+                return
+            except OSError:
+                pass
+        with open(path, 'wb') as target:
+            for part_path in self.paths:
+                with open(part_path, 'rb') as part:
+                    shutil.copyfileobj(part, target, CHUNK_SIZE)
+
+    def close(self):
+        if self.current is not None:
+            self.current[1].close()
+            self.current = None
+
+    def _open(self, index):
+        if self.current is None or self.current[0] != index:
+            self.close()
+            self.current = (index, open(self.paths[index], 'rb'))
+        return self.current[1]
+
+
+class UploadSessions(object):
+    """
+    A directory of upload sessions, one directory per session holding
+    session.json and a file for each part received.
+    """
+
+    def __init__(self, directory, ttl=DEFAULT_TTL):
+        self.directory = directory
+        self.ttl = ttl
+
+    def path(self, upload_id):
+        if not SESSION_PATTERN.match(upload_id):
+            raise KeyError(upload_id)
+        return os.path.join(self.directory, upload_id)
+
+    def create(self, session):
+        upload_id = uuid4().hex
+        path = self.path(upload_id)
+        os.makedirs(path)
+        with open(os.path.join(path, 'session.json'), 'w') as session_file:
+            json.dump(session, session_file)
+        return upload_id
+
+    def get(self, upload_id):
+        try:
+            with open(os.path.join(self.path(upload_id),
+                    'session.json')) as session_file:
+                return json.load(session_file)
+        except IOError:
+            raise KeyError(upload_id)
+
+    def parts(self, upload_id):
+        """
+        Return a dict of part number to size for the parts received.
+        """
+        path = self.path(upload_id)
+        parts = {}
+        for name in os.listdir(path):
+            match = PART_PATTERN.match(name)
+            if match:
+                parts[int(match.group(1))] = os.path.getsize(
+                        os.path.join(path, name))
+        return parts
+
+    def put_part(self, upload_id, number, stream, length):
+        """
+        Write length bytes from stream as part number, replacing any
+        earlier copy. The part appears only once it is complete.
+        """
+        path = self.path(upload_id)
+        temporary = NamedTemporaryFile(dir=path, prefix='.tmp-',
+                delete=False)
+        try:
+            with temporary:
+                remaining = length
+                while remaining > 0:
+                    chunk = stream.read(min(CHUNK_SIZE, remaining))
+                    if not chunk:
+                        raise HTTP400('part ended after %s of %s bytes'
+                                % (length - remaining, length))
+                    temporary.write(chunk)
+                    remaining -= len(chunk)
+            os.rename(temporary.name, os.path.join(path,
+                'part-%08d' % number))
+        except:
+            if os.path.exists(temporary.name):
+                os.unlink(temporary.name)
+            raise
+        # The mtime of the session directory is its last activity.
+        os.utime(path, None)
+
+    def join(self, upload_id, algorithms=()):
+        """
+        Return parts 1 to n as one JoinedParts, hashed with algorithms.
+        Raise ValueError naming the missing parts if they are not all
+        there.
+        """
+        parts = self.parts(upload_id)
+        if not parts:
+            raise ValueError('no parts')
+        missing = missing_parts(parts)
+        if missing:
+            raise ValueError('missing parts %s' % missing)
+        path = self.path(upload_id)
+        return JoinedParts([os.path.join(path, 'part-%08d' % number)
+            for number in sorted(parts)], algorithms)
+
+    def remove(self, upload_id):
+        shutil.rmtree(self.path(upload_id), ignore_errors=True)
+
+    def collect(self, now=None):
+        """
+        Remove sessions with no activity for ttl seconds and return
+        their ids.
+        """
+        if not os.path.isdir(self.directory):
+            return []
+        now = now or time.time()
+        removed = []
+        for upload_id in sorted(os.listdir(self.directory)):
+            if not SESSION_PATTERN.match(upload_id):
+                continue
+            try:
+                idle = now - os.path.getmtime(self.path(upload_id))
+            except OSError:
+                continue
+            if idle >= self.ttl:
+                self.remove(upload_id)
+                removed.append(upload_id)
+        return removed
+
+
+def upload_sessions(config):
+    """
+    Return the UploadSessions configured by form.upload_dir, relative
+    to root_dir when not absolute, and form.upload_ttl.
+    """
+    return UploadSessions(config_path(config, 'form.upload_dir', 'uploads'),
+            int(config.get('form.upload_ttl', DEFAULT_TTL)))
+
+
+def upload_uri(environ, upload_id):
+    return '%s/form/uploads/%s' % (server_base_url(environ), upload_id)
+
+
+def start_upload(environ, start_response):
+    """
+    Open an upload session for the form POSTed to a tiddlers URL,
+    once the user is known to be allowed to put the tiddler.
+    """
+    form = dict(environ['tiddlyweb.query'])
+    if form.pop(UPLOAD_KEY) != ['start']:
+        raise HTTP400('%s must be start' % UPLOAD_KEY)
+    if environ['tiddlyweb.input_files']:
+        raise HTTP400('files must be sent as parts of the upload')
+    try:
+        title = form['title'][0]
+    except (KeyError, IndexError):
+        title = str(uuid4())
+
+    tiddler = build_tiddler(environ, title, dict(form))
+    place_tiddlers(environ, [tiddler])
+    try:
+        check_tiddlers(environ, [tiddler])
+    except NoBagError as exc:
+        raise HTTP409('Unable to put tiddlers. There is no bag named: '
+                '%s. Create the bag.' % exc)
+
+    try:
+        container = ['recipes', get_route_value(environ, 'recipe_name')]
+    except KeyError:
+        container = ['bags', get_route_value(environ, 'bag_name')]
+
+    sessions = upload_sessions(environ['tiddlyweb.config'])
+    sessions.collect()
+    upload_id = sessions.create({
+        'container': container,
+        'title': title,
+        'form': form,
+        'user': environ['tiddlyweb.usersign']['name'],
+        'created': time.time()})
+
+    start_response('201 Created', [
+        ('Location', upload_uri(environ, upload_id))])
+    return []
+
+
+def build_tiddler(environ, title, form):
+    """
+    A tiddler from the form of an upload session, with type used
+    as its content type.
+    """
+    content_type = form.pop('type', [None])[0]
+    form.pop('redirect', None)
+    tiddler = form_to_tiddler(environ, Tiddler(title), form)
+    tiddler.type = content_type or 'application/octet-stream'
+    return tiddler
+
+
+def missing_parts(parts, shown=10):
+    """
+    Describe the gaps in the numbers of parts, which should run from
+    1, as ranges, naming at most shown of them.
+    """
+    gaps = []
+    expected = 1
+    for number in sorted(parts):
+        if number > expected:
+            if number - 1 > expected:
+                gaps.append('%s-%s' % (expected, number - 1))
+            else:
+                gaps.append(str(expected))
+        expected = number + 1
+    if len(gaps) > shown:
+        gaps = gaps[:shown] + ['...']
+    return ', '.join(gaps)
+
+
+def max_parts(config):
+    return min(int(config.get('form.upload_max_parts', DEFAULT_MAX_PARTS)),
+            LAST_PART)
+
+
+def get_session(environ):
+    """
+    The id and session named in the route, which must belong to the
+    current user.
+    """
+    upload_id = get_route_value(environ, 'upload_id')
+    sessions = upload_sessions(environ['tiddlyweb.config'])
+    try:
+        session = sessions.get(upload_id)
+    except KeyError:
+        raise HTTP404('upload %s not found' % upload_id)
+    if session['user'] != environ['tiddlyweb.usersign']['name']:
+        raise HTTP404('upload %s not found' % upload_id)
+    return sessions, upload_id, session
+
+
+def put_part(environ, start_response):
+    """
+    Store the request body as one numbered part of an upload.
+    """
+    sessions, upload_id, session = get_session(environ)
+    number = int(get_route_value(environ, 'part'))
+    last = max_parts(environ['tiddlyweb.config'])
+    if not 1 <= number <= last:
+        raise HTTP400('parts are numbered from 1 to %s' % last)
+    try:
+        length = int(environ['CONTENT_LENGTH'])
+    except (KeyError, ValueError):
+        raise HTTP411('parts must have a Content-Length')
+
+    limits = Limits(environ['tiddlyweb.config'])
+    if limits:
+        limits.check_request(environ)
+    if limits.max_file is not None:
+        parts = sessions.parts(upload_id)
+        parts.pop(number, None)
+        if sum(parts.values()) + length > limits.max_file:
+            raise HTTP413('upload is over the limit of %s bytes'
+                    % limits.max_file)
+
+    sessions.put_part(upload_id, number, environ['wsgi.input'], length)
+    start_response('204 No Content', [])
+    return []
+
+
+def get_upload(environ, start_response):
+    """
+    Describe an upload session and the parts it has received, so that
+    a client can tell which parts to send again.
+    """
+    sessions, upload_id, session = get_session(environ)
+    parts = sessions.parts(upload_id)
+    start_response('200 OK', [
+        ('Content-Type', 'application/json; charset=UTF-8'),
+        ('Cache-Control', 'no-cache')])
+    return [json.dumps({
+        'container': session['container'],
+        'title': session['title'],
+        'parts': dict((str(number), size)
+            for number, size in parts.items()),
+        'size': sum(parts.values())})]
+
+
+def commit_upload(environ, start_response):
+    """
+    Join the parts of an upload and put the tiddler, responding as
+    a POST of the whole file to the container would.
+    """
+    sessions, upload_id, session = get_session(environ)
+    config = environ['tiddlyweb.config']
+    try:
+        # the blob digest too, so a blob costs no further read
+        joined = sessions.join(upload_id, [digest_algorithm(config),
+            new_hash().name])
+    except ValueError as exc:
+        raise HTTP409('upload %s is incomplete: %s' % (upload_id, exc))
+
+    try:
+        form = dict(session['form'])
+        redirect = get_redirect(environ, form)
+        tiddler = build_tiddler(environ, session['title'], form)
+        file_to_tiddler(environ, tiddler,
+                UploadedFile(joined, tiddler.type))
+
+        # put_tiddlers places tiddlers by the route, so give it the
+        # container the session was opened on.
+        kind, name = session['container']
+        routing_args = environ.setdefault('wsgiorg.routing_args', ((), {}))
+        routing_args[1]['recipe_name' if kind == 'recipes'
+                else 'bag_name'] = name
+        write_id = put_tiddlers(environ, [tiddler])
+    finally:
+        joined.close()
+
+    sessions.remove(upload_id)
+    return respond_put(environ, start_response, tiddler, redirect, write_id)
+
+
+def delete_upload(environ, start_response):
+    """
+    Abandon an upload session and its parts.
+    """
+    sessions, upload_id, session = get_session(environ)
+    sessions.remove(upload_id)
+    start_response('204 No Content', [])
+    return []
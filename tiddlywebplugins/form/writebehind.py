@@ -0,0 +1,238 @@
+"""
+Write-behind of form POSTs.
+
+With form.write_behind set, a form POST is parsed and its tiddlers
+checked against the bag policies in the request as usual, but the
+store writes are queued and done by a pool of worker threads. The
+response is 202 Accepted with a status URL in Location:
+
+    GET /form/writes/{write_id}
+
+answers with JSON giving the status of the write (queued, done or
+failed), the URLs of its tiddlers and, if it failed, the error.
+
+    form.write_queue_size - writes that may wait (default 100)
+    form.write_workers - worker threads (default 2)
+
+When the queue is full the POST gets 503 with Retry-After. Each
+worker has a queue of its own, and the writes of a tiddler always go
+to the same one, chosen by its bag and title, so two POSTs of the same
+tiddler are written in the order they were accepted. The tiddlers of
+one POST may be shared among the workers, and are no longer all or
+nothing: a failure leaves the others stored. Queued writes are
+finished before the process exits.
+"""
+import atexit
+import json
+import logging
+import threading
+from collections import OrderedDict
+from Queue import Queue
+from uuid import uuid4
+
+from httpexceptor import HTTP404
+
+from tiddlyweb.web.util import get_route_value, server_base_url, tiddler_url
+
+from tiddlywebplugins.utils import get_store
+
+from tiddlywebplugins.form.exceptions import HTTP503
+
+
+LOGGER = logging.getLogger(__name__)
+
+DEFAULT_QUEUE_SIZE = 100
+DEFAULT_WORKERS = 2
+# how many finished writes to remember the status of
+STATUS_SIZE = 10000
+RETRY_AFTER = 1
+
+
+class Writer(object):
+    """
+    A bounded number of queued tiddler writes and the threads that do
+    them, each with its own queue and store.
+    """
+
+    def __init__(self, config, workers=DEFAULT_WORKERS,
+            queue_size=DEFAULT_QUEUE_SIZE):
+        self.config = config
+        self.queue_size = queue_size
+        self.queues = [Queue() for _ in range(max(workers, 1))]
+        # write id: [parts not yet written, first error]
+        self.pending = {}
+        self.statuses = OrderedDict()
+        self.lock = threading.Lock()
+        self.closed = False
+        self.threads = []
+        for index in range(workers):
+            thread = threading.Thread(target=self._work,
+                    args=(self.queues[index],), name='form-writer')
+            thread.daemon = True
+            thread.start()
+            self.threads.append(thread)
+
+    def submit(self, environ, tiddlers):
+        """
+        Queue tiddlers to be put by the current user and return the id
+        of the write. Raise HTTP503 if the queue is full.
+        """
+        if self.closed:
+            raise HTTP503('writes are shutting down', RETRY_AFTER)
+        write_id = uuid4().hex
+        parts = OrderedDict()
+        for tiddler in tiddlers:
+            parts.setdefault(self._queue_for(tiddler), []).append(tiddler)
+        usersign = environ['tiddlyweb.usersign']
+        with self.lock:
+            if len(self.pending) >= self.queue_size:
+                raise HTTP503('too many writes waiting, try again later',
+                        RETRY_AFTER)
+            self._set_status(write_id, {
+                'status': 'queued' if parts else 'done',
+                'tiddlers': [tiddler_url(environ, tiddler)
+                    for tiddler in tiddlers]})
+            if parts:
+                # Put under the lock, so that the writes of a tiddler
+                # are queued in the order their POSTs were accepted.
+                self.pending[write_id] = [len(parts), None]
+                for queue, part in parts.items():
+                    queue.put((write_id, usersign, part))
+        return write_id
+
+    def status(self, write_id):
+        """
+        Return a copy of the status of a write. Raise KeyError if it
+        is not known.
+        """
+        with self.lock:
+            return dict(self.statuses[write_id])
+
+    def flush(self):
+        """
+        Wait until every queued write is done.
+        """
+        for queue in self.queues:
+            queue.join()
+
+    def shutdown(self):
+        """
+        Finish the queued writes and stop the workers.
+        """
+        self.closed = True
+        for queue in self.queues[:len(self.threads)]:
+            queue.put(None)
+        for thread in self.threads:
+            thread.join()
+        self.threads = []
+
+    def _queue_for(self, tiddler):
+        return self.queues[hash((tiddler.bag, tiddler.title))
+                % len(self.queues)]
+
+    def _set_status(self, write_id, status):
+        self.statuses[write_id] = status
+        while len(self.statuses) > STATUS_SIZE:
+            self.statuses.popitem(last=False)
+
+    def _finish_part(self, write_id, error):
+        with self.lock:
+            pending = self.pending[write_id]
+            pending[0] -= 1
+            pending[1] = pending[1] or error
+            if pending[0]:
+                return
+            del self.pending[write_id]
+            if write_id in self.statuses:
+                if pending[1] is None:
+                    self.statuses[write_id].update(status='done')
+                else:
+                    self.statuses[write_id].update(status='failed',
+                            error=pending[1])
+
+    def _work(self, queue):
+        store = get_store(self.config)
+        while True:
+            job = queue.get()
+            try:
+                if job is None:
+                    return
+                self._write(store, *job)
+            finally:
+                queue.task_done()
+
+    def _write(self, store, write_id, usersign, tiddlers):
+        store.environ['tiddlyweb.usersign'] = usersign
+        error = None
+        try:
+            for tiddler in tiddlers:
+                store.put(tiddler)
+        except Exception as exc:
+            LOGGER.error('form write %s failed: %s', write_id, exc)
+            error = '%s' % exc
+        self._finish_part(write_id, error)
+
+
+_WRITER = None
+_WRITER_LOCK = threading.Lock()
+
+
+def get_writer(config):
+    """
+    Return the process's Writer, starting it on first use, so that
+    processes which never write (or fork before serving) start no
+    threads.
+    """
+    global _WRITER
+    with _WRITER_LOCK:
+        if _WRITER is None:
+            _WRITER = Writer(config,
+                    workers=int(config.get('form.write_workers',
+                        DEFAULT_WORKERS)),
+                    queue_size=int(config.get('form.write_queue_size',
+                        DEFAULT_QUEUE_SIZE)))
+        return _WRITER
+
+
+@atexit.register
+def shutdown():
+    """
+    Finish pending writes and stop the process's Writer, if started.
+    """
+    global _WRITER
+    with _WRITER_LOCK:
+        writer, _WRITER = _WRITER, None
+    if writer is not None:
+        writer.shutdown()
+
+
+def write_uri(environ, write_id):
+    return '%s/form/writes/%s' % (server_base_url(environ), write_id)
+
+
+def send_accepted(environ, start_response, write_id):
+    """
+    Respond to a POST whose writes have been queued.
+    """
+    start_response('202 Accepted', [
+        ('Location', write_uri(environ, write_id)),
+        ('Content-Type', 'application/json; charset=UTF-8')])
+    status = get_writer(environ['tiddlyweb.config']).status(write_id)
+    return [json.dumps(status)]
+
+
+def get_write(environ, start_response):
+    """
+    Report the status of a queued write.
+    """
+    write_id = get_route_value(environ, 'write_id')
+    try:
+        if _WRITER is None:
+            raise KeyError(write_id)
+        status = _WRITER.status(write_id)
+    except KeyError:
+        raise HTTP404('write %s not found' % write_id)
+    start_response('200 OK', [
+        ('Content-Type', 'application/json; charset=UTF-8'),
+        ('Cache-Control', 'no-cache')])
+    return [json.dumps(status)]